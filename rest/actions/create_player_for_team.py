@@ -3,7 +3,8 @@ def handler(
     new_data: dict,
     old_data: dict,
     well_known_urls: dict,
-    method: str = ""
+    method: str = "",
+    runtime=None
 ):
     req_data = {
       "name": str(new_data["name"]),
@@ -12,6 +13,8 @@ def handler(
       "is_active": True,
       "team": str(new_data["id"]),
     }
+    if runtime:
+        return runtime.create("players", req_data)
     import requests
     url=f"{well_known_urls['self']}players/"
     AUTH_HEADERS = {
@@ -20,3 +23,33 @@ def handler(
         "Content-Type": "application/json"
     }
     return requests.post(url=url, json=req_data, headers=AUTH_HEADERS).json()
+
+
+def batch_handler(
+    jwt: dict,
+    new_rows: list,
+    old_rows: list,
+    well_known_urls: dict,
+    method: str = "",
+    runtime=None
+):
+    req_data = [
+        {
+          "name": str(new_data["name"]),
+          "short_name": str(new_data["short_name"]),
+          "position": "staff",
+          "is_active": True,
+          "team": str(new_data["id"]),
+        }
+        for new_data in new_rows
+    ]
+    if runtime:
+        return runtime.create_many("players", req_data)
+    import requests
+    url=f"{well_known_urls['self']}players/add-players"
+    AUTH_HEADERS = {
+        "Authorization": f"Bearer {jwt}",
+        "accept": "application/json",
+        "Content-Type": "application/json"
+    }
+    return requests.post(url=url, json=req_data, headers=AUTH_HEADERS).json()
@@ -1,18 +1,74 @@
+import asyncio
 import importlib
 import os
 from dotenv import load_dotenv
 load_dotenv()
-import uvicorn
 from fastapi import FastAPI, Response
 from fastapi import Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
+from starlette.concurrency import run_in_threadpool
 
+from core import outbox, metrics, profiling, loop_monitor, replicas, events, rollups, triggers, changes
+from core import logger
+from core.crud_router import crud_router
+from core.notification import dispatcher
 from core.logger import log
+from core.server import MemoryLimitMiddleware
+from business import warm_pool, dispose_engine, pool_status
+from business.registry import ENTITIES
 
 app = FastAPI(title='new_version')
+ready = False
+
+
+async def warm_up():
+    """
+    open the db pool in the background, /ready answers 200 once it is done
+    """
+    global ready
+    loop = asyncio.get_event_loop()
+    while not ready:
+        try:
+            await loop.run_in_executor(None, warm_pool)
+            await loop.run_in_executor(None, changes.create_tables)
+            await loop.run_in_executor(None, rollups.create_tables)
+            ready = True
+            log.info("db pool warmed, ready to serve")
+        except Exception as e:
+            log.error("warming db pool failed, retrying")
+            log.debug(e)
+            await asyncio.sleep(2)
+
+
+@app.on_event("startup")
+async def start_workers():
+    triggers.check()
+    asyncio.ensure_future(warm_up())
+    if outbox.OUTBOX_ENABLED:
+        outbox.pool.start()
+    dispatcher.start()
+    if profiling.PROFILE_SAMPLER:
+        profiling.sampler.start()
+    if loop_monitor.LOOP_MONITOR:
+        loop_monitor.monitor.start()
+    replicas.health.start()
+    events.broker.start()
+
+
+@app.on_event("shutdown")
+async def stop_workers():
+    await outbox.pool.stop()
+    await dispatcher.stop()
+    await replicas.health.stop()
+    events.broker.stop()
+    dispose_engine()
+    profiling.sampler.stop()
+    await loop_monitor.monitor.stop()
+    if loop_monitor.monitor.strict:
+        loop_monitor.monitor.check()
 
 
 @app.get('/')
@@ -20,18 +76,50 @@ async def root():
     """Health check for API, anything except 200 means the API is not ready"""
     return {"message": "new_version API, generated by ZeKoder"}
 
-# load all routes dynamically
+
+@app.get('/ready')
+async def readiness():
+    """Readiness check, 503 until the db pool is warmed"""
+    if not ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"message": "warming up"})
+    return {"message": "ready"}
+
+
+@app.get('/metrics', include_in_schema=False)
+async def prometheus_metrics():
+    """Metrics of this worker process in the prometheus text format"""
+    return PlainTextResponse(await run_in_threadpool(metrics.render), media_type="text/plain; version=0.0.4")
+
+
+metrics.register(metrics.Gauges(f"{metrics.METRICS_PREFIX}_db_pool", "db connection pool of this worker", pool_status))
+metrics.register(metrics.Gauges(f"{metrics.METRICS_PREFIX}_notifications", "notification dispatcher", dispatcher.metrics))
+metrics.register(metrics.Gauges(f"{metrics.METRICS_PREFIX}_log", "log records not written", lambda: logger.stats))
+metrics.register(metrics.Gauges(f"{metrics.METRICS_PREFIX}_events", "live change events and subscribers", lambda: events.stats))
+if outbox.OUTBOX_ENABLED:
+    metrics.register(metrics.Gauges(f"{metrics.METRICS_PREFIX}_outbox", "outbox workers and backlog", outbox.metrics))
+
+# CRUD endpoints of every registered entity, routes are built with their final path and
+# appended as is since include_router would build every route a second time
+for entity in ENTITIES.values():
+    log.debug("building <%s> endpoints", entity.name)
+    try:
+        app.router.routes.extend(crud_router(entity, prefix=f"/{entity.name}").routes)
+    except Exception as e:
+        log.error("failed building <%s> endpoints", entity.name)
+        log.debug(e)
+
+# load hand written routes dynamically
 for module in os.listdir(f"{os.path.dirname(__file__)}/routes"):
     if module == '__init__.py' or module[-3:] != '.py':
         continue
     module_name = module[:-3]
-    log.debug(f"importing <{module_name}> endpoints")
+    log.debug("importing <%s> endpoints", module_name)
 
     try:
         pkg = importlib.import_module(f"routes.{module[:-3]}")
         app.include_router(pkg.router, prefix=f"/{module_name}")
     except Exception as e:
-        log.error(f"failed importing <{module_name}> endpoints")
+        log.error("failed importing <%s> endpoints", module_name)
         log.debug(e)
 
 
@@ -138,14 +226,24 @@ app.add_middleware(
     allow_methods=allow_methods,
     allow_headers=allow_headers,
 )
+app.add_middleware(MemoryLimitMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
 
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "api:app",
-        host="0.0.0.0",
-        port=int(os.environ.get('PORT', 5000)),
-        reload=bool(os.environ.get('UVICORN_RELOAD', True)),
-        debug=bool(os.environ.get('UVICORN_DEBUG', True)),
-        workers=int(os.environ.get('UVICORN_WORKERS', 1))
-    )
+    if os.environ.get('SERVER_MODE', 'development') == 'production':
+        from core import server
+        server.run(app)
+    else:
+        import uvicorn
+        reload = os.environ.get('UVICORN_RELOAD', 'false').lower() in ('1', 'true', 'yes')
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=int(os.environ.get('PORT', 5000)),
+            reload=reload,
+            debug=os.environ.get('UVICORN_DEBUG', 'false').lower() in ('1', 'true', 'yes'),
+            # uvicorn ignores workers when reloading
+            workers=1 if reload else int(os.environ.get('UVICORN_WORKERS', 1))
+        )
@@ -0,0 +1,72 @@
+"""
+run the api for benchmarks against a given database, or a sqlite stand-in when none is given:
+
+    python -m bench.app --port 8030 --database-url postgresql+psycopg2://...
+    python -m bench.app --port 8030 --sqlite /tmp/bench
+
+tables are created when missing. sqlite gets the public schema attached as a second database
+file and ARRAY columns stored as JSON, enough for the CRUD endpoints but not for postgres only
+features such as COPY
+"""
+import argparse
+import os
+import sqlite3
+import uuid
+
+
+def sqlite_engine(directory: str):
+    from sqlalchemy import ARRAY, create_engine, event
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.sql import functions
+
+    @compiles(ARRAY, 'sqlite')
+    def _array_as_json(element, compiler, **kw):
+        return 'JSON'
+
+    @compiles(functions.now, 'sqlite')
+    def _now_with_microseconds(element, compiler, **kw):
+        # CURRENT_TIMESTAMP has whole seconds, in a format that does not compare with bound datetimes
+        return "(STRFTIME('%Y-%m-%d %H:%M:%f', 'now') || '000')"
+
+    sqlite3.register_adapter(uuid.UUID, str)
+    os.makedirs(directory, exist_ok=True)
+    engine = create_engine(
+        f"sqlite:///{os.path.join(directory, 'main.db')}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    schema = os.environ.get('DEFAULT_SCHEMA', 'public')
+
+    @event.listens_for(engine, "connect")
+    def _connect(connection, record):
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute(f"ATTACH DATABASE '{os.path.join(directory, schema + '.db')}' AS {schema}")
+        connection.execute(f"PRAGMA {schema}.journal_mode=WAL")
+
+    return engine
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8030)
+    parser.add_argument("--database-url", help="sqlalchemy url, the sqlite stand-in is used when omitted")
+    parser.add_argument("--sqlite", default="/tmp/zekoder-bench", help="directory of the sqlite stand-in")
+    args = parser.parse_args()
+
+    import core.logger  # noqa: F401, configures logging before business is imported
+    import business
+    from sqlalchemy import create_engine
+    if args.database_url:
+        engine = create_engine(args.database_url, pool_size=business.DB_POOL_SIZE, max_overflow=business.DB_MAX_OVERFLOW)
+    else:
+        engine = sqlite_engine(args.sqlite)
+    business.set_engine(engine)
+    import api
+    business.Base.metadata.create_all(engine)
+
+    import uvicorn
+    uvicorn.run(api.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+local stand-in for zeauth /verify, every token is valid and gets every permission unless
+configured otherwise, point ZEAUTH_URI at it:
+
+    python -m bench.fake_zeauth --port 8026
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+PERMISSIONS = ["admin", "manager", "user"]
+
+
+class FakeZeauth(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, permissions: list = None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.permissions = permissions or PERMISSIONS
+        self.users = {}  # token -> user id, the same token always verifies as the same user
+        self.verify_calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def user(self, token: str) -> dict:
+        with self.lock:
+            self.verify_calls += 1
+            user_id = self.users.setdefault(token, str(uuid.uuid4()))
+        return {"id": user_id, "roles": [], "permissions": self.permissions}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        if url.path.rstrip("/") == "/verify":
+            token = parse_qs(url.query).get("token", [""])[0]
+            if not token:
+                return self._reply(401, {"detail": "missing token"})
+            return self._reply(200, self.server.user(token))
+        self._reply(404, {"detail": "not found"})
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, **kwargs) -> FakeZeauth:
+    """
+    start the stand-in on a background thread, port 0 picks a free port
+    """
+    server = FakeZeauth((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8026)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    FakeZeauth((args.host, args.port), latency=args.latency).serve_forever()
@@ -0,0 +1,86 @@
+"""
+local stand-in for zenotify and zenotify-service, point ZENOTIFY_BASE_URL and
+ZENOTIFY_SERVICE_BASE_URL at it:
+
+    python -m bench.fake_zenotify --port 8025
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeZenotify(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, fail_rate: int = 0):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_rate = fail_rate  # fail every nth create call, 0 never fails
+        self.notifications = {}
+        self.sent = []
+        self.create_calls = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if server.latency:
+            time.sleep(server.latency)
+        if self.path.rstrip("/") == "/notifications":
+            with server.lock:
+                server.create_calls += 1
+                failing = server.fail_rate and server.create_calls % server.fail_rate == 0
+                if not failing:
+                    notification_id = str(uuid.uuid4())
+                    server.notifications[notification_id] = body
+            if failing:
+                return self._reply(500, {"detail": "fake failure"})
+            return self._reply(201, {"id": notification_id, **body})
+        if self.path == "/send/email":
+            notification_id = body.get("notificationId")
+            if notification_id not in server.notifications:
+                return self._reply(404, {"detail": "notification not found"})
+            with server.lock:
+                server.sent.append(notification_id)
+            return self._reply(200, {"id": notification_id})
+        self._reply(404, {"detail": "not found"})
+
+
+def serve(host: str = "127.0.0.1", port: int = 0, **kwargs) -> FakeZenotify:
+    """
+    start the stand-in on a background thread, port 0 picks a free port
+    """
+    server = FakeZenotify((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    FakeZenotify((args.host, args.port), latency=args.latency).serve_forever()
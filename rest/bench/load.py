@@ -0,0 +1,288 @@
+"""
+offline load test of the CRUD api. starts fake zeauth and zenotify servers and the api (see
+bench/app.py), seeds teams, players and stadiums, then runs every scenario for --duration
+seconds at --concurrency and writes throughput and latency percentiles per endpoint as json:
+
+    python -m bench.load --seed 200 --concurrency 8 --duration 10 --output results.json
+    python -m bench.load --database-url postgresql+psycopg2://... --baseline results.json
+
+--baseline prints the change of every endpoint against an earlier results file
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+
+from bench import fake_zenotify, fake_zeauth
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+POSITIONS = ["goalkeeper", "defense", "Midfielder", "Forward", "staff"]
+
+
+def percentile(values: list, share: float) -> float:
+    """
+    nearest rank percentile of sorted values
+    """
+    if not values:
+        return 0.0
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+class Client:
+    def __init__(self, base_url: str, token: str):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = f"Bearer {token}"
+
+    def call(self, method: str, path: str, **kwargs):
+        return self.session.request(method, f"{self.base_url}{path}", timeout=60, **kwargs)
+
+
+def team(index=None):
+    suffix = index if index is not None else uuid.uuid4().hex[:8]
+    return {"name": f"team {suffix}", "location": "bench", "short_name": f"t{suffix}"}
+
+
+def player(team_id: str):
+    return {
+        "name": f"player {uuid.uuid4().hex[:8]}", "short_name": "p",
+        "position": random.choice(POSITIONS), "is_active": True, "team": team_id,
+    }
+
+
+def stadium():
+    return {"name": f"stadium {uuid.uuid4().hex}", "location": "bench", "capacity": random.randint(1000, 90000)}
+
+
+class State:
+    """
+    ids created by the seed, shared by the scenarios
+    """
+
+    def __init__(self):
+        self.teams, self.players, self.stadiums = [], [], []
+        self.deletable = []
+        self.lock = threading.Lock()
+
+    def take_deletable(self):
+        with self.lock:
+            return self.deletable.pop() if self.deletable else None
+
+
+def seed(client: Client, state: State, count: int, batch: int = 100):
+    for start in range(0, count, batch):
+        size = min(batch, count - start)
+        response = client.call("POST", "/teams/add-teams", json=[team(start + i) for i in range(size)])
+        response.raise_for_status()
+        state.teams += [row["id"] for row in response.json()]
+    for start in range(0, count, batch):
+        response = client.call("POST", "/players/add-players", json=[
+            player(random.choice(state.teams)) for _ in range(min(batch, count - start))
+        ])
+        response.raise_for_status()
+        state.players += [row["id"] for row in response.json()]
+    for start in range(0, count, batch):
+        response = client.call("POST", "/stadiums/add-stadiums", json=[stadium() for _ in range(min(batch, count - start))])
+        response.raise_for_status()
+        state.stadiums += [row["id"] for row in response.json()]
+
+
+def deletable_player(client: Client, state: State):
+    player_id = state.take_deletable()
+    if player_id is None:
+        # ran out of seeded rows, the row is created outside of the measured time
+        response = client.call("POST", "/players/", json=player(random.choice(state.teams)))
+        response.raise_for_status()
+        player_id = response.json()["id"]
+    return player_id
+
+
+# name -> (expected status, call, prepare). a call gets the client, the state, the bulk size and
+# what the optional prepare returned, prepare runs before every call and is not measured
+SCENARIOS = {
+    "list": (200, lambda c, s, n, _: c.call("GET", "/teams/", params={"page": random.randint(1, 5), "size": 20}), None),
+    "get": (200, lambda c, s, n, _: c.call("GET", "/players/player_id", params={"player_id": random.choice(s.players)}), None),
+    "q": (200, lambda c, s, n, _: c.call("POST", "/players/q", json={
+        "filter": {"position": {"$in": random.sample(POSITIONS, 2)}}, "limit": 20,
+    }), None),
+    "create": (201, lambda c, s, n, _: c.call("POST", "/stadiums/", json=stadium()), None),
+    "bulk_add": (201, lambda c, s, n, _: c.call("POST", "/players/add-players", json=[
+        player(random.choice(s.teams)) for _ in range(n)
+    ]), None),
+    "upsert": (201, lambda c, s, n, _: c.call("POST", "/teams/upsert-multiple-teams", json=[
+        {**team(), "id": random.choice(s.teams)} for _ in range(n // 2)
+    ] + [team() for _ in range(n - n // 2)]), None),
+    "delete": (204, lambda c, s, n, player_id: c.call("DELETE", "/players/player_id", params={"player_id": player_id}),
+               deletable_player),
+}
+
+
+def run_scenario(name: str, clients: list, state: State, duration: float, bulk: int) -> dict:
+    expected, call, prepare = SCENARIOS[name]
+    latencies, errors = [], []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker(client: Client):
+        own_latencies, own_errors = [], 0
+        while time.monotonic() < deadline:
+            try:
+                prepared = prepare(client, state) if prepare else None
+                started = time.perf_counter()
+                response = call(client, state, bulk, prepared)
+            except requests.RequestException:
+                own_errors += 1
+                continue
+            elapsed = time.perf_counter() - started
+            if response.status_code != expected:
+                own_errors += 1
+            else:
+                own_latencies.append(elapsed)
+        with lock:
+            latencies.extend(own_latencies)
+            errors.append(own_errors)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def start_api(args, zeauth_url: str, zenotify_url: str, sqlite_dir: str) -> subprocess.Popen:
+    command = [sys.executable, "-m", "bench.app", "--host", "127.0.0.1", "--port", str(args.port)]
+    command += ["--database-url", args.database_url] if args.database_url else ["--sqlite", sqlite_dir]
+    env = {
+        **os.environ,
+        "ZEAUTH_URI": zeauth_url,
+        "ZENOTIFY_BASE_URL": zenotify_url,
+        "ZENOTIFY_SERVICE_BASE_URL": zenotify_url,
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "ERROR"),
+    }
+    process = subprocess.Popen(command, cwd=HERE, env=env)
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("api exited before it was ready")
+        try:
+            if requests.get(f"{base_url}/ready", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("api was not ready after 60 seconds")
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\n{'endpoint':<10} {'rps':>18} {'p95 ms':>20} {'p99 ms':>20}")
+    for name, current in results["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(name)
+        if not old:
+            continue
+
+        def change(key):
+            before, after = old[key], current[key]
+            delta = (after - before) / before * 100 if before else 0.0
+            return f"{before:>7} -> {after:<7} {delta:+.0f}%"
+        print(f"{name:<10} {change('rps'):>18} {change('p95_ms'):>20} {change('p99_ms'):>20}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url", help="sqlalchemy url of a postgres/cockroachdb, sqlite stand-in when omitted")
+    parser.add_argument("--port", type=int, default=8030)
+    parser.add_argument("--seed", type=int, default=200, help="teams, players and stadiums to create first")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--bulk", type=int, default=20, help="rows per bulk add and upsert call")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma separated subset of " + ",".join(SCENARIOS))
+    parser.add_argument("--zeauth-latency", type=float, default=0.0, help="seconds added to every fake zeauth verify")
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="earlier results file to compare with")
+    args = parser.parse_args()
+    random.seed(args.random_seed)
+
+    zeauth = fake_zeauth.serve(latency=args.zeauth_latency)
+    zenotify = fake_zenotify.serve()
+    sqlite_dir = tempfile.mkdtemp(prefix="zekoder-bench-")
+    api = start_api(args, zeauth.url, zenotify.url, sqlite_dir)
+    try:
+        clients = [Client(f"http://127.0.0.1:{args.port}", "bench") for _ in range(args.concurrency)]
+        state = State()
+        started = time.monotonic()
+        seed(clients[0], state, args.seed)
+        state.deletable = list(state.players[len(state.players) // 2:])
+        state.players = state.players[:len(state.players) // 2]
+        print(f"seeded {args.seed} teams, players and stadiums in {time.monotonic() - started:.1f} s")
+
+        endpoints = {}
+        for name in args.scenarios.split(","):
+            endpoints[name] = run_scenario(name, clients, state, args.duration, args.bulk)
+            result = endpoints[name]
+            print(f"{name:<10} {result['rps']:>8} req/s  p50 {result['p50_ms']:>7} ms  p95 {result['p95_ms']:>7} ms  "
+                  f"p99 {result['p99_ms']:>7} ms  errors {result['errors']}")
+        results = {
+            "meta": {
+                "commit": commit(),
+                "at": datetime.utcnow().isoformat(),
+                "database": "sqlite" if not args.database_url else args.database_url.split("://")[0],
+                "seed": args.seed,
+                "concurrency": args.concurrency,
+                "duration": args.duration,
+                "bulk": args.bulk,
+                "zeauth_latency": args.zeauth_latency,
+                "python": platform.python_version(),
+                "zeauth_verify_calls": zeauth.verify_calls,
+            },
+            "endpoints": endpoints,
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+        if args.baseline:
+            with open(args.baseline) as f:
+                compare(results, json.load(f))
+    finally:
+        api.terminate()
+        api.wait(10)
+        zeauth.shutdown()
+        zenotify.shutdown()
+        shutil.rmtree(sqlite_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+report import time breakdown and time to first request of the api:
+
+    python -m bench.profile_startup --top 25
+    python -m bench.profile_startup --json startup.json
+
+every measurement runs in a fresh interpreter so nothing is already imported
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(api.app) as client:
+    booted = time.perf_counter()
+    status = client.get('/').status_code
+    answered = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "startup_seconds": booted - imported,
+    "first_request_seconds": answered - booted,
+    "time_to_first_request_seconds": answered - started,
+    "status": status,
+}))
+"""
+
+
+def import_times() -> list:
+    """
+    parse `python -X importtime` output into (module, self_us, cumulative_us, depth)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api"],
+        cwd=HERE, capture_output=True, text=True, env={**os.environ, "LOG_LEVEL": "ERROR"}
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        # importtime indents nested imports by two spaces after the separator's own space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        self_us, cumulative_us = int(own), int(cumulative)
+        rows.append((name.strip(), self_us, cumulative_us, depth))
+    return rows
+
+
+def first_request() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", "import json\n" + FIRST_REQUEST],
+        cwd=HERE, capture_output=True, text=True, env={**os.environ, "LOG_LEVEL": "ERROR"}
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=20, help="number of top level imports to show")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    rows = import_times()
+    api = next(row for row in rows if row[0] == "api")
+    # direct imports of api, i.e. what api.py pulls in and what it costs including children
+    top_level = sorted((row for row in rows if row[3] == 1), key=lambda row: row[2], reverse=True)
+    report = {
+        "api_import_us": api[2],
+        "api_self_us": api[1],
+        "top_level_imports": [{"module": name, "cumulative_us": cum, "self_us": own} for name, own, cum, _ in top_level[:args.top]],
+        "slowest_modules": [
+            {"module": name, "self_us": own}
+            for name, own, _, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:args.top]
+        ],
+        "first_request": first_request(),
+    }
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    print(f"api import: {report['api_import_us'] / 1000:.1f} ms (route building and module body {report['api_self_us'] / 1000:.1f} ms)")
+    print("\ntop level imports (cumulative):")
+    for row in report["top_level_imports"]:
+        print(f"  {row['cumulative_us'] / 1000:8.1f} ms  {row['module']}")
+    print("\nslowest modules (self):")
+    for row in report["slowest_modules"]:
+        print(f"  {row['self_us'] / 1000:8.1f} ms  {row['module']}")
+    timing = report["first_request"]
+    print(f"\nimport {timing['import_seconds'] * 1000:.1f} ms, startup {timing['startup_seconds'] * 1000:.1f} ms, "
+          f"first request {timing['first_request_seconds'] * 1000:.1f} ms, "
+          f"time to first request {timing['time_to_first_request_seconds'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
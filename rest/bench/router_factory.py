@@ -0,0 +1,86 @@
+"""
+measure startup time and memory of the CRUD router factory with many synthetic entities:
+
+    python -m bench.router_factory --entities 120
+"""
+import argparse
+import json
+import resource
+import time
+import tracemalloc
+import uuid
+import datetime
+from typing import Optional, Union
+
+from pydantic import BaseModel, create_model
+from sqlalchemy import Column, Text, Integer
+
+import core.logger  # noqa: F401, configures logging before business is imported
+from business import Base
+from business.registry import Entity
+from core.base_model import BaseModel as BaseDBModel
+from core.manager import Manager
+
+
+def synthetic_entity(index: int, fields: int) -> Entity:
+    plural, single = f"things{index}", f"thing{index}"
+    columns = {f"field_{n}": Column(Text if n % 2 else Integer) for n in range(fields)}
+    model = type(f"Thing{index}Model", (BaseDBModel,), {
+        "__tablename__": plural,
+        "__table_args__": {"schema": "bench", "extend_existing": True},
+        "objects": classmethod(lambda cls, session: Manager(cls, session)),
+        **columns,
+    })
+    values = {f"field_{n}": (Optional[str if n % 2 else int], None) for n in range(fields)}
+    create = create_model(f"CreateThing{index}", **values)
+    upsert = create_model(f"UpsertThing{index}", __base__=create, id=(Optional[uuid.UUID], None))
+    read = create_model(
+        f"ReadThing{index}", __base__=create,
+        id=(uuid.UUID, ...), created_on=(datetime.datetime, ...), updated_on=(datetime.datetime, ...)
+    )
+    read.Config.orm_mode = True
+    read_many = create_model(
+        f"ReadThing{index}s", data=(list[Optional[read]], ...), next_page=(Union[str, int], ...), page_size=(int, ...)
+    )
+    entity = Entity(plural, single, permissions={k: ["admin"] for k in ("list", "create", "get", "update", "del")})
+    entity._cache.update(model=model, create=create, upsert=upsert, read=read, read_many=read_many)
+    return entity
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entities", type=int, default=120)
+    parser.add_argument("--fields", type=int, default=8)
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+    from core.crud_router import crud_router
+
+    entities = [synthetic_entity(index, args.fields) for index in range(args.entities)]
+    started = time.perf_counter()
+    app = FastAPI()
+    for entity in entities:
+        app.router.routes.extend(crud_router(entity, prefix=f"/{entity.name}").routes)
+    elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    app.openapi()
+    openapi_elapsed = time.perf_counter() - started
+
+    # second pass under tracemalloc, it slows the build down so it is not timed
+    tracemalloc.start()
+    for entity in entities[:10]:
+        crud_router(entity, prefix=f"/{entity.name}")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(json.dumps({
+        "entities": args.entities,
+        "routes": len(app.routes),
+        "build_seconds": round(elapsed, 3),
+        "openapi_seconds": round(openapi_elapsed, 3),
+        "per_entity_kb": round(peak / 10 / 2 ** 10, 1),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+if __name__ == "__main__":
+    main()
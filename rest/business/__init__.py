@@ -1,12 +1,12 @@
 import os
+import threading
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from core.logger import log
 
-from mongosql import MongoSqlBase
-
-Base = declarative_base(cls=(MongoSqlBase,))
+# JSONQ runs MongoQuery on plain models, so mongosql is only imported by the first /q request
+Base = declarative_base()
 
 DB_USERNAME = os.environ.get('DB_USERNAME', 'demo')
 DB_PASSWORD = os.environ.get('DB_PASSWORD', 'demo29517')
@@ -15,6 +15,140 @@ DB_HOST = os.environ.get('DB_HOST', '127.0.0.1')
 DB_PORT = os.environ.get('DB_PORT', '26257')
 DB_DRIVER = os.environ.get('DB_DRIVER', 'postgresql+psycopg2')
 DB_QUERY_PARAMS = os.environ.get('DB_QUERY_PARAMS', 'sslmode=require&sslrootcert=/tmp/demo2408646734/ca.crt')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
 db_url = f'{DB_DRIVER}://{DB_USERNAME}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}?{DB_QUERY_PARAMS}'
-engine = create_engine(db_url)
-db_session = sessionmaker(bind=engine, autoflush=False)
+# comma separated sqlalchemy urls of read replicas, read only routes are spread over them
+DB_REPLICA_URLS = [url.strip() for url in os.environ.get('DB_REPLICA_URLS', '').split(',') if url.strip()]
+
+_engine = None
+_replicas = None
+# replica engine -> passed its last health check
+_replica_health = {}
+_next_replica = 0
+_replica_lock = threading.Lock()
+_session_factory = sessionmaker(autoflush=False)
+
+
+def get_engine():
+    """
+    create the engine on first use, so forked workers size and own their pool
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine(db_url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+        _session_factory.configure(bind=_engine)
+    return _engine
+
+
+def set_engine(engine):
+    global _engine
+    _engine = engine
+    _session_factory.configure(bind=engine)
+
+
+def get_replicas() -> list:
+    """
+    replica engines, created on first use like the primary one
+    """
+    global _replicas
+    if _replicas is None:
+        _replicas = [create_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW) for url in DB_REPLICA_URLS]
+        for replica in _replicas:
+            _replica_health[replica] = True
+    return _replicas
+
+
+def set_replicas(engines: list):
+    global _replicas
+    _replicas = list(engines)
+    _replica_health.clear()
+    for replica in _replicas:
+        _replica_health[replica] = True
+
+
+def set_replica_health(engine, healthy: bool):
+    if _replica_health.get(engine) != healthy:
+        log.warning("db replica <%s> is %s", engine.url.host or engine.url.database, "healthy again" if healthy else "unhealthy")
+    _replica_health[engine] = healthy
+
+
+def replica_session(**kwargs):
+    """
+    session on the next healthy replica, on the primary when there is none
+    """
+    global _next_replica
+    healthy = [replica for replica in get_replicas() if _replica_health.get(replica)]
+    if not healthy:
+        return db_session(**kwargs)
+    with _replica_lock:
+        _next_replica = (_next_replica + 1) % len(healthy)
+        replica = healthy[_next_replica]
+    return _session_factory(bind=replica, **kwargs)
+
+
+def configure_pool(pool_size: int, max_overflow: int):
+    """
+    size the pool of this process before its engine is created
+    """
+    global _engine, _replicas, DB_POOL_SIZE, DB_MAX_OVERFLOW
+    DB_POOL_SIZE, DB_MAX_OVERFLOW = pool_size, max_overflow
+    if _engine is not None:
+        # connections opened before fork belong to the parent, they must not be reused here
+        log.warning("db engine created before fork, discarding it")
+        _engine = None
+    if _replicas is not None:
+        _replicas = None
+        _replica_health.clear()
+
+
+def dispose_engine():
+    """
+    close every pooled connection, checked out connections are closed when returned
+    """
+    if _engine is not None:
+        _engine.dispose()
+    for replica in _replicas or []:
+        replica.dispose()
+
+
+def _pool_status(engine, prefix: str = "") -> dict:
+    status = {}
+    for key in ("size", "checkedout", "checkedin", "overflow"):
+        if hasattr(engine.pool, key):
+            status[f"{prefix}{key}"] = getattr(engine.pool, key)()
+    return status
+
+
+def pool_status() -> dict:
+    """
+    connections of this process' pools, replicas prefixed with replica_<n>_, empty until the engine is created
+    """
+    if _engine is None:
+        return {}
+    status = _pool_status(_engine)
+    for index, replica in enumerate(_replicas or []):
+        status.update(_pool_status(replica, f"replica_{index}_"))
+        status[f"replica_{index}_healthy"] = int(_replica_health.get(replica, False))
+    return status
+
+
+def warm_pool(size: int = None):
+    """
+    open pool connections ahead of the first requests
+    """
+    engine = get_engine()
+    connections = [engine.connect() for _ in range(size or DB_POOL_SIZE)]
+    for connection in connections:
+        connection.close()
+
+
+def db_session(**kwargs):
+    get_engine()
+    return _session_factory(**kwargs)
+
+
+def __getattr__(name):
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(name)
@@ -0,0 +1,94 @@
+import importlib
+
+from core import triggers
+
+
+def _load(path: str):
+    module_name, attr = path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), attr)
+
+
+class Entity:
+    """
+    in-process description of an entity, models and schemas are imported on first use.
+    by convention <plural> lives in business/<plural>_model.py and business/<plural>_schema.py
+    """
+
+    def __init__(self, name: str, single: str, permissions: dict, model: str = None, schema: str = None, validate=None):
+        self.name = name
+        self.single = single
+        self.permissions = permissions
+        self.validate_hook = validate
+        class_name = single.capitalize()
+        self._model = f"{model or f'business.{name}_model'}.{class_name}Model"
+        schema = schema or f"business.{name}_schema"
+        self._schemas = {
+            "create": f"{schema}.Create{class_name}",
+            "upsert": f"{schema}.Upsert{class_name}",
+            "read": f"{schema}.Read{class_name}",
+            "read_many": f"{schema}.Read{class_name}s",
+        }
+        self._cache = {}
+
+    def _get(self, key: str, path: str):
+        if key not in self._cache:
+            self._cache[key] = _load(path)
+        return self._cache[key]
+
+    @property
+    def model(self):
+        return self._get("model", self._model)
+
+    @property
+    def create_schema(self):
+        return self._get("create", self._schemas["create"])
+
+    @property
+    def upsert_schema(self):
+        return self._get("upsert", self._schemas["upsert"])
+
+    @property
+    def read_schema(self):
+        return self._get("read", self._schemas["read"])
+
+    @property
+    def read_many_schema(self):
+        return self._get("read_many", self._schemas["read_many"])
+
+    def validate(self, db, item, obj_id=None):
+        """
+        entity specific checks run before a row is written, raising HTTPException
+        """
+        if self.validate_hook:
+            self.validate_hook(self.model, db, item, obj_id)
+
+
+def _unique_name_location(model, db, item, obj_id=None):
+    model.validate_unique_name_location(db, item.name, item.location, obj_id)
+
+
+# entity specific checks, by plural
+VALIDATORS = {
+    "stadiums": _unique_name_location,
+}
+
+
+def _entities(spec: dict) -> dict:
+    """
+    an Entity per data.yaml entity, routes and actions check the permissions declared there
+    """
+    return {
+        entity["plural"]: Entity(
+            entity["plural"], single,
+            permissions=entity.get("permissions") or {},
+            validate=VALIDATORS.get(entity["plural"]),
+        )
+        for single, entity in spec.items()
+    }
+
+
+ENTITIES = _entities(triggers.data_yaml())
+
+
+def get_entity(name: str):
+    return ENTITIES.get(name)
@@ -1,9 +1,4 @@
 import os
-import importlib
-
-from actions import create_player_for_team
-
-
 import enum
 from sqlalchemy import DATETIME, String, ForeignKey
 from sqlalchemy import String, ForeignKey, Column, Text
@@ -12,19 +7,6 @@ from core.base_model import BaseModel
 from core.manager import Manager
 from fastapi import HTTPException
 
-class CustomManager(Manager):
-
-    def post_save(self, **kwargs) -> dict:
-        jwt = kwargs.get("jwt", {})
-        new_data = kwargs.get("new_data", {})
-        old_data = kwargs.get("old_data", {})
-        well_known_urls = kwargs.get("well_known_urls", {})
-        new_data = create_player_for_team.handler(jwt=jwt, new_data=new_data, old_data=old_data, well_known_urls=well_known_urls, method="create")
-        return new_data
-
-
-
-
 
 
 # select enums
@@ -51,5 +33,5 @@ class TeamModel(BaseModel):
     
     @classmethod
     def objects(cls, session):
-        return CustomManager(cls, session)
+        return Manager(cls, session)
 
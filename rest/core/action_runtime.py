@@ -0,0 +1,124 @@
+import os
+
+import requests
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from core import loader
+from core.depends import has_permission
+from core.logger import log
+
+# "local" runs actions against in-process managers, "http" keeps calling the API over the network
+ACTION_RUNTIME = os.environ.get('ACTION_RUNTIME', 'local')
+
+
+class ActionRuntime:
+    """
+    gives actions access to other entities' managers within the caller's session and transaction,
+    entities not served by this process are reached over HTTP once the transaction is committed
+    """
+
+    def __init__(self, db: Session, jwt: str = None, well_known_urls: dict = None):
+        self.db = db
+        self.jwt = jwt
+        self.well_known_urls = well_known_urls or {}
+        self._deferred = []
+
+    def _entity(self, name: str):
+        if ACTION_RUNTIME != 'local':
+            return None
+        from business.registry import get_entity
+        return get_entity(name)
+
+    def _signal_data(self, new_data: dict, old_data: dict = None) -> dict:
+        return {
+            "jwt": self.jwt,
+            "new_data": new_data,
+            "old_data": old_data or {},
+            "well_known_urls": self.well_known_urls,
+            "runtime": self,
+        }
+
+    @staticmethod
+    def _authorize(entity, method: str):
+        if not has_permission(entity.permissions.get(method, [])):
+            raise HTTPException(403, "user not authorized to do this action")
+
+    def create(self, entity_name: str, data: dict):
+        entity = self._entity(entity_name)
+        if not entity:
+            return self.remote("POST", f"{entity_name}/", json=data)
+        self._authorize(entity, "create")
+        try:
+            item = entity.create_schema(**data)
+        except ValidationError as e:
+            raise HTTPException(422, str(e))
+        entity.validate(self.db, item)
+        new_data = item.dict()
+        # the write path of bulk creates, it keeps rollups and live events in step and leaves the commit to the caller
+        objs = entity.model.objects(self.db).create_many([new_data], commit=False, signal_data=self._signal_data(new_data))
+        return objs[0]
+
+    def create_many(self, entity_name: str, items: list):
+        entity = self._entity(entity_name)
+        if not entity:
+            return self.remote("POST", f"{entity_name}/add-{entity_name}", json=items)
+        self._authorize(entity, "create")
+        try:
+            items = [entity.create_schema(**data) for data in items]
+        except ValidationError as e:
+            raise HTTPException(422, str(e))
+        for item in items:
+            entity.validate(self.db, item)
+        new_items = [item.dict() for item in items]
+        return entity.model.objects(self.db).create_many(new_items, commit=False, signal_data=self._signal_data({}))
+
+    def get(self, entity_name: str, obj_id: str):
+        entity = self._entity(entity_name)
+        if not entity:
+            path = f"{entity_name}/{entity_name[:-1]}_id"
+            return self.remote("GET", path, defer=False, params={f"{entity_name[:-1]}_id": obj_id}).json()
+        self._authorize(entity, "get")
+        return loader.of(self.db).load(entity.model, obj_id)
+
+    def get_many(self, entity_name: str, obj_ids: list) -> list:
+        """
+        rows by id in the order given, fetched together; remote entities answer one by one
+        """
+        entity = self._entity(entity_name)
+        if not entity:
+            return [self.get(entity_name, obj_id) for obj_id in obj_ids]
+        self._authorize(entity, "get")
+        return loader.of(self.db).load_many(entity.model, obj_ids)
+
+    def prime(self, entity_name: str, obj_ids: list):
+        """
+        queue ids so the next get or get_many of the entity fetches them in the same query
+        """
+        entity = self._entity(entity_name)
+        if entity:
+            loader.of(self.db).prime(entity.model, obj_ids)
+
+    def remote(self, method: str, path: str, service: str = "self", defer: bool = True, **kwargs):
+        """
+        call another service with the user's jwt, writes are queued until the caller commits
+        so the remote side can see them
+        """
+        url = f"{self.well_known_urls[service]}{path}"
+        headers = {
+            "Authorization": f"Bearer {self.jwt}",
+            "accept": "application/json",
+            "Content-Type": "application/json"
+        }
+        if not defer:
+            return requests.request(method, url, headers=headers, **kwargs)
+        self._deferred.append(lambda: requests.request(method, url, headers=headers, **kwargs))
+
+    def run_deferred(self):
+        deferred, self._deferred = self._deferred, []
+        for call in deferred:
+            try:
+                call()
+            except Exception as e:
+                log.debug(e)
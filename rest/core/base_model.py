@@ -1,16 +1,32 @@
 import uuid
-from datetime import datetime
 
 from business import Base
+from core import rollups
 from core.depends import current_user_uuid
-from sqlalchemy import Column, String, DATETIME
+from sqlalchemy import Column, String, DATETIME, Index, event, func
 
 
 class BaseModel(Base):
     __abstract__ = True
+    # read database generated timestamps back in the INSERT/UPDATE itself where RETURNING is available
+    __mapper_args__ = {"eager_defaults": True}
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     created_by = Column(String, default=current_user_uuid)
     updated_by = Column(String, default=current_user_uuid, onupdate=current_user_uuid)
-    created_on = Column(DATETIME, default=datetime.now())
-    updated_on = Column(DATETIME, default=datetime.now(), onupdate=datetime.now())
+    created_on = Column(DATETIME, default=func.now(), server_default=func.now())
+    updated_on = Column(DATETIME, default=func.now(), server_default=func.now(), onupdate=func.now())
+
+
+@event.listens_for(BaseModel, "instrument_class", propagate=True)
+def _changes_index(mapper, cls):
+    """
+    (updated_on, id) index of every entity table, the order of the change feed
+    """
+    table = cls.__table__
+    Index(f"ix_{table.name}_updated_on_id", table.c.updated_on, table.c.id)
+
+
+@event.listens_for(BaseModel, "instrument_class", propagate=True)
+def _rollups(mapper, cls):
+    rollups.declare(cls)
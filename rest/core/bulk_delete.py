@@ -0,0 +1,114 @@
+"""
+bulk delete by ids or by JSONQ filter. a request deletes chunk after chunk for up to
+DELETE_TIME_BUDGET seconds, whatever is left, or any set above DELETE_JOB_THRESHOLD ids and every
+filter delete, continues in a background job whose progress is kept in memory by the worker that
+accepted it
+"""
+import contextvars
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, List
+
+from pydantic import BaseModel
+
+from business import db_session
+from core.logger import log
+from core.manager import DELETE_CHUNK_SIZE
+from core.query import mongosql
+
+DELETE_TIME_BUDGET = float(os.environ.get('DELETE_TIME_BUDGET', 5))
+DELETE_JOB_THRESHOLD = int(os.environ.get('DELETE_JOB_THRESHOLD', 10000))
+DELETE_JOB_KEEP = int(os.environ.get('DELETE_JOB_KEEP', 100))
+
+
+class DeleteRequest(BaseModel):
+    ids: Optional[List[str]]
+    filter: Optional[dict]
+
+
+def matching_ids(db, model, query_filter: dict, limit: int) -> list:
+    """
+    ids of the first `limit` rows matching a JSONQ filter
+    """
+    query = mongosql().MongoQuery(model).with_session(db).query(filter=query_filter, project=["id"]).end()
+    return [row.id for row in query.limit(limit)]
+
+
+class DeleteJob:
+    def __init__(self, entity, signal_data: dict, ids: list = None, query_filter: dict = None):
+        self.id = str(uuid.uuid4())
+        self.entity = entity
+        self.signal_data = {key: value for key, value in signal_data.items() if key != "runtime"}
+        self.ids = ids
+        self.filter = query_filter
+        self.status = "pending"
+        self.total = len(ids) if ids is not None else None
+        self.deleted = 0
+        self.error = None
+        self.created_on = time.time()
+        self.finished_on = None
+
+    def info(self) -> dict:
+        return {
+            "id": self.id,
+            "entity": self.entity.name,
+            "status": self.status,
+            "total": self.total,
+            "deleted": self.deleted,
+            "error": self.error,
+            "created_on": self.created_on,
+            "finished_on": self.finished_on,
+        }
+
+    def run(self):
+        self.status = "running"
+        db = db_session()
+        try:
+            manager = self.entity.model.objects(db)
+            signal_data = dict(self.signal_data)
+            if self.ids is not None:
+                self.deleted += manager.delete_multiple(self.ids, signal_data=signal_data)["deleted"]
+            else:
+                while True:
+                    ids = matching_ids(db, self.entity.model, self.filter, DELETE_CHUNK_SIZE)
+                    if not ids:
+                        break
+                    # pre_delete may cancel, the rows then still match and would be found again
+                    deleted = manager.delete_multiple(ids, signal_data=signal_data)["deleted"]
+                    if not deleted:
+                        break
+                    self.deleted += deleted
+            self.status = "done"
+        except Exception as e:
+            log.error("delete job <%s> of <%s> failed", self.id, self.entity.name)
+            log.debug(e)
+            db.rollback()
+            self.status, self.error = "failed", str(e)
+        finally:
+            db.close()
+            self.finished_on = time.time()
+
+
+_jobs = OrderedDict()
+_lock = threading.Lock()
+
+
+def start(job: DeleteJob) -> DeleteJob:
+    """
+    run a job in a thread, carrying over the user of the request for triggers and row policies
+    """
+    with _lock:
+        _jobs[job.id] = job
+        finished = [job_id for job_id, known in _jobs.items() if known.finished_on]
+        for job_id in finished[:max(len(_jobs) - DELETE_JOB_KEEP, 0)]:
+            del _jobs[job_id]
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(job.run,), name=f"delete-{job.id[:8]}", daemon=True).start()
+    return job
+
+
+def get(job_id: str) -> Optional[DeleteJob]:
+    return _jobs.get(job_id)
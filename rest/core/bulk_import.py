@@ -0,0 +1,303 @@
+"""
+COPY based bulk import for initial loads and migrations. the upload (csv with a header line, or
+NDJSON) is validated row by row with the upsert schema of the entity while it is received, valid
+rows are streamed through `COPY ... FROM STDIN` into a staging table of text columns and merged
+into the entity table by a single INSERT ... SELECT casting every column to its type, enums,
+json and arrays included. rows whose id already exists are skipped, or replaced in upsert mode.
+
+rows failing validation are written with their errors to <IMPORT_DIR>/<import id>.rejects.ndjson.
+entity checks and hooks are not run, rows are written as given and the rollups of the entity are
+rebuilt
+"""
+import codecs
+import csv
+import datetime
+import enum
+import io
+import json
+import os
+import queue
+import threading
+import uuid
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import ARRAY, JSON, text
+from sqlalchemy.exc import DBAPIError
+
+from core.depends import current_user_uuid
+from core.encryptStr import resolve_pending
+from core import rollups
+from core.ingest import validation_errors
+from core.logger import log
+from core.slow_queries import origin
+
+IMPORT_DIR = os.environ.get('IMPORT_DIR', '/tmp/imports')
+IMPORT_BATCH = int(os.environ.get('IMPORT_BATCH', 1000))
+# chunks of the upload held between the request and the import thread
+IMPORT_BUFFER = int(os.environ.get('IMPORT_BUFFER', 64))
+COPY_DIALECTS = ("postgresql", "cockroachdb")
+FORMATS = ("csv", "ndjson")
+MODES = ("insert", "upsert")
+AUDIT_COLUMNS = ("created_by", "updated_by", "created_on", "updated_on")
+
+
+def supported(db) -> bool:
+    return db.get_bind().dialect.name in COPY_DIALECTS
+
+
+def rejects_file(import_id: str):
+    """
+    path of the rejects of an import, None for unknown ids
+    """
+    try:
+        uuid.UUID(import_id)
+    except ValueError:
+        return None
+    path = os.path.join(IMPORT_DIR, f"{import_id}.rejects.ndjson")
+    return path if os.path.exists(path) else None
+
+
+def _pg_array(values: list) -> str:
+    items = []
+    for value in values:
+        if value is None:
+            items.append("NULL")
+        else:
+            items.append('"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"')
+    return "{" + ",".join(items) + "}"
+
+
+def _cell(value) -> str:
+    """
+    csv cell of COPY, strings are always quoted so an empty cell is null and "" an empty string
+    """
+    if value is None:
+        return ""
+    return '"' + value.replace('"', '""') + '"'
+
+
+class Upload:
+    """
+    the request body, put by the event loop and read as text lines by the import thread
+    """
+
+    def __init__(self, size: int = IMPORT_BUFFER):
+        self.chunks = queue.Queue(size)
+        self.closed = threading.Event()
+
+    def put(self, chunk) -> bool:
+        """
+        hand over a chunk, None ends the upload. False once the import stopped reading
+        """
+        while not self.closed.is_set():
+            try:
+                self.chunks.put(chunk, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def lines(self):
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        pending = ""
+        while True:
+            chunk = self.chunks.get()
+            if chunk is None:
+                break
+            pending += decoder.decode(chunk)
+            *complete, pending = pending.split("\n")
+            for line in complete:
+                yield line + "\n"
+        pending += decoder.decode(b"", final=True)
+        if pending:
+            yield pending
+
+
+class _Reader:
+    """
+    file like view of the encoded staging rows, read by copy_expert
+    """
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self.pending = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.pending) < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.pending += block
+        if size < 0:
+            data, self.pending = self.pending, b""
+        else:
+            data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+class Import:
+    def __init__(self, entity, db, fmt: str = "csv", mode: str = "insert", batch: int = IMPORT_BATCH):
+        self.id = str(uuid.uuid4())
+        self.entity = entity
+        self.db = db
+        self.format = fmt
+        self.mode = mode
+        self.batch = max(batch, 1)
+        self.upload = Upload()
+        self.user = current_user_uuid()
+        self.schema = entity.upsert_schema
+        self.table = entity.model.__table__
+        fields = self.schema.__fields__
+        self.columns = [column for column in self.table.columns if column.name in fields or column.name == "id"]
+        self.json_columns = {column.name for column in self.columns if isinstance(column.type, JSON)}
+        self.array_columns = {column.name for column in self.columns if isinstance(column.type, ARRAY)}
+        self.defaults = {
+            column.name: column.default.arg for column in self.columns
+            if column.default is not None and column.default.is_scalar and column.default.arg is not None
+        }
+        self.counts = {"lines": 0, "staged": 0, "rejected": 0, "written": 0}
+        self._rejects = None
+
+    def _records(self):
+        """
+        (line number, dict or raw line) of the upload
+        """
+        lines = self.upload.lines()
+        if self.format == "csv":
+            reader = csv.DictReader(lines)
+            for record in reader:
+                yield reader.line_num, record
+        else:
+            for number, line in enumerate(lines, 1):
+                if line.strip():
+                    yield number, line
+
+    def _decode(self, record: dict) -> dict:
+        """
+        csv cells are text, json and array columns hold json, empty cells are null
+        """
+        if None in record:
+            raise ValueError("more values than columns")
+        data = {}
+        for key, value in record.items():
+            if value is None or value == "":
+                continue
+            data[key] = json.loads(value) if key in self.json_columns or key in self.array_columns else value
+        return data
+
+    def _row(self, raw) -> dict:
+        data = json.loads(raw) if isinstance(raw, str) else self._decode(raw)
+        item = self.schema.parse_obj(data)
+        row = item.dict()
+        for name, value in self.defaults.items():
+            if name not in item.__fields_set__:
+                row[name] = value
+        row["id"] = str(row.get("id") or uuid.uuid4())
+        return row
+
+    def _text(self, name: str, value):
+        if value is None:
+            return None
+        if isinstance(value, enum.Enum):
+            return value.name
+        if name in self.json_columns:
+            return json.dumps(value, default=str)
+        if name in self.array_columns:
+            return _pg_array(value)
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return str(value)
+
+    def _reject(self, number: int, raw, errors: list):
+        self.counts["rejected"] += 1
+        if self._rejects is None:
+            os.makedirs(IMPORT_DIR, exist_ok=True)
+            self._rejects = open(os.path.join(IMPORT_DIR, f"{self.id}.rejects.ndjson"), "w")
+        self._rejects.write(json.dumps({"line": number, "record": raw, "errors": errors}, default=str) + "\n")
+
+    def _encode(self, rows: list) -> bytes:
+        resolve_pending(*[row for _, row in rows])
+        out = io.StringIO()
+        for number, row in rows:
+            cells = [_cell(self._text(column.name, row.get(column.name))) for column in self.columns]
+            out.write(f"{number},{','.join(cells)}\n")
+        self.counts["staged"] += len(rows)
+        return out.getvalue().encode()
+
+    def _blocks(self):
+        rows = []
+        for number, raw in self._records():
+            self.counts["lines"] += 1
+            try:
+                rows.append((number, self._row(raw)))
+            except ValidationError as e:
+                self._reject(number, raw, validation_errors(e))
+            except ValueError as e:
+                self._reject(number, raw, [{"field_name": None, "message": f"invalid value: {e}"}])
+            if len(rows) >= self.batch:
+                yield self._encode(rows)
+                rows = []
+        if rows:
+            yield self._encode(rows)
+
+    def _statements(self, staging: str):
+        dialect = self.db.get_bind().dialect
+        quote = dialect.identifier_preparer.quote
+        target = dialect.identifier_preparer.format_table(self.table)
+        names = [quote(column.name) for column in self.columns]
+        create = f"CREATE TABLE {staging} (_line BIGINT, {', '.join(f'{name} TEXT' for name in names)})"
+        copy = f"COPY {staging} (_line, {', '.join(names)}) FROM STDIN WITH CSV"
+        casts = [f"CAST(s.{name} AS {dialect.type_compiler.process(column.type)})" for name, column in zip(names, self.columns)]
+        audit = [quote(name) for name in AUDIT_COLUMNS]
+        merge = (
+            f"INSERT INTO {target} ({', '.join(names + audit)}) "
+            f"SELECT DISTINCT ON (s.id) {', '.join(casts)}, :user, :user, LOCALTIMESTAMP, LOCALTIMESTAMP "
+            f"FROM {staging} AS s ORDER BY s.id, s._line DESC "
+        )
+        if self.mode == "upsert":
+            updates = [name for name in names + audit if name not in (quote("id"), quote("created_by"), quote("created_on"))]
+            merge += f"ON CONFLICT (id) DO UPDATE SET {', '.join(f'{name} = EXCLUDED.{name}' for name in updates)}"
+        else:
+            merge += "ON CONFLICT (id) DO NOTHING"
+        return create, copy, merge
+
+    def run(self) -> dict:
+        """
+        load the whole upload in one transaction, runs in a worker thread
+        """
+        schema = self.table.schema
+        staging = f"{schema}.import_{uuid.UUID(self.id).hex}" if schema else f"import_{uuid.UUID(self.id).hex}"
+        create, copy, merge = self._statements(staging)
+        try:
+            with origin(f"import {self.table.name}"):
+                self.entity.model.objects(self.db)
+                self.db.execute(text(create))
+                cursor = self.db.connection().connection.cursor()
+                try:
+                    cursor.copy_expert(copy, _Reader(self._blocks()))
+                finally:
+                    cursor.close()
+                self.counts["written"] = self.db.execute(text(merge), {"user": self.user}).rowcount
+                self.db.execute(text(f"DROP TABLE {staging}"))
+                rollups.rebuild(self.db, self.entity.model)
+                self.db.commit()
+        except DBAPIError as e:
+            log.debug(e)
+            self.db.rollback()
+            raise HTTPException(422, str(getattr(e.orig, "pgerror", None) or e.orig).strip())
+        except Exception:
+            self.db.rollback()
+            raise
+        finally:
+            self.upload.closed.set()
+            if self._rejects is not None:
+                self._rejects.close()
+        log.info("import <%s> of <%s>: %s", self.id, self.entity.name, self.counts)
+        return {
+            "id": self.id,
+            "entity": self.entity.name,
+            "mode": self.mode,
+            **self.counts,
+            "rejects": f"/admin/imports/{self.id}/rejects" if self.counts["rejected"] else None,
+        }
@@ -0,0 +1,151 @@
+"""
+change feed of an entity. rows are read in (updated_on, id) order from a cursor, deletes are kept
+as tombstones written in the same transaction as the delete.
+
+the tombstones table is created while the app warms up, while it is missing deletes are left out of
+the feed.
+
+updated_on is the transaction time of the write, so a transaction committing late may carry a
+time older than rows already handed out. the feed only returns changes older than
+CHANGES_SETTLE_SECONDS, writes taking longer than that to commit can be missed
+"""
+import base64
+import os
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Column, String, DATETIME, Index, func, literal, select, tuple_
+
+from business import Base, db_session
+from core.depends import current_user_uuid
+from core.logger import log
+
+CHANGES_SETTLE_SECONDS = float(os.environ.get('CHANGES_SETTLE_SECONDS', 5))
+CHANGES_PAGE_SIZE = int(os.environ.get('CHANGES_PAGE_SIZE', 100))
+CHANGES_MAX_PAGE_SIZE = int(os.environ.get('CHANGES_MAX_PAGE_SIZE', 1000))
+
+# whether the tombstones table exists, asked once until create_tables runs
+_tombstones = None
+
+
+class TombstoneModel(Base):
+    __tablename__ = 'tombstones'
+    __table_args__ = (
+        Index("ix_tombstones_entity_deleted_on_row_id", "entity", "deleted_on", "row_id"),
+        {'schema': 'public'},
+    )
+
+    entity = Column(String, primary_key=True)
+    row_id = Column(String, primary_key=True)
+    deleted_on = Column(DATETIME, primary_key=True, default=func.now(), server_default=func.now())
+    deleted_by = Column(String, default=current_user_uuid)
+
+
+def _table_exists(db) -> bool:
+    connection = db.connection()
+    table = TombstoneModel.__table__
+    return connection.dialect.has_table(connection, table.name, schema=table.schema)
+
+
+def tombstones_enabled(db) -> bool:
+    global _tombstones
+    if _tombstones is None:
+        _tombstones = _table_exists(db)
+        if not _tombstones:
+            log.warning("tombstones table is missing, deletes are left out of change feeds until it is created")
+    return _tombstones
+
+
+def create_tables():
+    """
+    create the tombstones table when it is missing, runs while the app warms up
+    """
+    global _tombstones
+    db = db_session()
+    try:
+        TombstoneModel.__table__.create(db.connection(), checkfirst=True)
+        db.commit()
+        _tombstones = True
+    except Exception as e:
+        db.rollback()
+        log.debug(e)
+        # another worker may have created it meanwhile
+        _tombstones = _table_exists(db)
+        if not _tombstones:
+            log.error("can not create the tombstones table, deletes are left out of change feeds")
+    finally:
+        db.close()
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(at: datetime, row_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{at.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        at, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+        return datetime.fromisoformat(at), row_id
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"<{cursor}> is not a valid cursor") from e
+
+
+def record_deletes(db, model, criterion):
+    """
+    add tombstones for the rows matching `criterion`, to be called right before deleting them
+    """
+    if not tombstones_enabled(db):
+        return
+    rows = select([literal(model.__tablename__), model.id, literal(current_user_uuid()), func.now()]).where(criterion)
+    table = TombstoneModel.__table__
+    db.execute(table.insert().from_select([table.c.entity, table.c.row_id, table.c.deleted_by, table.c.deleted_on], rows))
+
+
+def changes(db, model, read_schema, since: str = None, limit: int = CHANGES_PAGE_SIZE) -> dict:
+    """
+    up to `limit` changes after the cursor `since`, oldest first, with the cursor to continue from
+    """
+    limit = max(min(limit, CHANGES_MAX_PAGE_SIZE), 1)
+    horizon = db.query(func.now()).scalar()
+    if isinstance(horizon, str):
+        horizon = datetime.fromisoformat(horizon)
+    # timestamps are stored without time zone, as the wall clock time of the database session
+    horizon = horizon.replace(tzinfo=None) - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+
+    rows = db.query(model).filter(model.updated_on < horizon)
+    tombstones = db.query(TombstoneModel).filter(
+        TombstoneModel.entity == model.__tablename__, TombstoneModel.deleted_on < horizon
+    )
+    if since:
+        at, row_id = decode_cursor(since)
+        rows = rows.filter(tuple_(model.updated_on, model.id) > tuple_(at, row_id))
+        tombstones = tombstones.filter(tuple_(TombstoneModel.deleted_on, TombstoneModel.row_id) > tuple_(at, row_id))
+    rows = rows.order_by(model.updated_on, model.id).limit(limit + 1).all()
+    if tombstones_enabled(db):
+        tombstones = tombstones.order_by(TombstoneModel.deleted_on, TombstoneModel.row_id).limit(limit + 1).all()
+    else:
+        tombstones = []
+
+    merged = sorted(
+        [(row.updated_on, row.id, row) for row in rows] + [(tomb.deleted_on, tomb.row_id, tomb) for tomb in tombstones],
+        key=lambda change: (change[0], change[1]),
+    )
+    page = merged[:limit]
+    data = []
+    for at, row_id, change in page:
+        if isinstance(change, TombstoneModel):
+            data.append({"op": "delete", "id": row_id, "at": at, "by": change.deleted_by})
+        else:
+            data.append({
+                "op": "create" if change.created_on == change.updated_on else "update",
+                "id": row_id, "at": at, "by": change.updated_by,
+                "data": jsonable_encoder(read_schema.from_orm(change)),
+            })
+    return {
+        "data": data,
+        "next": encode_cursor(*page[-1][:2]) if page else since,
+        "has_more": len(merged) > limit,
+    }
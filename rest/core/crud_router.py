@@ -0,0 +1,412 @@
+import json
+from typing import Union, List
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Query as QueryParam
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.status import HTTP_204_NO_CONTENT
+
+from core.depends import CommonDependencies, get_db, get_read_db, Protect, ReadProtect, zeauth_url, current_user_uuid, current_user_roles
+from core import bulk_delete, changes, events, loader, rollups
+from core.etag import weak_etag, conditional_response
+from core.export import Export
+from core.ingest import Ingestion, DuplexStreamingResponse
+from core.logger import log
+from core.manager import row_data
+from core.query import QuerySchema, JSONQ, UnkownOperator, ColumnNotFound
+
+
+def signal_data(request: Request, token: Protect, new_data: dict = None, old_data: dict = None) -> dict:
+    return {
+        "jwt": token.credentials,
+        "new_data": new_data if new_data is not None else {},
+        "old_data": old_data or {},
+        "well_known_urls": {"zeauth": zeauth_url, "self": str(request.base_url)}
+    }
+
+
+def crud_router(entity, prefix: str = "") -> APIRouter:
+    """
+    build list/get/q/create/bulk/upsert/update/delete endpoints of a registry entity
+    """
+    router = APIRouter(prefix=prefix)
+    plural, single = entity.name, entity.single
+    Model = entity.model
+    CreateSchema, UpsertSchema = entity.create_schema, entity.upsert_schema
+    ReadSchema, ReadManySchema = entity.read_schema, entity.read_many_schema
+    permissions = entity.permissions
+    id_param = f"{single}_id"
+    tags = [plural]
+
+    def not_found(obj_id):
+        return HTTPException(status_code=404, detail={
+            "field_name": id_param,
+            "message": f"<{obj_id}> record not found in {plural}"
+        })
+
+    # list
+    @router.get('/', tags=tags, status_code=200, response_model=ReadManySchema)
+    async def list(request: Request, response: Response, token: str = Depends(ReadProtect), db: Session = Depends(get_read_db), commons: CommonDependencies = Depends(CommonDependencies)):
+        token.auth(permissions["list"])
+        try:
+            manager = Model.objects(db)
+            # relationships embedded in the response, their rows are part of the etag
+            relations = loader.relation_names(Model, ReadSchema)
+            version = manager.aggregate_version(relations=relations)
+            if version is not None:
+                etag = weak_etag(*version, commons.page, commons.size, current_user_uuid())
+                not_modified = conditional_response(request, response, etag, f'{plural}_list')
+                if not_modified:
+                    return not_modified
+            r = manager.all(offset=commons.offset, limit=commons.size)
+            loader.of(db).relations(r, relations)
+            return {
+                'data': r,
+                'page_size': commons.size,
+                'next_page': int(commons.page) + 1
+            }
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"could not fetch list of {single}")
+
+    list.__doc__ = f" List {plural}".expandtabs()
+
+    # get
+    @router.get(f'/{id_param}', tags=tags, response_model=ReadSchema)
+    async def get(request: Request, response: Response, obj_id: str = QueryParam(..., alias=id_param), db: Session = Depends(get_read_db), token: str = Depends(ReadProtect)):
+        token.auth(permissions["get"])
+        try:
+            manager = Model.objects(db)
+            version = manager.version(relations=loader.relation_names(Model, ReadSchema), id=obj_id)
+            if version:
+                not_modified = conditional_response(request, response, weak_etag(*version), f'{plural}_get')
+                if not_modified:
+                    return not_modified
+            result = manager.get(id=obj_id)
+            if result:
+                return result
+            else:
+                raise FileNotFoundError
+        except FileNotFoundError:
+            raise not_found(obj_id)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"could not fetch record <{obj_id}>")
+
+    get.__doc__ = f" Get a specific {single} by its id".expandtabs()
+
+    # change feed
+    @router.get('/changes', tags=tags, status_code=200)
+    async def changes_feed(since: str = None, limit: int = changes.CHANGES_PAGE_SIZE, db: Session = Depends(get_read_db), token: str = Depends(ReadProtect)):
+        token.auth(permissions["list"])
+        try:
+            Model.objects(db)
+            return changes.changes(db, Model, ReadSchema, since, limit)
+        except changes.InvalidCursor as e:
+            raise HTTPException(400, {"field_name": "since", "message": str(e)})
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"could not fetch changes of {plural}")
+
+    changes_feed.__doc__ = f" {plural} created, updated or deleted after a cursor, oldest first".expandtabs()
+
+    # live changes
+    @router.get('/stream', tags=tags, status_code=200, response_class=StreamingResponse)
+    async def stream(filter: str = None, token: str = Depends(ReadProtect)):
+        token.auth(permissions["list"])
+        try:
+            query_filter = json.loads(filter) if filter else None
+            if query_filter is not None:
+                events.check_filter(query_filter)
+        except ValueError as e:
+            raise HTTPException(400, {"field_name": "filter", "message": str(e)})
+        if not events.EVENTS_ENABLED:
+            raise HTTPException(409, "live events are disabled")
+        subscriber = events.broker.subscribe(Model.__tablename__, query_filter, user=current_user_uuid(), roles=current_user_roles())
+
+        async def body():
+            try:
+                async for chunk in subscriber.stream():
+                    yield chunk
+            finally:
+                events.broker.unsubscribe(subscriber)
+
+        return StreamingResponse(body(), media_type="text/event-stream", headers={
+            "cache-control": "no-cache", "x-accel-buffering": "no"
+        })
+
+    stream.__doc__ = f" Server-sent events of {plural} created, updated or deleted, optionally matching a JSON filter".expandtabs()
+
+    # query
+    @router.post('/q', tags=tags, status_code=200)
+    async def query(q: QuerySchema, db: Session = Depends(get_read_db), token: str = Depends(ReadProtect)):
+        token.auth(permissions["list"])
+        try:
+            size = q.limit if q.limit else 20
+            page = int(q.skip)/size if q.skip else 1
+            jq = JSONQ(db, Model)
+            log.debug(q)
+            allowed_aggregates = rollups.columns(Model)
+            result = jq.query(q, allowed_aggregates)
+            return {
+                'data': result.get("data", []),
+                'aggregates': result.get("aggregates", []),
+                'count': result.get("count", []),
+                'page_size': size,
+                'next_page': int(page) + 1
+            }
+        except UnkownOperator as e:
+            log.debug(e)
+            raise HTTPException(400, str(e))
+        except ColumnNotFound as e:
+            log.debug(e)
+            raise HTTPException(400, str(e))
+        except HTTPException as e:
+            raise e
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"could not fetch list of {plural} due to unknown error")
+
+    query.__doc__ = f" Query {plural}".expandtabs()
+
+    # export
+    @router.post('/export', tags=tags, status_code=200, response_class=StreamingResponse)
+    async def export(q: QuerySchema = None, fmt: str = QueryParam("ndjson", alias="format", regex="^(ndjson|csv)$"), db: Session = Depends(get_read_db), token: str = Depends(ReadProtect)):
+        token.auth(permissions["list"])
+        try:
+            Model.objects(db)
+            exporter = Export(db, Model, q, fmt)
+            exporter.query()
+        except (UnkownOperator, ColumnNotFound) as e:
+            log.debug(e)
+            raise HTTPException(400, str(e))
+        except AssertionError as e:
+            # mongosql rejects unknown columns and malformed queries with AssertionError subclasses
+            log.debug(e)
+            raise HTTPException(422, {"field_name": getattr(e, "where", None), "message": str(e)})
+        return StreamingResponse(exporter.stream(), media_type=exporter.media_type, headers={
+            "content-disposition": f'attachment; filename="{plural}.{fmt}"'
+        })
+
+    export.__doc__ = f" Stream every {single} matching an optional query as NDJSON or CSV".expandtabs()
+
+    # create
+    @router.post('/', tags=tags, status_code=201, response_model=ReadSchema)
+    async def create(request: Request, item: CreateSchema, db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["create"])
+        try:
+            entity.validate(db, item)
+            new_data = item.dict()
+            kwargs = {
+                "model_data": new_data,
+                "signal_data": signal_data(request, token, new_data)
+            }
+            return Model.objects(db).create(**kwargs)
+        except HTTPException as e:
+            raise e
+        except IntegrityError as e:
+            raise HTTPException(422, e.orig.pgerror)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"creation of new {single} failed")
+
+    create.__doc__ = f" Create a new {single}".expandtabs()
+
+    # create multiple
+    @router.post(f'/add-{plural}', tags=tags, status_code=201, response_model=List[ReadSchema])
+    async def create_multiple(request: Request, items: List[CreateSchema], db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["create"])
+        new_items, errors_info = [], []
+        try:
+            for item_index, item in enumerate(items):
+                try:
+                    entity.validate(db, item)
+                    new_items.append(item.dict())
+                except HTTPException as e:
+                    errors_info.append({"index": item_index, "errors": e.detail})
+
+            if errors_info:
+                return JSONResponse(errors_info, 422)
+            kwargs = {"signal_data": signal_data(request, token)}
+            created = Model.objects(db).create_many(new_items, **kwargs)
+            loader.of(db).relations(created, loader.relation_names(Model, ReadSchema))
+            return created
+        except HTTPException as e:
+            raise e
+        except IntegrityError as e:
+            raise HTTPException(422, e.orig.pgerror)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"creation of new {plural} failed")
+
+    create_multiple.__doc__ = f" Create multiple new {plural}".expandtabs()
+
+    # streamed create
+    @router.post('/ingest', tags=tags, status_code=200, response_class=DuplexStreamingResponse)
+    async def ingest(request: Request, db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["create"])
+        ingestion = Ingestion(entity, db, signal_data(request, token))
+        return DuplexStreamingResponse(ingestion.run(request), media_type="application/x-ndjson")
+
+    ingest.__doc__ = f" Create {plural} from a streamed NDJSON body, one result line per input line".expandtabs()
+
+    # upsert multiple
+    @router.post(f'/upsert-multiple-{plural}', tags=tags, status_code=201, response_model=List[ReadSchema])
+    async def upsert_multiple(request: Request, response: Response, items: List[UpsertSchema], db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["create"])
+        new_items, errors_info, creates = [], [], []
+        changed = unchanged = missing = 0
+        cache = loader.of(db)
+        cache.prime(Model, [item.id for item in items])
+        try:
+            for item_index, item in enumerate(items):
+                try:
+                    entity.validate(db, item, item.id)
+                    new_data = item.dict()
+                    if new_data['id']:
+                        old_data = cache.load(Model, new_data['id'])
+                        kwargs = {
+                            "model_data": new_data,
+                            "signal_data": signal_data(request, token, new_data, row_data(old_data) if old_data else {})
+                        }
+                        manager = Model.objects(db)
+                        if old_data is not None and not manager.comparator.changes(old_data, new_data):
+                            unchanged += 1
+                        elif manager.update(obj_id=new_data['id'], **kwargs):
+                            changed += 1
+                        else:
+                            missing += 1
+                        new_items.append(cache.load(Model, new_data['id']))
+                    else:
+                        new_items.append(None)
+                        creates.append((len(new_items) - 1, new_data))
+                except HTTPException as e:
+                    errors_info.append({"index": item_index, "errors": e.detail})
+
+            if errors_info:
+                return JSONResponse(errors_info, 422)
+            if creates:
+                kwargs = {"signal_data": signal_data(request, token)}
+                created = Model.objects(db).create_many([new_data for _, new_data in creates], **kwargs)
+                for (item_index, _), new_item in zip(creates, created):
+                    new_items[item_index] = new_item
+            response.headers["x-upsert-created"] = str(len(creates))
+            response.headers["x-upsert-changed"] = str(changed)
+            response.headers["x-upsert-unchanged"] = str(unchanged)
+            response.headers["x-upsert-missing"] = str(missing)
+            # ids without a row are left out of the response, x-upsert-missing counts them
+            new_items = [new_item for new_item in new_items if new_item is not None]
+            cache.relations(new_items, loader.relation_names(Model, ReadSchema))
+            return new_items
+        except HTTPException as e:
+            raise e
+        except IntegrityError as e:
+            raise HTTPException(422, e.orig.pgerror)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"upsert multiple {plural} failed")
+
+    upsert_multiple.__doc__ = f" upsert multiple {plural}".expandtabs()
+
+    # update
+    @router.put(f'/{id_param}', tags=tags, status_code=201)
+    async def update(request: Request, item: CreateSchema, obj_id: Union[str, int] = QueryParam(..., alias=id_param), db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["update"])
+        try:
+            entity.validate(db, item, obj_id)
+            cache = loader.of(db)
+            old_data = cache.load(Model, obj_id)
+            new_data = item.dict(exclude_unset=True)
+            kwargs = {
+                "model_data": new_data,
+                "signal_data": signal_data(request, token, new_data, row_data(old_data) if old_data else {})
+            }
+            Model.objects(db).update(obj_id=obj_id, **kwargs)
+            return Model.objects(db).get(id=obj_id)
+        except HTTPException as e:
+            raise e
+        except IntegrityError as e:
+            raise HTTPException(422, e.orig.pgerror)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"failed updating {single} with id <{obj_id}>")
+
+    update.__doc__ = f" Update a {single} by its id and payload".expandtabs()
+
+    # delete
+    @router.delete(f'/{id_param}', tags=tags, status_code=HTTP_204_NO_CONTENT, response_class=Response)
+    async def delete(request: Request, obj_id: Union[str, int] = QueryParam(..., alias=id_param), db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["del"])
+        try:
+            kwargs = {
+                "model_data": {},
+                "signal_data": signal_data(request, token)
+            }
+            Model.objects(db).delete(obj_id=obj_id, **kwargs)
+        except FileNotFoundError:
+            raise not_found(obj_id)
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"failed deleting {single} with id <{obj_id}>")
+
+    delete.__doc__ = f" Delete a {single} by its id".expandtabs()
+
+    # delete multiple
+    @router.delete(f'/delete-{plural}', tags=tags, status_code=HTTP_204_NO_CONTENT, response_class=Response)
+    async def delete_multiple(request: Request, obj_ids: List[str] = QueryParam(..., alias=f"{plural}_id"), db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["del"])
+        kwargs = {
+            "model_data": {},
+            "signal_data": signal_data(request, token)
+        }
+        Model.objects(db).delete_multiple(obj_ids=obj_ids, **kwargs)
+
+    delete_multiple.__doc__ = f" Delete multiple {plural} by list of ids".expandtabs()
+
+    # bulk delete by body or filter
+    @router.post('/delete', tags=tags, status_code=200)
+    async def bulk_delete_(request: Request, body: bulk_delete.DeleteRequest, db: Session = Depends(get_db), token: str = Depends(Protect)):
+        token.auth(permissions["del"])
+        if body.ids is None and body.filter is None:
+            raise HTTPException(422, {"field_name": "ids", "message": "either ids or filter is required"})
+        job_ids, deleted = None, 0
+        try:
+            if body.filter is not None:
+                await run_in_threadpool(bulk_delete.matching_ids, db, Model, body.filter, 0)
+            elif len(body.ids) > bulk_delete.DELETE_JOB_THRESHOLD:
+                job_ids = body.ids
+            else:
+                result = await run_in_threadpool(
+                    Model.objects(db).delete_multiple, body.ids, budget=bulk_delete.DELETE_TIME_BUDGET,
+                    signal_data=signal_data(request, token)
+                )
+                if not result["remaining"]:
+                    return {"deleted": result["deleted"], "job": None}
+                job_ids = result["remaining"]
+                deleted = result["deleted"]
+        except AssertionError as e:
+            # mongosql rejects unknown columns and malformed filters with AssertionError subclasses
+            log.debug(e)
+            raise HTTPException(422, {"field_name": getattr(e, "where", None), "message": str(e)})
+        except Exception as e:
+            log.debug(e)
+            raise HTTPException(500, f"failed deleting {plural}")
+        job = bulk_delete.start(bulk_delete.DeleteJob(entity, signal_data(request, token), job_ids, body.filter))
+        return JSONResponse({"deleted": deleted, "job": job.info()}, 202)
+
+    bulk_delete_.__doc__ = f" Delete {plural} by a list of ids or a filter, large sets continue in a background job".expandtabs()
+
+    # bulk delete job status
+    @router.get('/delete-jobs/{job_id}', tags=tags, status_code=200)
+    async def bulk_delete_status(job_id: str, token: str = Depends(Protect)):
+        token.auth(permissions["del"])
+        job = bulk_delete.get(job_id)
+        if not job or job.entity.name != plural:
+            raise HTTPException(404, {"field_name": "job_id", "message": f"<{job_id}> delete job not found"})
+        return job.info()
+
+    bulk_delete_status.__doc__ = f" Progress of a background delete of {plural}".expandtabs()
+
+    return router
@@ -1,24 +1,45 @@
+import logging
 import os
 import uuid
 from contextvars import ContextVar
 from typing import Optional
 
 import requests as prequest
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request, Response
 from fastapi.security import HTTPBearer
 from sqlalchemy.orm import Session
 
-from business import db_session
-from core.logger import log
+from business import db_session, replica_session
+from core import metrics, profiling, replicas
+from core.logger import get_logger, sampled
+
+log = get_logger('depends')
 
 auth_schema = HTTPBearer()
 zeauth_url = os.environ.get('ZEAUTH_URI', 'https://zekoder-zeauth-dev-25ahf2meja-uc.a.run.app')
 user_session: ContextVar[str] = ContextVar('user_session', default=None)
 user_roles: ContextVar[list] = ContextVar('user_roles', default=[])
+user_permissions: ContextVar[list] = ContextVar('user_permissions', default=[])
 
 
-def get_db():
+def get_db(response: Response = None):
     db = db_session()
+    if response is not None and replicas.enabled():
+        replicas.track_writes(db, response)
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def get_read_db(request: Request, response: Response):
+    """
+    session of read only routes, on a replica unless the client just wrote
+    """
+    if not replicas.enabled() or replicas.sticky(request):
+        yield from get_db(response)
+        return
+    db = replica_session()
     try:
         yield db
     finally:
@@ -38,39 +59,53 @@ class Protect:
         self.db = db
 
     def auth(self, method_required_permissions):
-        response = prequest.request("POST", f"{zeauth_url}/verify?token={self.credentials}", data={})
+        with metrics.timed("zeauth", "verify"):
+            response = prequest.request("POST", f"{zeauth_url}/verify?token={self.credentials}", data={})
         if response.status_code != 200:
             raise HTTPException(403, "invalid token")
+        current_user = response.json()
         has_permission = False
         for permission in method_required_permissions:
-            if permission in response.json()['permissions']:
+            if permission in current_user['permissions']:
                 has_permission = True
                 break
         if not has_permission:
             raise HTTPException(403, "user not authorized to do this action")
-        self.set_current_user_uuid_in_contextvar(response=response)
+        self.set_current_user_uuid_in_contextvar(response=response, current_user=current_user)
         return response
 
-    def set_current_user_uuid_in_contextvar(self, response):
+    def set_current_user_uuid_in_contextvar(self, response, current_user: dict = None):
         try:
-            current_user = response.json()
-            log.debug(f"current user: {current_user}")
+            if current_user is None:
+                current_user = response.json()
+            sampled(log, logging.DEBUG, "current user <%s>", current_user.get("id"))
             current_user_id = current_user.get("id")
             current_user_roles_ = current_user.get("roles", [])
+            current_user_permissions_ = current_user.get("permissions", [])
             if not current_user_id:
                 raise
             user_session.set(current_user_id)
             user_roles.set(current_user_roles_)
+            user_permissions.set(current_user_permissions_)
+            profiling.tag(user=current_user_id, roles=current_user_roles_)
         except Exception as e:
             log.debug(e)
             raise HTTPException(403, "user not authorized to do this action")
 
 
+class ReadProtect(Protect):
+    """
+    Protect of read only routes, it shares their replica session instead of checking out a primary one
+    """
+
+    def __init__(self, token: str = Depends(auth_schema), db: Session = Depends(get_read_db)) -> None:
+        super().__init__(token, db)
+
+
 def current_user_uuid():
     """
     get current user uuid from contextvar
     """
-    log.debug(f"user_session: {user_session}")
     return user_session.get()
 
 
@@ -79,3 +114,18 @@ def current_user_roles() -> list:
     get current user roles from contextvar
     """
     return user_roles.get()
+
+
+def current_user_permissions() -> list:
+    """
+    get current user permissions, as verified by zeauth, from contextvar
+    """
+    return user_permissions.get()
+
+
+def has_permission(method_required_permissions) -> bool:
+    """
+    check already verified permissions of current user without calling zeauth again
+    """
+    permissions = current_user_permissions()
+    return any(permission in permissions for permission in method_required_permissions)
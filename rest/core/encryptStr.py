@@ -1,10 +1,126 @@
+import base64
+import os
 from typing import Dict, Any
+
+import requests
+from fastapi import HTTPException
 from pydantic.utils import update_not_none
 from core.logger import log
-import requests
-import os
 
 ZEAUTH_ENCRYPT_URI = os.environ.get('ZEAUTH_ENCRYPT_URI', 'https://zeauth.zekoder.zestudio.zekoder.zekoder.net/encrypt_str')
+ZEAUTH_ENCRYPT_BATCH_URI = os.environ.get('ZEAUTH_ENCRYPT_BATCH_URI', f'{ZEAUTH_ENCRYPT_URI}_batch')
+ZEAUTH_ENCRYPT_TIMEOUT = float(os.environ.get('ZEAUTH_ENCRYPT_TIMEOUT', 10))
+# local: encrypt in process, remote: one zeauth call per value, remote_batch: one zeauth call per request
+ENCRYPTION_BACKEND = os.environ.get('ENCRYPTION_BACKEND', 'remote')
+# comma separated <version>:<urlsafe base64 32 bytes key>, values are tagged with the version that encrypted them
+FIELD_ENCRYPTION_KEYS = os.environ.get('FIELD_ENCRYPTION_KEYS', '')
+FIELD_ENCRYPTION_KEY_VERSION = os.environ.get('FIELD_ENCRYPTION_KEY_VERSION')
+
+_keys = None
+
+
+def _load_keys() -> dict:
+    global _keys
+    if _keys is None:
+        keys = {}
+        for entry in filter(None, FIELD_ENCRYPTION_KEYS.split(',')):
+            version, key = entry.strip().split(':', 1)
+            keys[version] = base64.urlsafe_b64decode(key)
+        _keys = keys
+    return _keys
+
+
+def _current_version() -> str:
+    keys = _load_keys()
+    if not keys:
+        raise ValueError("FIELD_ENCRYPTION_KEYS is not configured")
+    return FIELD_ENCRYPTION_KEY_VERSION or list(keys)[-1]
+
+
+def local_encrypt(value: str) -> str:
+    """
+    AES-GCM encrypt with the current key, output is <version>$<urlsafe base64 nonce + ciphertext>
+    """
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    version = _current_version()
+    nonce = os.urandom(12)
+    sealed = AESGCM(_load_keys()[version]).encrypt(nonce, value.encode(), version.encode())
+    return f"{version}${base64.urlsafe_b64encode(nonce + sealed).decode()}"
+
+
+def local_decrypt(token: str) -> str:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    version, payload = token.split('$', 1)
+    raw = base64.urlsafe_b64decode(payload)
+    return AESGCM(_load_keys()[version]).decrypt(raw[:12], raw[12:], version.encode()).decode()
+
+
+class PendingEncryption:
+    """
+    placeholder returned by validation in remote_batch mode, swapped for ciphertext by
+    resolve_pending before the row is written. it is deliberately not a str so an
+    unresolved value can never be stored as plain text
+    """
+
+    def __init__(self, value: str):
+        self.value = value
+        self.encrypted = None
+
+    def __repr__(self):
+        return "PendingEncryption(***)"
+
+
+def remote_encrypt_many(values: list) -> list:
+    response = requests.post(ZEAUTH_ENCRYPT_BATCH_URI, json={"strs_for_enc": values}, timeout=ZEAUTH_ENCRYPT_TIMEOUT)
+    response.raise_for_status()
+    result = response.json()['encrypt_decrypt_strs']
+    if len(result) != len(values):
+        raise ValueError("encryption service returned a different number of values")
+    return result
+
+
+def _collect(value, found: list):
+    if isinstance(value, PendingEncryption):
+        found.append(value)
+    elif isinstance(value, dict):
+        for item in value.values():
+            _collect(item, found)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            _collect(item, found)
+
+
+def _replace(value):
+    if isinstance(value, PendingEncryption):
+        return value.encrypted
+    if isinstance(value, dict):
+        return {k: _replace(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_replace(v) for v in value]
+    return value
+
+
+def resolve_pending(*items: dict):
+    """
+    encrypt every PendingEncryption found in the given payloads with a single remote call
+    and replace them in place
+    """
+    found = []
+    for item in items:
+        _collect(item, found)
+    todo = [value for value in found if value.encrypted is None]
+    if todo:
+        try:
+            for value, encrypted in zip(todo, remote_encrypt_many([value.value for value in todo])):
+                value.encrypted = encrypted
+        except Exception as e:
+            log.debug(e)
+            log.error("Can not connect to encryption endpoint or something went wrong")
+            raise HTTPException(503, "encryption service unavailable")
+    if found:
+        for item in items:
+            for key, value in item.items():
+                item[key] = _replace(value)
 
 
 class EncryptStr:
@@ -25,14 +141,22 @@ class EncryptStr:
             params = {
                 'str_for_enc': f'{value}',
             }
-            response = requests.post(f'{ZEAUTH_ENCRYPT_URI}', params=params)
+            response = requests.post(f'{ZEAUTH_ENCRYPT_URI}', params=params, timeout=ZEAUTH_ENCRYPT_TIMEOUT)
             result = response.json()
             return result['encrypt_decrypt_str']
         except Exception as e:
             log.debug(e)
             log.error("Can not connect to encryption endpoint or something went wrong")
-            exit(1)
+            raise ValueError("value could not be encrypted")
 
     @classmethod
     def validate(cls, value: Any):
+        if ENCRYPTION_BACKEND == 'local':
+            try:
+                return local_encrypt(f'{value}')
+            except Exception as e:
+                log.debug(e)
+                raise ValueError("value could not be encrypted")
+        if ENCRYPTION_BACKEND == 'remote_batch':
+            return PendingEncryption(f'{value}')
         return cls.encryptStr(value)
@@ -0,0 +1,50 @@
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+
+CACHE_CONTROL = os.environ.get('CACHE_CONTROL', 'private, no-cache')
+
+
+def cache_control(route: str) -> str:
+    """
+    get Cache-Control value of a route, e.g. CACHE_CONTROL_TEAMS_LIST overrides CACHE_CONTROL
+    """
+    return os.environ.get(f"CACHE_CONTROL_{route.upper()}", CACHE_CONTROL)
+
+
+def weak_etag(*parts) -> str:
+    """
+    build a weak etag out of version parts, e.g. (id, updated_on) or (count, max(updated_on), page)
+    """
+    digest = hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith('W/') else tag
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """
+    weak comparison of If-None-Match header against the current etag
+    """
+    header = request.headers.get('if-none-match')
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    return any(_opaque(tag) == _opaque(etag) for tag in header.split(','))
+
+
+def conditional_response(request: Request, response: Response, etag: str, route: str) -> Optional[Response]:
+    """
+    return a 304 response if client copy is fresh, otherwise attach validators to the outgoing response
+    """
+    headers = {'ETag': etag, 'Cache-Control': cache_control(route)}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,351 @@
+"""
+live change events of entities. Manager writes record an event on the session, it is published
+once the transaction commits and dropped when it rolls back, then fanned out to the subscribers
+of GET /<plural>/stream (server-sent events).
+
+EVENTS_BACKEND picks how events reach subscribers:
+- memory: within the worker that made the write
+- postgres: `pg_notify` inside the committing transaction and a LISTEN connection per worker, so
+  subscribers of every worker see every write. payloads over the NOTIFY limit are sent without
+  the row and only reach subscribers without a filter
+
+every subscriber has a buffer of EVENTS_BUFFER events, a subscriber falling that far behind gets an
+`overflow` event and is disconnected, it should catch up from /<plural>/changes and subscribe again
+
+events of a table with row level security only reach subscribers that can read the row, it is read
+again under the user of every subscriber. delete events of such a table carry no row and only
+reach subscribers without a filter
+"""
+import asyncio
+import json
+import os
+import re
+import select
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, select as select_, text
+from sqlalchemy.orm import Session
+
+from core import policies
+from core.logger import log
+
+EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+EVENTS_BACKEND = os.environ.get('EVENTS_BACKEND', 'memory')
+EVENTS_BUFFER = int(os.environ.get('EVENTS_BUFFER', 100))
+EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+EVENTS_CHANNEL = os.environ.get('EVENTS_CHANNEL', 'zekoder_events')
+NOTIFY_LIMIT = 7900
+
+stats = {"published": 0, "delivered": 0, "dropped_subscribers": 0, "subscribers": 0}
+
+
+class UnsupportedFilter(ValueError):
+    pass
+
+
+def _like(pattern: str, value: str, flags=0) -> bool:
+    regex = "".join(".*" if c == "%" else "." if c == "_" else re.escape(c) for c in pattern)
+    return re.fullmatch(regex, value, flags | re.DOTALL) is not None
+
+
+OPERATORS = {
+    "$eq": lambda value, arg: value == arg,
+    "$ne": lambda value, arg: value != arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+    "$in": lambda value, arg: value in arg,
+    "$nin": lambda value, arg: value not in arg,
+    "$exist": lambda value, arg: (value is not None) == bool(arg),
+    "$prefix": lambda value, arg: isinstance(value, str) and value.startswith(arg),
+    "$contains": lambda value, arg: isinstance(value, str) and _like(arg, value, re.IGNORECASE),
+    "$like": lambda value, arg: isinstance(value, str) and _like(arg, value),
+}
+
+
+def check_filter(query_filter: dict):
+    """
+    raise UnsupportedFilter for filters `matches` can not evaluate
+    """
+    if not isinstance(query_filter, dict):
+        raise UnsupportedFilter("filter must be an object")
+    for key, condition in query_filter.items():
+        if key == "$or":
+            if not isinstance(condition, list):
+                raise UnsupportedFilter("$or takes a list of filters")
+            for option in condition:
+                check_filter(option)
+        elif key.startswith("$"):
+            raise UnsupportedFilter(f"unknown operator <{key}>")
+        elif isinstance(condition, dict):
+            for operator in condition:
+                if operator not in OPERATORS:
+                    raise UnsupportedFilter(f"unknown operator <{operator}>")
+
+
+def matches(query_filter: dict, row: dict) -> bool:
+    """
+    evaluate a JSONQ filter against a row as serialized in events
+    """
+    for key, condition in query_filter.items():
+        if key == "$or":
+            if not any(matches(option, row) for option in condition):
+                return False
+            continue
+        value = row.get(key)
+        if isinstance(condition, dict):
+            try:
+                if not all(OPERATORS[operator](value, arg) for operator, arg in condition.items()):
+                    return False
+            except TypeError:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+
+class Subscriber:
+    def __init__(self, entity: str, query_filter: dict = None, size: int = EVENTS_BUFFER, user=None, roles=()):
+        self.entity = entity
+        self.filter = query_filter or None
+        self.user = user
+        self.roles = list(roles or [])
+        self.queue = asyncio.Queue(size + 1)
+        self.size = size
+        self.overflowed = False
+
+    def offer(self, change: dict):
+        if self.overflowed:
+            return
+        if self.filter is not None and ("data" not in change or not matches(self.filter, change["data"])):
+            return
+        if self.queue.qsize() >= self.size:
+            self.overflowed = True
+            stats["dropped_subscribers"] += 1
+            self.queue.put_nowait({"op": "overflow"})
+            return
+        self.queue.put_nowait(change)
+        stats["delivered"] += 1
+
+    async def stream(self, heartbeat: float = EVENTS_HEARTBEAT):
+        """
+        server-sent events, a comment line every `heartbeat` seconds keeps idle connections open
+        """
+        yield b"retry: 3000\n\n"
+        while True:
+            try:
+                change = await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+            yield f"event: {change['op']}\ndata: {json.dumps(change, default=str)}\n\n".encode()
+            if change["op"] == "overflow":
+                return
+
+
+class Broker:
+    def __init__(self):
+        self.subscribers = {}
+        self.loop = None
+        self._listener = None
+        self._running = False
+        self._checker = None
+
+    def wanted(self, entity: str) -> bool:
+        if not EVENTS_ENABLED:
+            return False
+        return EVENTS_BACKEND == "postgres" or bool(self.subscribers.get(entity))
+
+    def subscribe(self, entity: str, query_filter: dict = None, user=None, roles=()) -> Subscriber:
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        subscriber = Subscriber(entity, query_filter, user=user, roles=roles)
+        self.subscribers.setdefault(entity, set()).add(subscriber)
+        stats["subscribers"] += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        subscribers = self.subscribers.get(subscriber.entity, set())
+        if subscriber in subscribers:
+            subscribers.discard(subscriber)
+            stats["subscribers"] -= 1
+
+    def dispatch(self, change: dict):
+        """
+        hand an event to the subscribers of its entity allowed to see it, runs on the event loop. the
+        check reads the database, it runs on one thread so events keep their order
+        """
+        subscribers = list(self.subscribers.get(change["entity"], ()))
+        if not subscribers:
+            return
+        if self._checker is None:
+            self._checker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events-check")
+        self._checker.submit(self._check, change, subscribers)
+
+    def _check(self, change: dict, subscribers: list):
+        try:
+            deliveries = visible(change, subscribers)
+        except Exception as e:
+            log.error("can not check who sees <%s> events, event dropped", change["entity"])
+            log.debug(e)
+            return
+        self.loop.call_soon_threadsafe(self._deliver, deliveries)
+
+    def _deliver(self, deliveries: list):
+        for subscriber, change in deliveries:
+            subscriber.offer(change)
+
+    def publish(self, change: dict):
+        """
+        thread safe, called once the write committed
+        """
+        stats["published"] += 1
+        if self.loop is not None and self.subscribers.get(change["entity"]):
+            self.loop.call_soon_threadsafe(self.dispatch, change)
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        if EVENTS_ENABLED and EVENTS_BACKEND == "postgres" and not self._running:
+            self._running = True
+            self._listener = threading.Thread(target=self._listen, name="events-listener", daemon=True)
+            self._listener.start()
+
+    def stop(self):
+        self._running = False
+
+    def _listen(self):
+        from business import get_engine
+        while self._running:
+            try:
+                connection = get_engine().raw_connection()
+                try:
+                    connection.set_isolation_level(0)  # autocommit, notifications arrive outside of transactions
+                    cursor = connection.cursor()
+                    cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+                    pg = connection.connection
+                    while self._running:
+                        if select.select([pg], [], [], 1)[0]:
+                            pg.poll()
+                            while pg.notifies:
+                                self.publish(json.loads(pg.notifies.pop(0).payload))
+                finally:
+                    connection.invalidate()
+            except Exception as e:
+                log.error("events listener lost its connection, reconnecting")
+                log.debug(e)
+                time.sleep(1)
+
+
+broker = Broker()
+
+
+def _table(entity: str):
+    from business import Base
+    for table in Base.metadata.tables.values():
+        if table.name == entity:
+            return table
+    return None
+
+
+def readable(db, table, row_id, user, roles) -> bool:
+    """
+    whether `user` reads the row under the row level policies of `table`
+    """
+    try:
+        policies.set_user(db, user, roles, local=True)
+        return db.execute(select_([table.c.id]).where(table.c.id == row_id)).first() is not None
+    finally:
+        db.rollback()
+
+
+def visible(change: dict, subscribers: list) -> list:
+    """
+    (subscriber, event) of the subscribers allowed to see an event
+    """
+    from business import db_session
+    table = _table(change["entity"])
+    db = db_session()
+    try:
+        if table is None or not policies.row_security(db, table):
+            return [(subscriber, change) for subscriber in subscribers]
+        if change["op"] == "delete":
+            bare = {key: value for key, value in change.items() if key != "data"}
+            return [(subscriber, bare) for subscriber in subscribers]
+        allowed = {}
+        deliveries = []
+        for subscriber in subscribers:
+            user = (subscriber.user, tuple(subscriber.roles))
+            if user not in allowed:
+                allowed[user] = readable(db, table, change["id"], subscriber.user, subscriber.roles)
+            if allowed[user]:
+                deliveries.append((subscriber, change))
+        return deliveries
+    finally:
+        db.close()
+
+
+def _row(obj) -> dict:
+    data = obj if isinstance(obj, dict) else obj.__dict__
+    return jsonable_encoder({key: value for key, value in data.items() if not str(key).startswith("_")})
+
+
+def record(db, entity: str, op: str, rows: list):
+    """
+    queue events for rows (models or dicts) written in the current transaction of `db`
+    """
+    if not broker.wanted(entity):
+        return
+    pending = db.info.setdefault("events", [])
+    transaction = db.transaction
+    at = time.time()
+    for row in rows:
+        data = _row(row)
+        pending.append((transaction, {"entity": entity, "op": op, "id": data.get("id"), "at": at, "data": data}))
+
+
+def _inside(transaction, ancestor) -> bool:
+    while transaction is not None:
+        if transaction is ancestor:
+            return True
+        transaction = transaction.parent
+    return False
+
+
+def _savepoint(session) -> bool:
+    # commit events also fire when a savepoint is released
+    return session.transaction is not None and session.transaction.nested
+
+
+@event.listens_for(Session, "before_commit")
+def _notify(session):
+    if EVENTS_BACKEND != "postgres" or not session.info.get("events") or _savepoint(session):
+        return
+    for _, change in session.info["events"]:
+        payload = json.dumps(change, default=str)
+        if len(payload) > NOTIFY_LIMIT:
+            payload = json.dumps({**{k: v for k, v in change.items() if k != "data"}, "truncated": True}, default=str)
+        session.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": EVENTS_CHANNEL, "payload": payload})
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    if _savepoint(session):
+        return
+    pending = session.info.pop("events", None)
+    if not pending or EVENTS_BACKEND == "postgres":
+        return
+    for _, change in pending:
+        broker.publish(change)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard(session, previous_transaction):
+    pending = session.info.get("events")
+    if pending:
+        session.info["events"] = [
+            (transaction, change) for transaction, change in pending if not _inside(transaction, previous_transaction)
+        ]
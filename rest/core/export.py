@@ -0,0 +1,172 @@
+"""
+streamed export of a whole table or of a JSONQ filter. rows are read through a server-side cursor
+EXPORT_FETCH_SIZE at a time and each batch is only fetched once the previous one was sent, so a
+slow client slows the cursor down instead of filling memory.
+
+csv exports on postgres are handed to `COPY (<query>) TO STDOUT`, which skips building ORM objects
+altogether, the copy thread blocks on a bounded buffer while the client catches up
+"""
+import csv
+import enum
+import io
+import json
+import os
+import queue
+import threading
+import typing
+from itertools import islice
+
+from sqlalchemy import inspect
+from starlette.concurrency import run_in_threadpool
+
+from core.logger import log
+from core.query import QuerySchema, mongosql
+from core.slow_queries import origin, shape
+
+EXPORT_FETCH_SIZE = int(os.environ.get('EXPORT_FETCH_SIZE', 1000))
+EXPORT_COPY = os.environ.get('EXPORT_COPY', 'true').lower() in ('1', 'true', 'yes')
+EXPORT_COPY_BUFFER = int(os.environ.get('EXPORT_COPY_BUFFER', 64))
+COPY_DIALECTS = ("postgresql",)
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _value(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    return value
+
+
+def _csv_value(value):
+    value = _value(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    return value
+
+
+class Export:
+    """
+    one export of a model, `q` takes the filter, project, sort, skip and limit of a /q request,
+    limit is only applied when it was given
+    """
+
+    def __init__(self, db, model, q: QuerySchema = None, fmt: str = "ndjson", fetch_size: int = EXPORT_FETCH_SIZE):
+        self.db = db
+        self.model = model
+        self.format = fmt
+        self.fetch_size = max(fetch_size, 1)
+        self.request = q.dict(by_alias=True, exclude_none=True, exclude_unset=True,
+                              include={"filter", "project", "sort", "skip", "limit"}) if q else {}
+        mapper = inspect(model)
+        names = [attr.key for attr in mapper.column_attrs]
+        project = self.request.get("project")
+        self.columns = [name for name in names if name in project] if project else names
+        self._query = None
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format]
+
+    def query(self):
+        """
+        the sqlalchemy query of the export, raises mongosql errors for unknown columns or operators
+        """
+        if self._query is None:
+            self._query = mongosql().MongoQuery(self.model).with_session(self.db).query(**self.request).end()
+        return self._query
+
+    def copy_statement(self):
+        """
+        `COPY ... TO STDOUT` of the query, None when the database or the query can not take it
+        """
+        if not EXPORT_COPY or self.format != "csv" or self.db.get_bind().dialect.name not in COPY_DIALECTS:
+            return None
+        try:
+            query = self.query().with_entities(*[getattr(self.model, name) for name in self.columns])
+            compiled = query.statement.compile(dialect=self.db.get_bind().dialect)
+            cursor = self.db.connection().connection.cursor()
+            try:
+                sql = cursor.mogrify(str(compiled), compiled.params).decode()
+            finally:
+                cursor.close()
+        except Exception as e:
+            log.debug(e)
+            return None
+        return f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)"
+
+    def _rows(self, rows: list) -> bytes:
+        if self.format == "csv":
+            out = io.StringIO()
+            writer = csv.writer(out)
+            writer.writerows([[_csv_value(getattr(row, name)) for name in self.columns] for row in rows])
+            return out.getvalue().encode()
+        return b"".join(
+            json.dumps({name: _value(getattr(row, name)) for name in self.columns}, default=str).encode() + b"\n"
+            for row in rows
+        )
+
+    def _header(self) -> bytes:
+        if self.format != "csv":
+            return b""
+        out = io.StringIO()
+        csv.writer(out).writerow(self.columns)
+        return out.getvalue().encode()
+
+    async def stream(self) -> typing.AsyncIterator[bytes]:
+        with origin(lambda: f"export {self.model.__tablename__} {shape(self.request)}"):
+            statement = await run_in_threadpool(self.copy_statement)
+            if statement:
+                async for block in self._copy(statement):
+                    yield block
+                return
+            rows = await run_in_threadpool(lambda: iter(self.query().yield_per(self.fetch_size)))
+            header = self._header()
+            if header:
+                yield header
+            while True:
+                block = await run_in_threadpool(lambda: self._rows(list(islice(rows, self.fetch_size))))
+                if not block:
+                    break
+                yield block
+
+    async def _copy(self, statement: str) -> typing.AsyncIterator[bytes]:
+        buffer = queue.Queue(EXPORT_COPY_BUFFER)
+        done = object()
+        cancelled = threading.Event()
+
+        class Writer:
+            def write(self, data):
+                if cancelled.is_set():
+                    raise IOError("export cancelled")
+                buffer.put(data.encode() if isinstance(data, str) else bytes(data))
+
+        def copy():
+            try:
+                cursor = self.db.connection().connection.cursor()
+                try:
+                    cursor.copy_expert(statement, Writer())
+                finally:
+                    cursor.close()
+            except Exception as e:
+                log.debug(e)
+                buffer.put(e)
+            finally:
+                buffer.put(done)
+
+        thread = threading.Thread(target=copy, name="export-copy", daemon=True)
+        thread.start()
+        try:
+            while True:
+                block = await run_in_threadpool(buffer.get)
+                if block is done:
+                    break
+                if isinstance(block, Exception):
+                    raise block
+                yield block
+        finally:
+            # unblock the copy thread when the client went away
+            cancelled.set()
+            while thread.is_alive():
+                try:
+                    buffer.get_nowait()
+                except queue.Empty:
+                    await run_in_threadpool(thread.join, 0.1)
@@ -1,7 +1,6 @@
 import uuid
-from datetime import datetime
 
-from sqlalchemy import Column, String, DATETIME, INTEGER
+from sqlalchemy import func, Column, String, DATETIME, INTEGER
 from business import Base
 
 
@@ -20,5 +19,5 @@ class FilesModel(Base):
     file_name = Column(String, nullable=False)
     file_extension = Column(String)
     file_description = Column(String)
-    created_on = Column(DATETIME, default=datetime.now())
-    updated_on = Column(DATETIME, default=datetime.now(), onupdate=datetime.now())
+    created_on = Column(DATETIME, default=func.now(), server_default=func.now())
+    updated_on = Column(DATETIME, default=func.now(), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,189 @@
+"""
+streamed NDJSON ingestion. the request body is read line by line, rows are validated and written
+in chunks of INGEST_CHUNK_SIZE and committed every INGEST_COMMIT_ROWS rows, one result line is
+streamed back per input line, so memory does not grow with the upload. the closing summary line
+tells how many rows were committed, an aborted upload keeps the rows of its earlier commits
+"""
+import json
+import os
+import typing
+
+from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy.exc import DBAPIError
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import StreamingResponse
+
+from core.logger import log
+
+INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 500))
+INGEST_COMMIT_ROWS = int(os.environ.get('INGEST_COMMIT_ROWS', 5000))
+INGEST_MAX_LINE_BYTES = int(os.environ.get('INGEST_MAX_LINE_BYTES', 1024 * 1024))
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse reads `receive` to notice disconnects, which would swallow the body of a
+    request that is still being uploaded. this one leaves `receive` to the body iterator
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+class LineTooLong(Exception):
+    pass
+
+
+async def lines(request: Request, max_bytes: int = INGEST_MAX_LINE_BYTES) -> typing.AsyncIterator[bytes]:
+    """
+    non empty lines of the request body as they arrive
+    """
+    pending = bytearray()
+    async for chunk in request.stream():
+        pending += chunk
+        while True:
+            end = pending.find(b"\n")
+            if end < 0:
+                break
+            line = bytes(pending[:end]).strip()
+            del pending[:end + 1]
+            if line:
+                yield line
+        if len(pending) > max_bytes:
+            raise LineTooLong(f"line longer than {max_bytes} bytes")
+    line = bytes(pending).strip()
+    if line:
+        yield line
+
+
+def validation_errors(e: ValidationError) -> list:
+    errors = []
+    for error in e.errors():
+        field_name = error["loc"][-1] if error["loc"] else None
+        errors.append({"field_name": field_name, "message": f'<{field_name}> {error["msg"]}'})
+    return errors
+
+
+def http_errors(e: HTTPException) -> list:
+    if isinstance(e.detail, dict):
+        return [{"field_name": e.detail.get("field_name"), "message": e.detail.get("message")}]
+    return [{"field_name": None, "message": e.detail}]
+
+
+def db_error(e: DBAPIError) -> list:
+    return [{"field_name": None, "message": str(getattr(e.orig, "pgerror", None) or e.orig).strip()}]
+
+
+class Ingestion:
+    """
+    validates lines with the create schema of an entity and writes them through its Manager
+    """
+
+    def __init__(self, entity, db, signal_data: dict, chunk_size: int = INGEST_CHUNK_SIZE,
+                 commit_rows: int = INGEST_COMMIT_ROWS):
+        self.entity = entity
+        self.db = db
+        self.manager = entity.model.objects(db)
+        self.signal_data = signal_data
+        # one action runtime for the whole upload, deferred calls run after every commit
+        self.manager.runtime(signal_data)
+        self.chunk_size = max(chunk_size, 1)
+        self.commit_rows = max(commit_rows, self.chunk_size)
+        self.uncommitted = 0
+        self.counts = {"lines": 0, "created": 0, "failed": 0, "committed": 0}
+
+    def parse(self, line: bytes):
+        """
+        (item, None) for a line matching the create schema, (None, errors) otherwise
+        """
+        try:
+            return self.entity.create_schema.parse_obj(json.loads(line)), None
+        except ValidationError as e:
+            return None, validation_errors(e)
+        except ValueError as e:
+            return None, [{"field_name": None, "message": f"invalid json: {e}"}]
+
+    def _create(self, rows: list) -> list:
+        signal_data = {**self.signal_data, "new_rows": [], "old_rows": []}
+        return self.manager.create_many(rows, commit=False, signal_data=signal_data)
+
+    def write(self, chunk: list) -> list:
+        """
+        run the entity checks on a chunk of (index, item, errors) and write the valid rows in one
+        savepoint, when the database rejects it rows are retried one by one so only the offending
+        ones fail. returns (index, id, errors) in input order
+        """
+        results, rows = {}, []
+        for index, item, errors in chunk:
+            if item is not None:
+                try:
+                    self.entity.validate(self.db, item)
+                    rows.append((index, item.dict()))
+                    continue
+                except HTTPException as e:
+                    errors = http_errors(e)
+            results[index] = (index, None, errors)
+        try:
+            with self.db.begin_nested():
+                objs = self._create([row for _, row in rows]) if rows else []
+            results.update((index, (index, str(obj.id), None)) for (index, _), obj in zip(rows, objs))
+        except DBAPIError as e:
+            log.debug(e)
+            for index, row in rows:
+                try:
+                    with self.db.begin_nested():
+                        obj, = self._create([row])
+                    results[index] = (index, str(obj.id), None)
+                except DBAPIError as e:
+                    results[index] = (index, None, db_error(e))
+        created = sum(1 for _, obj_id, _ in results.values() if obj_id)
+        self.counts["created"] += created
+        self.counts["failed"] += len(results) - created
+        self.uncommitted += created
+        if self.uncommitted >= self.commit_rows:
+            self.commit()
+        return [results[index] for index, _, _ in chunk]
+
+    def commit(self):
+        self.manager.commit(self.signal_data)
+        self.counts["committed"] += self.uncommitted
+        self.uncommitted = 0
+
+    async def run(self, request: Request) -> typing.AsyncIterator[bytes]:
+        chunk = []
+        index = -1
+        try:
+            async for line in lines(request):
+                index += 1
+                self.counts["lines"] += 1
+                chunk.append((index, *self.parse(line)))
+                if len(chunk) >= self.chunk_size:
+                    for result in await run_in_threadpool(self.write, chunk):
+                        yield _result(*result)
+                    chunk = []
+            if chunk:
+                for result in await run_in_threadpool(self.write, chunk):
+                    yield _result(*result)
+            await run_in_threadpool(self.commit)
+            yield _line({"summary": self.counts})
+        except LineTooLong as e:
+            await run_in_threadpool(self.db.rollback)
+            yield _line({"index": index + 1, "errors": [{"field_name": None, "message": str(e)}]})
+            yield _line({"summary": {**self.counts, "aborted": True}})
+        except Exception as e:
+            log.error("ingestion of <%s> aborted", self.entity.name)
+            log.debug(e)
+            await run_in_threadpool(self.db.rollback)
+            yield _line({"summary": {**self.counts, "aborted": True}})
+
+
+def _line(value: dict) -> bytes:
+    return json.dumps(value, default=str).encode() + b"\n"
+
+
+def _result(index: int, obj_id, errors) -> bytes:
+    return _line({"index": index, "errors": errors} if errors else {"index": index, "id": obj_id})
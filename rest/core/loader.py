@@ -0,0 +1,157 @@
+"""
+request scoped batch loading of rows by model and id. a Loader lives on a session, routes open one
+session per request: ids asked for are queued and fetched together, one `WHERE id IN (...)` per
+model for every LOADER_BATCH ids, and rows stay cached for the rest of the session.
+
+`relations` loads a relationship of many rows the same way, one query per relationship instead of
+one lazy load per row, and `refresh` reloads rows expired by a commit in one query
+"""
+import os
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.interfaces import MANYTOONE, ONETOMANY
+
+LOADER_BATCH = int(os.environ.get('LOADER_BATCH', 500))
+
+
+def of(db) -> "Loader":
+    """
+    the loader of a session, created on first use
+    """
+    loader = db.info.get("loader")
+    if loader is None:
+        loader = db.info["loader"] = Loader(db)
+    return loader
+
+
+def relation_names(model, schema) -> list:
+    """
+    relationships of `model` read by the pydantic `schema`
+    """
+    relationships = inspect(model).relationships
+    return [name for name in schema.__fields__ if name in relationships]
+
+
+def _chunks(values: list):
+    for start in range(0, len(values), LOADER_BATCH):
+        yield values[start:start + LOADER_BATCH]
+
+
+class Loader:
+    def __init__(self, db):
+        self.db = db
+        self.rows = {}  # (model, id) -> row, None for ids known not to exist
+        self.pending = {}
+
+    def add(self, rows):
+        for row in rows:
+            if row is not None:
+                self.rows[(type(row), str(row.id))] = row
+
+    def prime(self, model, ids):
+        """
+        queue ids to be fetched by the next load
+        """
+        pending = self.pending.setdefault(model, set())
+        for obj_id in ids:
+            if obj_id is not None and (model, str(obj_id)) not in self.rows:
+                pending.add(str(obj_id))
+
+    def dispatch(self):
+        pending, self.pending = self.pending, {}
+        for model, ids in pending.items():
+            for chunk in _chunks(sorted(ids)):
+                found = {str(row.id): row for row in self.db.query(model).filter(model.id.in_(chunk))}
+                for obj_id in chunk:
+                    self.rows[(model, obj_id)] = found.get(obj_id)
+
+    def load(self, model, obj_id):
+        if obj_id is None:
+            return None
+        self.prime(model, [obj_id])
+        self.dispatch()
+        return self.rows.get((model, str(obj_id)))
+
+    def load_many(self, model, ids) -> list:
+        """
+        rows in the order of `ids`, None for the missing ones
+        """
+        ids = list(ids)
+        self.prime(model, ids)
+        self.dispatch()
+        return [self.rows.get((model, str(obj_id))) if obj_id is not None else None for obj_id in ids]
+
+    def refresh(self, rows: list):
+        """
+        reload rows expired by a commit together instead of one by one when they are read
+        """
+        expired = [row for row in rows if row is not None and inspect(row).expired_attributes]
+        if not expired:
+            return
+        model = type(expired[0])
+        ids = [inspect(row).identity[0] for row in expired]
+        for chunk in _chunks(ids):
+            self.db.query(model).filter(model.id.in_(chunk)).populate_existing().all()
+        self.add(expired)
+
+    def relations(self, rows: list, names: list = None):
+        """
+        load relationships of `rows`, all of one model, with one query per relationship. other
+        than plain foreign keys to an id the relationship is left to lazy loading
+        """
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return
+        self.refresh(rows)
+        mapper = inspect(type(rows[0]))
+        for name in names if names is not None else mapper.relationships.keys():
+            relationship = mapper.relationships[name]
+            todo = [row for row in rows if name not in row.__dict__]
+            if not todo or len(relationship.local_remote_pairs) != 1:
+                continue
+            (local, remote), = relationship.local_remote_pairs
+            target = relationship.mapper.class_
+            local_key = mapper.get_property_by_column(local).key
+            remote_key = relationship.mapper.get_property_by_column(remote).key
+            if relationship.direction is MANYTOONE and remote_key == "id":
+                parents = self.load_many(target, [getattr(row, local_key) for row in todo])
+                for row, parent in zip(todo, parents):
+                    set_committed_value(row, name, parent)
+            elif relationship.direction is ONETOMANY:
+                children = {}
+                keys = sorted({str(getattr(row, local_key)) for row in todo})
+                for chunk in _chunks(keys):
+                    for child in self.db.query(target).filter(getattr(target, remote_key).in_(chunk)):
+                        children.setdefault(str(getattr(child, remote_key)), []).append(child)
+                        self.add([child])
+                for row in todo:
+                    set_committed_value(row, name, children.get(str(getattr(row, local_key)), []))
+
+    def forget(self, rows=(), model=None):
+        """
+        drop ids known missing, the given rows and every row of `model`
+        """
+        dropped = {(type(row), str(row.id)) for row in rows}
+        self.rows = {
+            key: row for key, row in self.rows.items()
+            if row is not None and key not in dropped and key[0] is not model
+        }
+
+
+@event.listens_for(Session, "after_flush")
+def _flushed(session, flush_context):
+    if "loader" in session.info:
+        session.info["loader"].forget(session.deleted)
+
+
+@event.listens_for(Session, "after_bulk_delete")
+def _bulk_deleted(delete_context):
+    if "loader" in delete_context.session.info:
+        delete_context.session.info["loader"].forget(model=delete_context.mapper.class_)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _rolled_back(session, previous_transaction):
+    session.info.pop("loader", None)
@@ -1,12 +1,153 @@
+import atexit
+import json
 import logging
 import os
-LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG')
-FORMAT = '%(asctime)s %(clientip)-15s %(user)-8s %(message)s'
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# text for humans, json for log collectors
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+# per logger levels, e.g. "ZEKODER_APP.depends=DEBUG,sqlalchemy.engine=INFO,uvicorn.access=WARNING"
+LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+# records waiting for the writer thread, new records are dropped once it is full
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# share of sampled records that are kept, and at most that many per message and second
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 10))
+
+TEXT_FORMAT = '%(asctime)s | %(levelname)8s | %(name)s | %(message)s'
+# attributes every LogRecord has, anything else was passed through `extra`
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+stats = {
+    "dropped": 0,
+    "sampled_out": 0,
+}
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    one json object per line, fields passed with extra={...} are added as they are
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    hands records to the writer thread, the caller never waits on the stream
+    """
+
+    def prepare(self, record):
+        # only the message is rendered here so later changes to the args do not show up,
+        # timestamps, json and tracebacks are formatted by the writer thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            stats["dropped"] += 1
+
+
+def _formatter() -> logging.Formatter:
+    return JSONFormatter() if LOG_FORMAT == 'json' else logging.Formatter(TEXT_FORMAT)
+
+
+def _stream_handler() -> logging.Handler:
+    handler = logging.StreamHandler()
+    handler.setFormatter(_formatter())
+    return handler
+
+
 log = logging.getLogger(os.environ.get('APP_NAME', 'ZEKODER_APP'))
-log.setLevel(eval(f"logging.{LEVEL}"))
-# Define format for logs
-fmt = '%(asctime)s | %(levelname)8s | %(message)s'
-# Create stdout handler for logging to the console (logs all five levels)
-stdout_handler = logging.StreamHandler()
-stdout_handler.setLevel(logging.DEBUG)
-log.addHandler(stdout_handler)
+log.setLevel(getattr(logging, LEVEL, logging.INFO))
+log.propagate = False
+queue_handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+log.addHandler(queue_handler)
+listener = QueueListener(queue_handler.queue, _stream_handler())
+listener.start()
+
+
+def _apply_levels(levels: str):
+    for entry in filter(None, levels.split(',')):
+        name, level = entry.strip().rsplit('=', 1)
+        logger = logging.getLogger(name)
+        logger.setLevel(getattr(logging, level.upper(), logging.INFO))
+        # loggers of libraries write through the same queue, children of the app logger already do
+        if not name.startswith(f"{log.name}.") and name != log.name:
+            logger.addHandler(queue_handler)
+            logger.propagate = False
+
+
+_apply_levels(LOG_LEVELS)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    child of the app logger, its level can be set on its own through LOG_LEVELS
+    """
+    return log.getChild(name)
+
+
+def _restart_listener():
+    # the writer thread does not survive fork, workers forked from a preloaded app start their own
+    global listener
+    queue_handler.queue = queue.Queue(LOG_QUEUE_SIZE)
+    listener = QueueListener(queue_handler.queue, _stream_handler())
+    listener.start()
+
+
+def _stop_listener():
+    listener.stop()
+
+
+os.register_at_fork(after_in_child=_restart_listener)
+atexit.register(_stop_listener)
+
+_windows = {}
+_windows_lock = threading.Lock()
+
+
+def sampled(logger: logging.Logger, level: int, msg: str, *args, rate: float = None, per_second: int = None, **kwargs):
+    """
+    log a hot path record for a share of the calls, and never more than per_second times a
+    second for the same message. records let through carry how many were skipped before them
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_SAMPLE_RATE if rate is None else rate
+    per_second = LOG_RATE_LIMIT if per_second is None else per_second
+    key = (logger.name, msg)
+    with _windows_lock:
+        window = _windows.setdefault(key, [0, 0, 0])
+        second = int(time.monotonic())
+        if window[0] != second:
+            window[0], window[1] = second, 0
+        if window[1] >= per_second or random.random() >= rate:
+            window[2] += 1
+            stats["sampled_out"] += 1
+            return
+        window[1] += 1
+        skipped, window[2] = window[2], 0
+    extra = kwargs.pop('extra', {})
+    logger.log(level, msg, *args, extra={**extra, "skipped": skipped}, **kwargs)
@@ -0,0 +1,161 @@
+"""
+event loop lag monitor. a heartbeat task measures how late the loop wakes it up, a watchdog
+thread notices when the heartbeat stalls past LOOP_BLOCK_MS and captures the stack of the loop
+thread at that moment, i.e. the blocking call, with the route being served. LOOP_MONITOR=true
+starts it with the app
+
+LOOP_MONITOR_STRICT=true turns every detection into a failure raised on shutdown, so a test
+suite running the app under TestClient fails on blocking calls in async handlers
+"""
+import asyncio
+import logging
+import os
+import sys
+import sysconfig
+import threading
+import time
+from collections import Counter, deque
+
+from core import metrics, profiling
+from core.logger import log, sampled
+
+LOOP_MONITOR = os.environ.get('LOOP_MONITOR', 'false').lower() in ('1', 'true', 'yes')
+LOOP_MONITOR_INTERVAL = float(os.environ.get('LOOP_MONITOR_INTERVAL', 0.05))
+LOOP_BLOCK_MS = float(os.environ.get('LOOP_BLOCK_MS', 100))
+LOOP_MONITOR_STRICT = os.environ.get('LOOP_MONITOR_STRICT', 'false').lower() in ('1', 'true', 'yes')
+LOOP_MONITOR_KEEP = int(os.environ.get('LOOP_MONITOR_KEEP', 50))
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY_DIRS = tuple({sysconfig.get_paths()[key] for key in ("stdlib", "platstdlib", "purelib", "platlib")})
+# frames of these modules wrap every request, a stall is never their own doing
+WRAPPERS = ("core/metrics.py", "core/profiling.py", "core/server.py", "core/loop_monitor.py")
+
+lag_seconds = metrics.register(metrics.Histogram(
+    f"{metrics.METRICS_PREFIX}_event_loop_lag_seconds", "delay of the event loop waking up a timer",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+))
+blocked_total = metrics.register(metrics.Counter(
+    f"{metrics.METRICS_PREFIX}_event_loop_blocked_total", "event loop stalls by route and blocking code location",
+    ("route", "location")
+))
+
+
+class BlockingDetected(AssertionError):
+    pass
+
+
+def _location(frames: list) -> str:
+    """
+    innermost frame outside the standard library and installed packages, i.e. the code of ours
+    that made the blocking call
+    """
+    for frame in frames:
+        if not frame["file"].startswith(LIBRARY_DIRS) and not frame["file"].endswith(WRAPPERS):
+            path = frame["file"]
+            if path.startswith(APP_DIR):
+                path = os.path.relpath(path, APP_DIR)
+            return f'{path}:{frame["line"]} {frame["function"]}'
+    frame = frames[0] if frames else {"file": "?", "line": 0, "function": "?"}
+    return f'{os.path.basename(frame["file"])}:{frame["line"]} {frame["function"]}'
+
+
+class LoopMonitor:
+    def __init__(self, interval: float = LOOP_MONITOR_INTERVAL, block_ms: float = LOOP_BLOCK_MS,
+                 strict: bool = LOOP_MONITOR_STRICT):
+        self.interval = interval
+        self.block = block_ms / 1000
+        self.strict = strict
+        self.offenders = Counter()
+        self.recent = deque(maxlen=LOOP_MONITOR_KEEP)
+        self.violations = []
+        self.running = False
+        self.loop = None
+        self.loop_thread = None
+        self.beat = 0.0
+        self._task = None
+        self._watchdog = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.get_ident()
+        self.beat = time.monotonic()
+        profiling.track_tasks(True)
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self):
+        self.running = False
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        profiling.track_tasks(False)
+
+    async def _heartbeat(self):
+        while self.running:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag_seconds.observe(max(now - expected, 0.0))
+            self.beat = now
+
+    def _watch(self):
+        reported = None
+        while self.running:
+            time.sleep(self.interval / 2)
+            beat = self.beat
+            if beat == reported or time.monotonic() - beat - self.interval < self.block:
+                continue
+            reported = beat
+            try:
+                self._capture(time.monotonic() - beat - self.interval)
+            except Exception as e:
+                log.debug(e)
+
+    def _capture(self, stalled: float):
+        frame = sys._current_frames().get(self.loop_thread)
+        frames = []
+        while frame is not None:
+            frames.append({"file": frame.f_code.co_filename, "line": frame.f_lineno, "function": frame.f_code.co_name})
+            frame = frame.f_back
+        task = getattr(asyncio.tasks, "_current_tasks", {}).get(self.loop)
+        meta = profiling.task_meta(task) or {}
+        route = meta.get("route") or (task.get_name() if task else "loop")
+        location = _location(frames)
+        self.offenders[(route, location)] += 1
+        blocked_total.inc(route, location)
+        entry = {
+            "at": time.time(),
+            "stalled_ms": round(stalled * 1000, 1),
+            "route": route,
+            "user": meta.get("user"),
+            "location": location,
+            "stack": [f'{f["file"]}:{f["line"]} {f["function"]}' for f in reversed(frames)],
+        }
+        self.recent.append(entry)
+        if self.strict:
+            self.violations.append(entry)
+        sampled(log, logging.WARNING, "event loop blocked for more than %.0f ms in <%s> at %s", stalled * 1000, route, location)
+
+    def top(self, limit: int = 20) -> list:
+        return [
+            {"route": route, "location": location, "count": count}
+            for (route, location), count in self.offenders.most_common(limit)
+        ]
+
+    def check(self):
+        """
+        raise BlockingDetected listing the blocking calls seen so far, strict mode calls it on shutdown
+        """
+        if self.violations:
+            violations, self.violations = self.violations, []
+            raise BlockingDetected("event loop blocked:\n" + "\n".join(
+                f'  {entry["stalled_ms"]} ms in <{entry["route"]}> at {entry["location"]}' for entry in violations
+            ))
+
+
+monitor = LoopMonitor()
@@ -1,8 +1,66 @@
+import enum
 import json
+import os
+import time
+import uuid
 from core.logger import log
+from sqlalchemy import func, any_, bindparam, inspect, ARRAY, String
 from sqlalchemy.orm import Session
 
+from core import changes, events, loader, outbox, policies, rollups, triggers
+from core.action_runtime import ActionRuntime
 from core.depends import get_db, current_user_uuid, current_user_roles
+from core.encryptStr import resolve_pending
+
+HOOK_EVENTS = {
+    "pre_save": "pre_create",
+    "post_save": "post_create",
+    "post_save_many": "post_create",
+    "pre_update": "pre_update",
+    "post_update": "post_update",
+    "pre_delete": "pre_delete",
+    "post_delete": "post_delete",
+    "post_delete_many": "post_delete",
+}
+HOOK_ALIASES = {"post_save_many": ("post_save_many", "post_save"), "post_delete_many": ("post_delete_many", "post_delete")}
+# dialects binding a list as one array parameter, `id = ANY(:ids)`, instead of one parameter per id
+ARRAY_DIALECTS = ("postgresql", "cockroachdb")
+DELETE_CHUNK_SIZE = int(os.environ.get('DELETE_CHUNK_SIZE', 1000))
+
+
+def row_data(obj) -> dict:
+    """
+    column values of a row as a plain dict, a copy hooks can keep after the row changes
+    """
+    return {attr.key: getattr(obj, attr.key) for attr in inspect(obj).mapper.column_attrs}
+
+
+def _plain(value):
+    if isinstance(value, enum.Enum):
+        return value.value
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+class Comparator:
+    """
+    finds the fields of a payload differing from a stored row, built once per model
+    """
+
+    def __init__(self, model):
+        self.columns = {attr.key for attr in inspect(model).column_attrs}
+
+    def changes(self, row, model_data: dict) -> dict:
+        return {
+            key: value for key, value in model_data.items()
+            if key not in self.columns or _plain(getattr(row, key)) != _plain(value)
+        }
+
+
+_comparators = {}
 
 
 class Manager:
@@ -13,9 +71,8 @@ class Manager:
         self.db = database
         self.Model = model
         self._query = {}  # Instantiate a query, update it on get/filter call
-        # set session variables
-        self.db.execute(f"SET zekoder.id = '{current_user_uuid()}'")
-        self.db.execute(f"SET zekoder.roles = '{','.join(current_user_roles())}'")
+        # set session variables, read by row level policies of postgres and cockroachdb
+        policies.set_user(self.db, current_user_uuid(), current_user_roles())
 
     def __str__(self):
         return "%s_%s" % (self.__class__.__name__, self.Model.__name__)
@@ -40,87 +97,285 @@ class Manager:
         self.update_query(query)
         return self.__fetch().first()
 
+    def get_many(self, obj_ids: list) -> list:
+        """
+        rows by id in the order given, through the loader of the session
+        """
+        return loader.of(self.db).load_many(self.Model, obj_ids)
+
+    def version(self, relations: list = (), **query):
+        """
+        cheap (id, updated_on) lookup of a single row, used to answer conditional requests. rows of
+        the embedded `relations` add their (count, max(updated_on)), None when they can not be versioned
+        """
+        self.update_query(query)
+        version = self.db.query(self.Model.id, self.Model.updated_on).filter_by(**self._query).first()
+        if version is None:
+            return None
+        related = self._relations_version(relations)
+        return None if related is None else (*version, *related)
+
+    def aggregate_version(self, relations: list = (), **query):
+        """
+        cheap (count, max(updated_on)) lookup of the whole listing, used to answer conditional requests.
+        rows of the embedded `relations` add theirs, None when they can not be versioned
+        """
+        self.update_query(query)
+        version = self.db.query(func.count(self.Model.id), func.max(self.Model.updated_on)).filter_by(**self._query).first()
+        related = self._relations_version(relations)
+        return None if related is None else (*version, *related)
+
+    def _relations_version(self, relations: list):
+        """
+        (count, max(updated_on)) of the rows each relationship links to the matching rows
+        """
+        mapper = inspect(self.Model)
+        version = []
+        for name in relations:
+            relationship = mapper.relationships[name]
+            target = relationship.mapper.class_
+            if len(relationship.local_remote_pairs) != 1 or not hasattr(target, "updated_on"):
+                return None
+            (local, remote), = relationship.local_remote_pairs
+            keys = self.db.query(getattr(self.Model, mapper.get_property_by_column(local).key)).filter_by(**self._query)
+            version += self.db.query(func.count(), func.max(target.updated_on)).filter(remote.in_(keys.subquery())).first()
+        return version
+
     def filter(self, **query):
         self.update_query(query)
         return self
 
     def create(self, only_add: bool = False, **kwargs):
         model_data = kwargs.get("model_data", {})
-        if kwargs.get("signal_data"):
-            model_data.update(self.pre_save(**kwargs["signal_data"]))
+        signal_data = kwargs.get("signal_data")
+        if signal_data:
+            self.runtime(signal_data)
+            model_data.update(self.pre_save(**signal_data))
+        resolve_pending(model_data)
         obj = self.Model(**model_data)
         if only_add:  # to handle multi-create in on commit
             self.db.add(obj)
             return obj
-        self.save(obj)
-        if kwargs.get("signal_data"):
-            try:
-                kwargs.get("signal_data")["new_data"] = obj.__dict__
-                self.post_save(**kwargs["signal_data"])
-            except Exception as e:
-                log.debug(e)
-
+        self.db.add(obj)
+        self.db.flush()
+        rollups.apply(self.db, self.Model, new=[obj])
+        events.record(self.db, self.entity, "create", [obj])
+        if signal_data:
+            signal_data["new_data"] = obj.__dict__
+            self.run_hook(self.post_save, signal_data)
+        self.commit(signal_data)
+        self.db.refresh(obj)
         return obj
 
+    def create_many(self, items: list, commit: bool = True, **kwargs):
+        """
+        add many rows in one transaction, post_create triggers receive all of them in a single call
+        """
+        signal_data = kwargs.get("signal_data")
+        objs = []
+        if signal_data:
+            self.runtime(signal_data)
+        for model_data in items:
+            if signal_data:
+                model_data.update(self.pre_save(**{**signal_data, "new_data": model_data}))
+        resolve_pending(*items)
+        for model_data in items:
+            objs.append(self.Model(**model_data))
+        self.db.add_all(objs)
+        self.db.flush()
+        rollups.apply(self.db, self.Model, new=objs)
+        events.record(self.db, self.entity, "create", objs)
+        if signal_data:
+            signal_data["new_rows"] = [obj.__dict__ for obj in objs]
+            self.run_hook(self.post_save_many, signal_data)
+        if commit:
+            self.commit(signal_data)
+        return objs
+
     def save(self, obj):
         self.db.add(obj)
         self.db.commit()
         self.db.refresh(obj)
 
-    def update(self, obj_id, **kwargs):
+    @property
+    def comparator(self) -> Comparator:
+        if self.Model not in _comparators:
+            _comparators[self.Model] = Comparator(self.Model)
+        return _comparators[self.Model]
+
+    def update(self, obj_id, **kwargs) -> bool:
+        """
+        write the fields of model_data differing from the stored row. a payload matching the row
+        writes nothing, runs no hooks and returns False
+        """
         model_data = kwargs.get("model_data", {})
-        if kwargs.get("signal_data"):
-            model_data.update(self.pre_update(**kwargs["signal_data"]))
-        self.db.query(self.Model).filter(self.Model.id == obj_id).update(model_data)
-        self.db.commit()
-        try:
-            if kwargs.get("signal_data"):
-                kwargs.get("signal_data")["new_data"] = model_data
-                self.post_update(**kwargs["signal_data"])
-        except Exception as e:
-            log.debug(e)
+        signal_data = kwargs.get("signal_data")
+        current = loader.of(self.db).load(self.Model, obj_id)
+        if current is not None and not self.comparator.changes(current, model_data):
+            return False
+        if signal_data:
+            self.runtime(signal_data)
+            model_data.update(self.pre_update(**signal_data))
+        resolve_pending(model_data)
+        changed = self.comparator.changes(current, model_data) if current is not None else model_data
+        if not changed:
+            return False
+        old_rows = rollups.snapshot(self.db, self.Model, self.Model.id == obj_id)
+        updated = self.db.query(self.Model).filter(self.Model.id == obj_id).update(changed)
+        if old_rows:
+            rollups.apply(self.db, self.Model, old_rows, rollups.snapshot(self.db, self.Model, self.Model.id == obj_id))
+        if events.broker.wanted(self.entity):
+            query = self.db.query(self.Model).populate_existing().filter(self.Model.id == obj_id)
+            events.record(self.db, self.entity, "update", query.all())
+        if signal_data:
+            signal_data["new_data"] = model_data
+            self.run_hook(self.post_update, signal_data)
+        self.commit(signal_data)
+        return bool(updated)
 
     def delete(self, obj_id, **kwargs):
         delete = True
-        if kwargs.get("signal_data"):
-            delete = self.pre_delete(**kwargs["signal_data"])
+        signal_data = kwargs.get("signal_data")
+        if signal_data:
+            self.runtime(signal_data)
+            delete = self.pre_delete(**signal_data)
         if not delete:
             return
-        self.db.query(self.Model).filter(self.Model.id == obj_id).delete()
-        self.db.commit()
-        try:
-            if kwargs.get("signal_data"):
-                kwargs.get("signal_data")["new_data"] = delete
-                self.post_delete(**kwargs["signal_data"])
-        except Exception as e:
-            log.debug(e)
+        changes.record_deletes(self.db, self.Model, self.Model.id == obj_id)
+        old_rows = rollups.snapshot(self.db, self.Model, self.Model.id == obj_id)
+        if self.db.query(self.Model).filter(self.Model.id == obj_id).delete():
+            rollups.apply(self.db, self.Model, old=old_rows)
+            events.record(self.db, self.entity, "delete", [{"id": obj_id}])
+        if signal_data:
+            signal_data["new_data"] = delete
+            self.run_hook(self.post_delete, signal_data)
+        self.commit(signal_data)
+
+    def id_in(self, obj_ids: list):
+        """
+        `id = ANY(:ids)` where the database takes arrays, a plain IN elsewhere
+        """
+        if self.db.get_bind().dialect.name in ARRAY_DIALECTS:
+            return self.Model.id == any_(bindparam("ids", value=[str(obj_id) for obj_id in obj_ids], type_=ARRAY(String)))
+        return self.Model.id.in_(obj_ids)
 
-    def delete_multiple(self, obj_ids: list, **kwargs):
+    def delete_multiple(self, obj_ids: list, chunk_size: int = DELETE_CHUNK_SIZE, budget: float = None, **kwargs) -> dict:
+        """
+        delete rows by id in chunks, each chunk committed on its own with one batched post_delete.
+        stops after `budget` seconds, what is left over is returned as `remaining`
+        """
+        signal_data = kwargs.get("signal_data")
         delete = True
-        if kwargs.get("signal_data"):
-            delete = self.pre_delete(**kwargs["signal_data"])
+        if signal_data:
+            self.runtime(signal_data)
+            delete = self.pre_delete(**signal_data)
         if not delete:
+            return {"deleted": 0, "remaining": []}
+        obj_ids = list(dict.fromkeys(obj_ids))
+        deadline = time.monotonic() + budget if budget is not None else None
+        deleted, done = 0, 0
+        for start in range(0, len(obj_ids), max(chunk_size, 1)):
+            if deadline is not None and done and time.monotonic() >= deadline:
+                break
+            deleted += self.delete_chunk(obj_ids[start:start + chunk_size], signal_data)
+            done = start + chunk_size
+        return {"deleted": deleted, "remaining": obj_ids[done:] if done < len(obj_ids) else []}
+
+    def delete_chunk(self, obj_ids: list, signal_data: dict = None) -> int:
+        """
+        delete one chunk of ids and commit, post_delete triggers get the deleted rows as `old_rows`
+        """
+        old_rows = []
+        if signal_data and self.has_hook("post_delete_many"):
+            old_rows = [
+                {key: value for key, value in obj.__dict__.items() if not key.startswith("_")}
+                for obj in self.db.query(self.Model).filter(self.id_in(obj_ids))
+            ]
+        changes.record_deletes(self.db, self.Model, self.id_in(obj_ids))
+        if events.broker.wanted(self.entity):
+            gone = old_rows or [{"id": row.id} for row in self.db.query(self.Model.id).filter(self.id_in(obj_ids))]
+            events.record(self.db, self.entity, "delete", [{"id": row["id"]} for row in gone])
+        rollup_rows = rollups.snapshot(self.db, self.Model, self.id_in(obj_ids))
+        deleted = self.db.query(self.Model).filter(self.id_in(obj_ids)).delete(synchronize_session=False)
+        rollups.apply(self.db, self.Model, old=rollup_rows)
+        if signal_data and old_rows:
+            self.run_hook(self.post_delete_many, {**signal_data, "new_rows": [{} for _ in old_rows], "old_rows": old_rows})
+        self.commit(signal_data)
+        return deleted
+
+    def runtime(self, signal_data: dict) -> ActionRuntime:
+        """
+        action runtime bound to this session, shared by every hook fired for the same request
+        """
+        if not signal_data.get("runtime"):
+            signal_data["runtime"] = ActionRuntime(self.db, signal_data.get("jwt"), signal_data.get("well_known_urls"))
+        return signal_data["runtime"]
+
+    def run_hook(self, hook, signal_data: dict):
+        """
+        run a post_* hook inside a savepoint of the current transaction, a failing hook only
+        rolls back its own writes. with the outbox enabled the hook is queued in the same
+        transaction and run later by an outbox worker
+        """
+        if not self.has_hook(hook.__name__):
             return
-        self.db.query(self.Model).filter(self.Model.id.in_(obj_ids)).delete(synchronize_session=False)
+        if outbox.OUTBOX_ENABLED:
+            outbox.enqueue_hook(self.db, self.Model, hook.__name__, signal_data)
+            return
+        self.runtime(signal_data)
+        try:
+            with self.db.begin_nested():
+                hook(**signal_data)
+        except Exception:
+            log.exception("%s hook of <%s> failed", hook.__name__, self.entity)
+
+    @property
+    def entity(self) -> str:
+        return self.Model.__tablename__
+
+    def has_hook(self, name: str) -> bool:
+        """
+        whether a hook does anything, either overridden by a generated manager or backed by data.yaml triggers
+        """
+        overridden = [hook for hook in HOOK_ALIASES.get(name, (name,)) if getattr(type(self), hook) is not getattr(Manager, hook)]
+        return bool(overridden) or triggers.has(self.entity, HOOK_EVENTS[name])
+
+    def commit(self, signal_data: dict = None):
         self.db.commit()
+        if signal_data and signal_data.get("runtime"):
+            signal_data["runtime"].run_deferred()
 
     def pre_save(self, **kwargs):
-        return kwargs.get("new_data")
+        return triggers.run(self.entity, "pre_create", kwargs)
 
     def post_save(self, **kwargs):
-        pass
+        triggers.run(self.entity, "post_create", kwargs)
+
+    def post_save_many(self, **kwargs):
+        if type(self).post_save is not Manager.post_save:  # generated hook without batch support
+            for new_data in kwargs.get("new_rows", []):
+                self.post_save(**{**kwargs, "new_data": new_data})
+            return
+        triggers.run_batch(self.entity, "post_create", kwargs)
 
     def pre_update(self, **kwargs):
-        return kwargs.get("new_data")
+        return triggers.run(self.entity, "pre_update", kwargs)
 
     def post_update(self, **kwargs):
-        pass
+        triggers.run(self.entity, "post_update", kwargs)
 
     def pre_delete(self, **kwargs):
-        return True
+        return triggers.run(self.entity, "pre_delete", kwargs)
 
     def post_delete(self, **kwargs):
-        pass
+        triggers.run(self.entity, "post_delete", kwargs)
+
+    def post_delete_many(self, **kwargs):
+        if type(self).post_delete is not Manager.post_delete:  # generated hook without batch support
+            for old_data in kwargs.get("old_rows", []):
+                self.post_delete(**{**kwargs, "new_data": True, "old_data": old_data})
+            return
+        triggers.run_batch(self.entity, "post_delete", kwargs)
 
     def all(self, offset: int = 0, limit: int = 10, **query):
         self.update_query(query)
@@ -0,0 +1,245 @@
+"""
+in-process metrics exposed on /metrics in the prometheus text format, no client library needed.
+every worker process keeps and exposes its own numbers
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_PREFIX = os.environ.get('METRICS_PREFIX', 'zekoder')
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+# per request totals of the database and outbound calls made while serving it
+_request: ContextVar[dict] = ContextVar('metrics_request', default=None)
+# "<method> <path>" of the request being served, for logs of what happens while serving it
+current_request: ContextVar[str] = ContextVar('current_request', default=None)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, value: float = 1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for labels, value in self.values.items():
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+def _le(bound) -> str:
+    return f'le="{bound}"' if isinstance(bound, str) else f'le="{float(bound)}"'
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket ..., count above the last bucket, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.values.items()]
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, _le(bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Gauges:
+    """
+    values read from a callback at scrape time, the callback returns {name: value}
+    """
+
+    def __init__(self, name: str, help: str, collect):
+        self.name, self.help, self.collect = name, help, collect
+
+    def render(self) -> list:
+        lines = []
+        for key, value in self.collect().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f"{self.name}_{key}"
+            lines += [f"# HELP {name} {self.help}", f"# TYPE {name} gauge", f"{name} {_number(value)}"]
+        return lines
+
+
+REQUEST_LABELS = ("method", "route", "status")
+
+requests_seconds = Histogram(
+    f"{METRICS_PREFIX}_http_request_duration_seconds", "time spent serving requests", REQUEST_LABELS
+)
+request_db_queries = Histogram(
+    f"{METRICS_PREFIX}_http_request_db_queries", "database queries run per request", REQUEST_LABELS, COUNT_BUCKETS
+)
+request_dependency_seconds = Histogram(
+    f"{METRICS_PREFIX}_http_request_dependency_seconds", "time per request spent in database and outbound calls",
+    REQUEST_LABELS + ("dependency",)
+)
+db_query_seconds = Histogram(f"{METRICS_PREFIX}_db_query_duration_seconds", "time spent per database query")
+external_seconds = Histogram(
+    f"{METRICS_PREFIX}_external_call_duration_seconds", "time spent per outbound call", ("kind", "name", "outcome")
+)
+registry = [requests_seconds, request_db_queries, request_dependency_seconds, db_query_seconds, external_seconds]
+
+
+def register(collector):
+    """
+    add a Counter, Histogram or Gauges to /metrics
+    """
+    registry.append(collector)
+    return collector
+
+
+def render() -> str:
+    lines = []
+    for collector in registry:
+        try:
+            lines += collector.render()
+        except Exception as e:
+            from core.logger import log
+            log.debug(e)
+    return '\n'.join(lines) + '\n'
+
+
+def _add(key: str, seconds: float):
+    totals = _request.get()
+    if totals is not None:
+        totals[key] = totals.get(key, 0.0) + seconds
+
+
+@contextmanager
+def timed(kind: str, name: str = ""):
+    """
+    time an outbound call, it is added to the totals of the request being served if any
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if METRICS_ENABLED:
+            external_seconds.observe(elapsed, kind, name, outcome)
+            _add(kind, elapsed)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('metrics_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    if not METRICS_ENABLED:
+        return
+    db_query_seconds.observe(elapsed)
+    totals = _request.get()
+    if totals is not None:
+        totals["db"] = totals.get("db", 0.0) + elapsed
+        totals["db_queries"] = totals.get("db_queries", 0) + 1
+
+
+class MetricsMiddleware:
+    """
+    per route and status latency, database and outbound call totals of every http request.
+    routes are labelled with their path template, unmatched paths share one label
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.routes = {}
+
+    def route(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        path = self.routes.get(endpoint)
+        if path is None:
+            router = scope.get("router")
+            for route in getattr(router, "routes", []):
+                if getattr(route, "endpoint", None) is endpoint:
+                    path = route.path
+                    break
+            path = self.routes[endpoint] = path or endpoint.__name__
+        return path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        current_request.set(f'{scope["method"]} {scope["path"]}')
+        if not METRICS_ENABLED:
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        totals = {}
+        token = _request.set(totals)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request.reset(token)
+            labels = (scope["method"], self.route(scope), str(status[0]))
+            requests_seconds.observe(elapsed, *labels)
+            request_db_queries.observe(totals.pop("db_queries", 0), *labels)
+            for dependency, seconds in totals.items():
+                request_dependency_seconds.observe(seconds, *labels, dependency)
@@ -1,12 +1,45 @@
+import asyncio
+import json
 import os
+import threading
+import time
 from typing import List
+
 import requests
+from requests.adapters import HTTPAdapter
+from core import metrics
 from core.logger import log
 
 NOTIFICATION_PROVIDER = os.environ.get('NOTIFICATION_PROVIDER', "0f8c65d3-e4c4-4a89-b638-c31a8262e0fb")
 ZENOTIFY_BASE_URL = os.environ.get('ZENOTIFY_BASE_URL', "http://zenotify.zekoder.zestudio.zekoder.zekoder.net")
 ZENOTIFY_SERVICE_BASE_URL = os.environ.get('ZENOTIFY_SERVICE_BASE_URL',
                                            "http://zenotify-service.zekoder.zestudio.zekoder.zekoder.net")
+NOTIFICATION_TIMEOUT = float(os.environ.get('NOTIFICATION_TIMEOUT', 10))
+NOTIFICATION_CONCURRENCY = int(os.environ.get('NOTIFICATION_CONCURRENCY', 4))
+NOTIFICATION_QUEUE_SIZE = int(os.environ.get('NOTIFICATION_QUEUE_SIZE', 1000))
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 100))
+NOTIFICATION_BATCH_WINDOW = float(os.environ.get('NOTIFICATION_BATCH_WINDOW', 0.05))
+# max create calls per second across all dispatcher workers, 0 disables the limit
+NOTIFICATION_RATE_LIMIT = float(os.environ.get('NOTIFICATION_RATE_LIMIT', 0))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session() -> requests.Session:
+    """
+    keep-alive session shared by every zenotify call, sized for the dispatcher concurrency
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=2, pool_maxsize=NOTIFICATION_CONCURRENCY)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
 
 
 def create_notification(recipients: List[str], template: str, data: dict):
@@ -22,9 +55,10 @@ def create_notification(recipients: List[str], template: str, data: dict):
             "status": "",
             "last_error": ""
         }
-        resp = requests.post(f"{ZENOTIFY_BASE_URL}/notifications/", json=json_data)
+        with metrics.timed("notification", "create"):
+            resp = http_session().post(f"{ZENOTIFY_BASE_URL}/notifications/", json=json_data, timeout=NOTIFICATION_TIMEOUT)
         response = resp.json()
-        log.debug(f'Notification created success <{response["id"]}>')
+        log.debug('Notification created success <%s>', response["id"])
         return response
     except Exception as e:
         log.debug(e)
@@ -36,9 +70,183 @@ def send_notification(notification_id: str = None):
         'Content-Type': 'application/json',
     }
     json_data = {"notificationId": notification_id}
-    response = requests.post(f"{ZENOTIFY_SERVICE_BASE_URL}/send/email", json=json_data, headers=headers)
-    log.info(response)
+    try:
+        with metrics.timed("notification", "send"):
+            response = http_session().post(f"{ZENOTIFY_SERVICE_BASE_URL}/send/email", json=json_data, headers=headers,
+                                           timeout=NOTIFICATION_TIMEOUT)
+    except Exception as e:
+        log.debug(e)
+        log.error("Can not send notification <%s>", notification_id)
+        return False
     if response.status_code in [200, 201]:
-        log.debug(f'Notification sent!')
+        log.debug('Notification <%s> sent', notification_id)
+        return True
     else:
-        log.error(response.json())
+        log.error("Can not send notification <%s>: %s %s", notification_id, response.status_code, response.text)
+        return False
+
+
+def queue_notification(db, recipients: List[str], template: str, data: dict):
+    """
+    queue a notification in the outbox, it is delivered by outbox workers once the caller commits
+    """
+    from core.outbox import enqueue
+    return enqueue(db, "notification", {"recipients": recipients, "template": template, "data": data})
+
+
+def deliver_notification(db, payload: dict):
+    """
+    outbox handler, raising makes the event retried with backoff
+    """
+    notification = create_notification(payload["recipients"], payload["template"], payload["data"])
+    if not notification:
+        raise RuntimeError("Can not create notification!")
+    if not send_notification(notification["id"]):
+        raise RuntimeError(f"Can not send notification <{notification['id']}>")
+
+
+class RateLimiter:
+    """
+    token bucket shared by the dispatcher workers
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def group_notifications(items: list) -> list:
+    """
+    merge queued notifications sharing template and data into one create call with all recipients
+    """
+    groups = {}
+    for item in items:
+        key = (item["template"], json.dumps(item["data"], sort_keys=True, default=str))
+        group = groups.setdefault(key, {"template": item["template"], "data": item["data"], "recipients": [], "queued": []})
+        group["recipients"].extend(r for r in item["recipients"] if r not in group["recipients"])
+        group["queued"].append(item["queued"])
+    return list(groups.values())
+
+
+class NotificationDispatcher:
+    """
+    bounded in-memory queue drained by a few asyncio workers, blocking zenotify calls run in the
+    default executor over the shared keep-alive session
+    """
+
+    def __init__(self, concurrency: int = NOTIFICATION_CONCURRENCY, queue_size: int = NOTIFICATION_QUEUE_SIZE,
+                 batch_size: int = NOTIFICATION_BATCH_SIZE, batch_window: float = NOTIFICATION_BATCH_WINDOW,
+                 rate_limit: float = NOTIFICATION_RATE_LIMIT):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.limiter = RateLimiter(rate_limit)
+        self.queue = None
+        self.loop = None
+        self._tasks = []
+        self.stats = {
+            "queued": 0,
+            "dropped": 0,
+            "batches": 0,
+            "create_calls": 0,
+            "sent": 0,
+            "failed": 0,
+            "latency_seconds_sum": 0.0,
+            "latency_seconds_max": 0.0,
+        }
+
+    def start(self):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _offer(self, item: dict) -> bool:
+        try:
+            self.queue.put_nowait(item)
+            self.stats["queued"] += 1
+            return True
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            log.error("notification queue is full, notification dropped")
+            return False
+
+    def notify(self, recipients: List[str], template: str, data: dict) -> bool:
+        """
+        queue a notification without waiting for zenotify, returns False when the queue is full
+        so callers can fall back to the outbox
+        """
+        if not self._tasks:
+            log.error("notification dispatcher is not running")
+            return False
+        item = {"recipients": recipients, "template": template, "data": data, "queued": time.monotonic()}
+        try:
+            running = asyncio.get_event_loop() is self.loop
+        except RuntimeError:
+            running = False
+        if running:
+            return self._offer(item)
+        return asyncio.run_coroutine_threadsafe(self._offer_async(item), self.loop).result()
+
+    async def _offer_async(self, item: dict) -> bool:
+        return self._offer(item)
+
+    async def _batch(self) -> list:
+        items = [await self.queue.get()]
+        deadline = time.monotonic() + self.batch_window
+        while len(items) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+
+    def _deliver(self, group: dict) -> bool:
+        notification = create_notification(group["recipients"], group["template"], group["data"])
+        return bool(notification) and send_notification(notification["id"])
+
+    async def _work(self):
+        while True:
+            items = await self._batch()
+            self.stats["batches"] += 1
+            for group in group_notifications(items):
+                await self.limiter.acquire()
+                self.stats["create_calls"] += 1
+                delivered = await self.loop.run_in_executor(None, self._deliver, group)
+                self.stats["sent" if delivered else "failed"] += len(group["queued"])
+                now = time.monotonic()
+                for queued in group["queued"]:
+                    self.stats["latency_seconds_sum"] += now - queued
+                    self.stats["latency_seconds_max"] = max(self.stats["latency_seconds_max"], now - queued)
+            for _ in items:
+                self.queue.task_done()
+
+    def metrics(self) -> dict:
+        result = dict(self.stats)
+        result["queue_depth"] = self.queue.qsize() if self.queue else 0
+        return result
+
+
+dispatcher = NotificationDispatcher()
@@ -0,0 +1,234 @@
+import asyncio
+import importlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Column, String, Text, Integer, DATETIME, JSON
+
+from business import Base, db_session
+from core.logger import log
+
+OUTBOX_ENABLED = os.environ.get('OUTBOX_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 2))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 50))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', 1))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 8))
+OUTBOX_BACKOFF_BASE = float(os.environ.get('OUTBOX_BACKOFF_BASE', 2))
+OUTBOX_BACKOFF_MAX = float(os.environ.get('OUTBOX_BACKOFF_MAX', 600))
+# bearer token replayed hooks call other services with, user tokens are never written to the outbox
+OUTBOX_SERVICE_TOKEN = os.environ.get('OUTBOX_SERVICE_TOKEN', '')
+
+PENDING, DONE, DEAD = 'pending', 'done', 'dead'
+
+# topic -> "module.function" handling the event payload, imported on first use
+TOPICS = {
+    "hook": "core.outbox.replay_hook",
+    "notification": "core.notification.deliver_notification",
+}
+
+stats = {
+    "processed": 0,
+    "failed": 0,
+    "dead": 0,
+    "batches": 0,
+    "lag_seconds": 0.0,
+}
+
+
+class OutboxModel(Base):
+    __tablename__ = 'outbox'
+    __table_args__ = {'schema': 'public'}
+
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
+    topic = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default=PENDING, index=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    available_on = Column(DATETIME, nullable=False, default=datetime.utcnow)
+    created_on = Column(DATETIME, nullable=False, default=datetime.utcnow)
+    processed_on = Column(DATETIME)
+
+
+def _serializable(value):
+    if isinstance(value, dict):
+        value = {k: v for k, v in value.items() if not str(k).startswith('_')}
+    return jsonable_encoder(value)
+
+
+def enqueue(db, topic: str, payload: dict) -> OutboxModel:
+    """
+    add an event to the outbox, it is only visible to workers once the caller commits
+    """
+    event = OutboxModel(topic=topic, payload=_serializable(payload))
+    db.add(event)
+    return event
+
+
+def enqueue_hook(db, model, hook: str, signal_data: dict) -> OutboxModel:
+    """
+    queue a Manager post_* hook, the user is kept as id, roles and permissions instead of the token of the request
+    """
+    from core.depends import current_user_uuid, current_user_roles, current_user_permissions
+    return enqueue(db, "hook", {
+        "model": f"{model.__module__}.{model.__name__}",
+        "hook": hook,
+        "signal_data": {k: _serializable(v) for k, v in signal_data.items() if k not in ("runtime", "jwt")},
+        "user": {
+            "id": current_user_uuid(),
+            "roles": current_user_roles(),
+            "permissions": current_user_permissions(),
+        },
+    })
+
+
+def credentials(user: dict) -> str:
+    """
+    bearer token of a replayed hook of `user`, resolved when the hook runs
+    """
+    return OUTBOX_SERVICE_TOKEN or None
+
+
+def replay_hook(db, payload: dict):
+    """
+    run a Manager post_* hook on behalf of the user that triggered it
+    """
+    from core.depends import user_session, user_roles, user_permissions
+    user = payload.get("user", {})
+    user_session.set(user.get("id"))
+    user_roles.set(user.get("roles", []))
+    user_permissions.set(user.get("permissions", []))
+    module_name, model_name = payload["model"].rsplit('.', 1)
+    model = getattr(importlib.import_module(module_name), model_name)
+    manager = model.objects(db)
+    signal_data = {**payload["signal_data"], "jwt": credentials(user)}
+    runtime = manager.runtime(signal_data)
+    getattr(manager, payload["hook"])(**signal_data)
+    return runtime
+
+
+def _handler(topic: str):
+    module_name, func = TOPICS[topic].rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func)
+
+
+def backoff(attempts: int) -> float:
+    return min(OUTBOX_BACKOFF_BASE ** attempts, OUTBOX_BACKOFF_MAX)
+
+
+def drain_once(batch_size: int = OUTBOX_BATCH_SIZE) -> int:
+    """
+    claim and process one batch of due events, returns the number of claimed events
+    """
+    db = db_session()
+    runtimes = []
+    try:
+        now = datetime.utcnow()
+        events = db.query(OutboxModel).filter(
+            OutboxModel.status == PENDING,
+            OutboxModel.available_on <= now
+        ).order_by(OutboxModel.created_on).limit(batch_size).with_for_update(skip_locked=True).all()
+        if events:
+            stats["lag_seconds"] = (now - events[0].created_on).total_seconds()
+        else:
+            stats["lag_seconds"] = 0.0
+        for event in events:
+            event.attempts += 1
+            try:
+                with db.begin_nested():
+                    runtime = _handler(event.topic)(db, event.payload)
+                if runtime is not None:
+                    runtimes.append(runtime)
+                event.status = DONE
+                event.processed_on = datetime.utcnow()
+                stats["processed"] += 1
+            except Exception as e:
+                log.debug(e)
+                stats["failed"] += 1
+                event.last_error = str(e)
+                if event.attempts >= OUTBOX_MAX_ATTEMPTS:
+                    event.status = DEAD
+                    stats["dead"] += 1
+                    log.error("outbox event <%s> moved to dead letter after %s attempts", event.id, event.attempts)
+                else:
+                    event.available_on = datetime.utcnow() + timedelta(seconds=backoff(event.attempts))
+        db.commit()
+        for runtime in runtimes:
+            runtime.run_deferred()
+        stats["batches"] += 1
+        return len(events)
+    except Exception as e:
+        db.rollback()
+        log.error("outbox drain failed")
+        log.debug(e)
+        return 0
+    finally:
+        db.close()
+
+
+def requeue_dead(db, ids: list = None) -> int:
+    """
+    move dead letter events back to pending, all of them when no ids are given
+    """
+    query = db.query(OutboxModel).filter(OutboxModel.status == DEAD)
+    if ids:
+        query = query.filter(OutboxModel.id.in_(ids))
+    count = query.update({"status": PENDING, "attempts": 0, "available_on": datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    return count
+
+
+def metrics(db=None) -> dict:
+    """
+    worker counters plus pending/dead backlog read from the table
+    """
+    result = dict(stats)
+    close = db is None
+    db = db or db_session()
+    try:
+        result["pending"] = db.query(OutboxModel).filter(OutboxModel.status == PENDING).count()
+        result["dead_letter"] = db.query(OutboxModel).filter(OutboxModel.status == DEAD).count()
+    except Exception as e:
+        log.debug(e)
+    finally:
+        if close:
+            db.close()
+    return result
+
+
+class OutboxWorkerPool:
+    """
+    asyncio tasks draining the outbox, database work runs in the default executor
+    """
+
+    def __init__(self, workers: int = OUTBOX_WORKERS, poll_interval: float = OUTBOX_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._tasks = []
+        self._running = False
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+        while self._running:
+            started = time.monotonic()
+            claimed = await loop.run_in_executor(None, drain_once)
+            if not claimed:
+                await asyncio.sleep(max(self.poll_interval - (time.monotonic() - started), 0))
+
+    def start(self):
+        self._running = True
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+        log.info("outbox started with %s workers", self.workers)
+
+    async def stop(self):
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+pool = OutboxWorkerPool()
@@ -0,0 +1,67 @@
+"""
+row level policies of postgres and cockroachdb read the user of a session from the session
+variables zekoder.id and zekoder.roles, Manager sets them for the user of the request
+"""
+import os
+from contextlib import contextmanager
+
+from core.logger import log
+
+SESSION_VARIABLE_DIALECTS = ("postgresql", "cockroachdb")
+# role with BYPASSRLS the database user is a member of, statements needing every row of a table run as it
+ROW_SECURITY_BYPASS_ROLE = os.environ.get('ROW_SECURITY_BYPASS_ROLE', '')
+
+_row_security = {}
+
+
+def session_variables(user_id, roles, local: bool = False) -> list:
+    """
+    statements setting the session variables of a user, `local` ones last until the transaction ends
+    """
+    scope = "SET LOCAL" if local else "SET"
+    return [f"{scope} zekoder.id = '{user_id}'", f"{scope} zekoder.roles = '{','.join(roles or [])}'"]
+
+
+def set_user(db, user_id, roles, local: bool = False):
+    if db.get_bind().dialect.name in SESSION_VARIABLE_DIALECTS:
+        for statement in session_variables(user_id, roles, local):
+            db.execute(statement)
+
+
+def row_security(db, table) -> bool:
+    """
+    whether row level security is enabled on `table`, asked once per table
+    """
+    if table.name not in _row_security:
+        enabled = False
+        if db.get_bind().dialect.name in SESSION_VARIABLE_DIALECTS:
+            name = f"{table.schema}.{table.name}" if table.schema else table.name
+            try:
+                with db.begin_nested():
+                    enabled = bool(db.execute(
+                        "SELECT relrowsecurity FROM pg_class WHERE oid = to_regclass(:name)", {"name": name}
+                    ).scalar())
+            except Exception as e:
+                log.debug(e)
+                # policies can not be told apart, assume there are some
+                enabled = True
+        _row_security[table.name] = enabled
+    return _row_security[table.name]
+
+
+@contextmanager
+def unrestricted(db, table):
+    """
+    statements inside read every row of `table`, as ROW_SECURITY_BYPASS_ROLE for the rest of the block
+    when the table has row level security. a failing block leaves the role to the rollback
+    """
+    if not row_security(db, table):
+        yield
+        return
+    if not ROW_SECURITY_BYPASS_ROLE:
+        raise RuntimeError(f"reading every row of <{table.name}> under row level security needs ROW_SECURITY_BYPASS_ROLE")
+    quote = db.get_bind().dialect.identifier_preparer.quote
+    previous = db.execute("SELECT current_setting('role')").scalar()
+    db.execute(f"SET LOCAL ROLE {quote(ROW_SECURITY_BYPASS_ROLE)}")
+    yield
+    db.execute(f"SET LOCAL ROLE {'NONE' if previous in (None, 'none') else quote(previous)}")
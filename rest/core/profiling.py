@@ -0,0 +1,275 @@
+"""
+request profiling on demand and an optional always-on sampling profiler.
+
+a request sent with `X-Profile: <PROFILE_SECRET>` runs under cProfile, the profile is stored in
+PROFILE_DIR and its id returned in the X-Profile-Id response header. with PROFILE_SAMPLER on, a
+thread samples the stacks of every thread and writes them every PROFILE_DUMP_INTERVAL seconds in
+the folded format read by flamegraph.pl and speedscope
+"""
+import asyncio
+import hmac
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+
+from core.logger import log
+from core.metrics import current_request
+
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/profiles')
+PROFILE_SAMPLER = os.environ.get('PROFILE_SAMPLER', 'false').lower() in ('1', 'true', 'yes')
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', 0.02))
+PROFILE_DUMP_INTERVAL = float(os.environ.get('PROFILE_DUMP_INTERVAL', 60))
+PROFILE_MAX_DEPTH = int(os.environ.get('PROFILE_MAX_DEPTH', 64))
+
+# route and user of the request being served, Protect adds the user once it is verified
+request_meta: ContextVar[dict] = ContextVar('profiling_request_meta', default=None)
+# asyncio task -> request_meta, the sampler runs in another thread and can not read contextvars
+_tasks = {}
+_loop_threads = {}
+# number of users of the task mapping, the sampler and the loop monitor
+_tracking = 0
+
+
+def track_tasks(enabled: bool):
+    global _tracking
+    _tracking = max(_tracking + (1 if enabled else -1), 0)
+
+
+def task_meta(task):
+    return _tasks.get(task)
+
+
+def tag(**fields):
+    meta = request_meta.get()
+    if meta is not None:
+        meta.update(fields)
+
+
+def _path(name: str) -> str:
+    return os.path.join(PROFILE_DIR, name)
+
+
+def _save(profile_id: str, profiler, meta: dict):
+    import pstats
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(_path(f"{profile_id}.prof"))
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(60)
+    with open(_path(f"{profile_id}.txt"), "w") as f:
+        f.write(report.getvalue())
+    with open(_path(f"{profile_id}.json"), "w") as f:
+        json.dump(meta, f, default=str)
+
+
+def profiles() -> list:
+    """
+    metadata of the stored request profiles, newest first
+    """
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    result = []
+    for name in os.listdir(PROFILE_DIR):
+        if name.endswith(".json") and not name.startswith("stacks-"):
+            with open(_path(name)) as f:
+                result.append(json.load(f))
+    return sorted(result, key=lambda meta: meta.get("at", ""), reverse=True)
+
+
+def profile_file(profile_id: str, kind: str = "txt"):
+    """
+    path of a stored profile, None for unknown ids
+    """
+    try:
+        uuid.UUID(profile_id)
+    except ValueError:
+        return None
+    path = _path(f"{profile_id}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    keeps route and user of every request for the sampler, and profiles requests carrying the
+    X-Profile header. cProfile sees every coroutine the loop runs meanwhile, so profiles of a
+    busy worker include some work of other requests
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.busy = threading.Lock()
+        self.secret = PROFILE_SECRET.encode()
+
+    def _requested(self, scope) -> bool:
+        if not self.secret:
+            return False
+        for key, value in scope["headers"]:
+            if key == b"x-profile":
+                return hmac.compare_digest(value, self.secret)
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        meta = {"route": current_request.get() or f'{scope["method"]} {scope["path"]}'}
+        request_meta.set(meta)
+        task = None
+        if _tracking:
+            task = asyncio.current_task()
+            _tasks[task] = meta
+            _loop_threads[threading.get_ident()] = asyncio.get_event_loop()
+        try:
+            if self._requested(scope) and self.busy.acquire(blocking=False):
+                try:
+                    await self._profile(scope, receive, send, meta)
+                finally:
+                    self.busy.release()
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            if task is not None:
+                _tasks.pop(task, None)
+
+    async def _profile(self, scope, receive, send, meta: dict):
+        import cProfile
+        profile_id = str(uuid.uuid4())
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            meta.update(
+                id=profile_id, at=datetime.utcnow().isoformat(), status=status[0], pid=os.getpid(),
+                duration_ms=round((time.perf_counter() - started) * 1000, 2),
+            )
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, _save, profile_id, profiler, dict(meta))
+                log.info("request profile <%s> stored for <%s>", profile_id, meta["route"])
+            except Exception as e:
+                log.error("could not store request profile")
+                log.debug(e)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+class StackSampler:
+    """
+    samples the stack of every thread, stacks of the event loop thread are prefixed with the
+    route of the task running at that moment
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, dump_interval: float = PROFILE_DUMP_INTERVAL):
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.stacks = Counter()
+        self.requests = Counter()
+        self.samples = 0
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        track_tasks(True)
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        log.info("stack sampler started, one sample every %s s", self.interval)
+
+    def stop(self):
+        if self.running:
+            track_tasks(False)
+        self.running = False
+        if self._thread:
+            self._thread.join(self.interval * 5)
+            self._thread = None
+        self.dump()
+
+    def _meta(self, thread_id: int):
+        loop = _loop_threads.get(thread_id)
+        if loop is None:
+            return None
+        return task_meta(getattr(asyncio.tasks, "_current_tasks", {}).get(loop))
+
+    def sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < PROFILE_MAX_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            meta = self._meta(thread_id)
+            if meta:
+                root = meta["route"]
+                self.requests[(meta["route"], meta.get("user"))] += 1
+            else:
+                root = names.get(thread_id, str(thread_id))
+            stack.append(root)
+            self.stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self):
+        last_dump = time.monotonic()
+        while self.running:
+            try:
+                self.sample()
+            except Exception as e:
+                log.debug(e)
+            if time.monotonic() - last_dump >= self.dump_interval:
+                self.dump()
+                last_dump = time.monotonic()
+            time.sleep(self.interval)
+
+    def dump(self):
+        """
+        write and reset the folded stacks, the json next to them counts samples per route and user
+        """
+        if not self.samples:
+            return None
+        stacks, requests, samples = self.stacks, self.requests, self.samples
+        self.stacks, self.requests, self.samples = Counter(), Counter(), 0
+        name = f"stacks-{os.getpid()}-{int(time.time())}"
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(_path(f"{name}.folded"), "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+            with open(_path(f"{name}.json"), "w") as f:
+                json.dump({
+                    "samples": samples,
+                    "interval": self.interval,
+                    "requests": [
+                        {"route": route, "user": user, "samples": count}
+                        for (route, user), count in requests.most_common()
+                    ],
+                }, f)
+            return _path(f"{name}.folded")
+        except OSError as e:
+            log.error("could not write sampled stacks")
+            log.debug(e)
+
+
+sampler = StackSampler()
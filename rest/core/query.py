@@ -2,22 +2,34 @@ import datetime
 from typing import Optional, Union, List, Any
 
 from fastapi import HTTPException, status
-from mongosql import MongoQuery, InvalidColumnError, MongoQuerySettingsDict
-from mongosql.handlers import MongoFilter
 from pydantic import BaseModel, Field
 from sqlalchemy.orm import Session
 
+from . import rollups
 from .logger import log
-
-# add custom $contains filter handler in py-mongosql
-MongoFilter.add_scalar_operator(
-    '$contains',
-    lambda col, val, oval: col.ilike(val)
-)
-MongoFilter.add_scalar_operator(
-    '$like',
-    lambda col, val, oval: col.like(val)
-)
+from .slow_queries import origin, shape
+
+_mongosql = None
+
+
+def mongosql():
+    """
+    import py-mongosql on first query and add the custom $contains and $like filter handlers
+    """
+    global _mongosql
+    if _mongosql is None:
+        import mongosql as module
+        from mongosql.handlers import MongoFilter
+        MongoFilter.add_scalar_operator(
+            '$contains',
+            lambda col, val, oval: col.ilike(val)
+        )
+        MongoFilter.add_scalar_operator(
+            '$like',
+            lambda col, val, oval: col.like(val)
+        )
+        _mongosql = module
+    return _mongosql
 
 
 class ColumnNotFound(Exception):
@@ -105,28 +117,49 @@ class JSONQ:
         self.session = session
 
     def query(self, req: QuerySchema, allowed_aggregates: list[str]):
+        with origin(lambda: f"jsonq {self.model.__tablename__} {shape(req.dict(by_alias=True, exclude_none=True))}"):
+            return self._query(req, allowed_aggregates)
+
+    def _from_rollup(self, aggregate: dict, group: list, query_filter: dict):
+        """
+        aggregates read from a rollup of the model, None when no rollup covers the request
+        """
+        for rollup in rollups.of(self.model):
+            columns = rollup.expressions(aggregate, group)
+            if columns is None or not rollup.filterable(query_filter) or not rollup.active(self.session):
+                continue
+            query = self.session.query(rollup.Model)
+            if query_filter:
+                query = mongosql().MongoQuery(rollup.Model).with_session(self.session).query(filter=query_filter).end()
+            return query.with_entities(*columns).group_by(*[rollup.table.c[field] for field in group]).all()
+
+    def _query(self, req: QuerySchema, allowed_aggregates: list[str]):
+        ms = mongosql()
+        MongoQuery = ms.MongoQuery
         result, aggregates, count = None, None, None
         if req.count:
             count = MongoQuery(self.model).with_session(self.session).query(**req.dict(
                 by_alias=True,
+                exclude={"aggregate"},
                 exclude_none=True
             )).end().first()
         if req.aggregate:
-            aggregates_group = req.aggregate.get("group", [])
-            if aggregates_group:
-                del req.aggregate["group"]
-            aggregates = MongoQuery(self.model, MongoQuerySettingsDict(
-                aggregate_columns=allowed_aggregates,
-                aggregate_labels=True,
-            )).with_session(self.session).query(
-                filter=req.filter,
-                aggregate=req.aggregate,
-                group=aggregates_group
-            ).end().all()
+            aggregates_group = req.aggregate.pop("group", None) or []
+            query_filter = req.dict(by_alias=True, include={"filter"}, exclude_none=True).get("filter")
+            aggregates = self._from_rollup(req.aggregate, aggregates_group, query_filter)
+            if aggregates is None:
+                aggregates = MongoQuery(self.model, ms.MongoQuerySettingsDict(
+                    aggregate_columns=allowed_aggregates,
+                    aggregate_labels=True,
+                )).with_session(self.session).query(
+                    filter=query_filter,
+                    aggregate=req.aggregate,
+                    group=aggregates_group
+                ).end().all()
         query = req.dict(by_alias=True, exclude={"count", "aggregate"}, exclude_none=True)
         try:
             result = MongoQuery(self.model).with_session(self.session).query(**query).end().all()
-        except InvalidColumnError as e:
+        except ms.InvalidColumnError as e:
             log.debug(e)
             raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail={
                 "field_name": e.where,
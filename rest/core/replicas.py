@@ -0,0 +1,101 @@
+"""
+read replica routing. read only routes get a session on a healthy replica unless the client wrote
+within the last DB_REPLICA_STICKY_SECONDS, read your writes: every commit on the primary during a
+request sets the DB_STICKY_COOKIE cookie and the X-Last-Write header to the commit time, clients
+sending either back are served from the primary until the replicas have caught up.
+
+a background task runs `SELECT 1` on every replica each DB_REPLICA_CHECK_INTERVAL seconds and, on
+postgres with DB_REPLICA_MAX_LAG set, takes replicas replaying further behind out of rotation
+"""
+import asyncio
+import os
+import time
+
+from sqlalchemy import event
+
+import business
+from core.logger import log
+
+DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', 5))
+DB_REPLICA_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_CHECK_INTERVAL', 10))
+DB_REPLICA_MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', 0))
+DB_STICKY_COOKIE = os.environ.get('DB_STICKY_COOKIE', 'zk_last_write')
+LAST_WRITE_HEADER = "x-last-write"
+LAG_QUERY = "SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)"
+
+
+def enabled() -> bool:
+    return bool(business.get_replicas())
+
+
+def last_write(request) -> float:
+    """
+    commit time the client last saw, 0 when unknown
+    """
+    value = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(DB_STICKY_COOKIE)
+    try:
+        return float(value) if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def sticky(request) -> bool:
+    return time.time() - last_write(request) < DB_REPLICA_STICKY_SECONDS
+
+
+def track_writes(db, response):
+    """
+    stamp the response with the time of every commit of the session
+    """
+    @event.listens_for(db, "after_commit")
+    def _committed(session):
+        stamp = f"{time.time():.3f}"
+        response.headers[LAST_WRITE_HEADER] = stamp
+        response.set_cookie(DB_STICKY_COOKIE, stamp, max_age=int(DB_REPLICA_STICKY_SECONDS) + 1, httponly=True)
+
+
+def check(engine) -> bool:
+    try:
+        with engine.connect() as connection:
+            connection.execute("SELECT 1")
+            if DB_REPLICA_MAX_LAG and engine.dialect.name == "postgresql":
+                lag = connection.execute(LAG_QUERY).scalar()
+                if lag is not None and float(lag) > DB_REPLICA_MAX_LAG:
+                    log.warning("db replica <%s> is %.1f s behind", engine.url.host or engine.url.database, float(lag))
+                    return False
+        return True
+    except Exception as e:
+        log.debug(e)
+        return False
+
+
+class HealthCheck:
+    def __init__(self, interval: float = DB_REPLICA_CHECK_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def check_all(self):
+        for replica in business.get_replicas():
+            business.set_replica_health(replica, check(replica))
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.check_all)
+            except Exception as e:
+                log.debug(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and business.get_replicas():
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+health = HealthCheck()
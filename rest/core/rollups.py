@@ -0,0 +1,398 @@
+"""
+aggregate rollups declared per entity in data.yaml:
+
+    rollups:
+      by_type:
+        group: [type]
+        columns: [capacity]
+        public: false
+
+every rollup is a table rollup_<plural>_<name> with one row per group holding the row count and the
+sum, non null count, min and max of every column. Manager writes add the difference they make to
+the groups they touch in the same transaction, min and max are counted again from the entity table
+only for groups losing their smallest or largest value. bulk imports writing past Manager rebuild
+the rollups of the entity, so does POST /admin/rollups/<entity>/rebuild.
+
+missing rollup tables are created while the app warms up and counted from their entity table, a
+rollup whose table can not be created stays off: writes skip it and aggregates are counted from
+the entity table.
+
+JSONQ answers `aggregate` requests from a rollup when the grouped, aggregated and filtered columns
+all belong to it. rollups count every row, row level policies do not apply to them: a rollup of a
+table with row level security is only kept when it is declared `public: true` and
+ROW_SECURITY_BYPASS_ROLE is set, recounts then run as that role instead of the writer. otherwise the
+aggregate is counted from the entity table under the policies of the caller
+"""
+import json
+from collections import Counter
+
+from sqlalchemy import ARRAY, JSON, BigInteger, Column, Float, Integer, Numeric, String, and_, case, cast, func, or_, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+
+from business import Base, db_session
+from core import policies, triggers
+from core.logger import log
+
+UPSERT_DIALECTS = ("postgresql", "cockroachdb")
+
+_definitions = None
+_rollups = {}
+
+
+def definitions() -> dict:
+    """
+    {plural: {name: definition}} out of the `rollups` section of every entity in data.yaml
+    """
+    global _definitions
+    if _definitions is None:
+        _definitions = {}
+        for name, entity in triggers.data_yaml().items():
+            entity = entity or {}
+            if entity.get("rollups"):
+                _definitions[entity.get("plural", f"{name}s")] = entity["rollups"]
+    return _definitions
+
+
+def _values(row, fields: list) -> dict:
+    if isinstance(row, dict):
+        return {field: row.get(field) for field in fields}
+    return {field: getattr(row, field) for field in fields}
+
+
+def _total(values: Counter):
+    return sum(value * times for value, times in values.items())
+
+
+class _Delta:
+    """
+    what the writes of one transaction change in one group
+    """
+
+    def __init__(self, values: dict, columns: list):
+        self.values = values
+        self.rows = 0
+        self.added = {field: Counter() for field in columns}
+        self.removed = {field: Counter() for field in columns}
+
+    def add(self, sign: int, values: dict):
+        self.rows += sign
+        for field, counter in (self.added if sign > 0 else self.removed).items():
+            if values[field] is not None:
+                counter[values[field]] += 1
+
+    def settle(self) -> bool:
+        """
+        cancel out values both removed and added, False when nothing is left
+        """
+        for field in self.added:
+            added, removed = self.added[field], self.removed[field]
+            self.added[field], self.removed[field] = added - removed, removed - added
+        return bool(self.rows or any(self.added.values()) or any(self.removed.values()))
+
+
+class Rollup:
+    def __init__(self, model, name: str, group: list, columns: list, public: bool = False):
+        self.entity = model.__table__
+        self.name = name
+        self.public = public
+        self.group = list(group)
+        self.columns = list(columns)
+        self.fields = list(dict.fromkeys(self.group + self.columns))
+        attrs = {
+            "__tablename__": f"rollup_{self.entity.name}_{name}",
+            "__table_args__": {"schema": self.entity.schema},
+            "key": Column(String, primary_key=True),
+            "row_count": Column(BigInteger, nullable=False),
+        }
+        for field in self.group:
+            attrs[field] = Column(self.entity.c[field].type.copy())
+        for field in self.columns:
+            column_type = self.entity.c[field].type
+            attrs[f"sum_{field}"] = Column(BigInteger if isinstance(column_type, Integer) else column_type.copy())
+            attrs[f"count_{field}"] = Column(BigInteger, nullable=False)
+            attrs[f"min_{field}"] = Column(column_type.copy())
+            attrs[f"max_{field}"] = Column(column_type.copy())
+        class_name = model.__name__ + "".join(part.capitalize() for part in name.split("_")) + "Rollup"
+        self.Model = type(class_name, (Base,), attrs)
+        self.table = self.Model.__table__
+        self.exists = None
+        self._warned = False
+
+    def _table_exists(self, db) -> bool:
+        connection = db.connection()
+        return connection.dialect.has_table(connection, self.table.name, schema=self.table.schema)
+
+    def available(self, db) -> bool:
+        """
+        whether the rollup table exists, asked once until create_tables runs
+        """
+        if self.exists is None:
+            self.exists = self._table_exists(db)
+            if not self.exists:
+                log.warning("rollup <%s> of <%s> is off until its table <%s> is created", self.name, self.entity.name, self.table.name)
+        return self.exists
+
+    def create(self, db):
+        """
+        create the rollup table and count it from the entity table, in one transaction
+        """
+        self.table.create(db.connection())
+        self.rebuild(db)
+        db.commit()
+
+    def key(self, values) -> str:
+        return json.dumps([values[field] for field in self.group], default=str)
+
+    def _match(self, values: dict):
+        c = self.entity.c
+        return and_(*[c[field].is_(None) if value is None else c[field] == value for field, value in values.items()])
+
+    def _aggregates(self) -> list:
+        c = self.entity.c
+        columns = [func.count().label("row_count")]
+        for field in self.columns:
+            columns += [
+                func.sum(c[field]).label(f"sum_{field}"), func.count(c[field]).label(f"count_{field}"),
+                func.min(c[field]).label(f"min_{field}"), func.max(c[field]).label(f"max_{field}"),
+            ]
+        return columns
+
+    def _count(self, db, values: dict) -> dict:
+        """
+        the rollup row of one group counted from the entity table
+        """
+        with policies.unrestricted(db, self.entity):
+            row = db.execute(select(self._aggregates()).select_from(self.entity).where(self._match(values))).first()
+        return {**values, **dict(row)}
+
+    def _changes(self, delta: _Delta) -> dict:
+        c = self.table.c
+        changes = {"row_count": c.row_count + delta.rows}
+        for field in self.columns:
+            added, removed = delta.added[field], delta.removed[field]
+            if not added and not removed:
+                continue
+            changes[f"sum_{field}"] = func.coalesce(c[f"sum_{field}"], 0) + (_total(added) - _total(removed))
+            changes[f"count_{field}"] = c[f"count_{field}"] + (sum(added.values()) - sum(removed.values()))
+            if added:
+                low, high = c[f"min_{field}"], c[f"max_{field}"]
+                changes[f"min_{field}"] = case([(or_(low.is_(None), low > min(added)), min(added))], else_=low)
+                changes[f"max_{field}"] = case([(or_(high.is_(None), high < max(added)), max(added))], else_=high)
+        return changes
+
+    def _row(self, key: str, delta: _Delta) -> dict:
+        """
+        the rollup row of a group that had none
+        """
+        row = {"key": key, **delta.values, "row_count": delta.rows}
+        for field in self.columns:
+            added, removed = delta.added[field], delta.removed[field]
+            row[f"count_{field}"] = sum(added.values()) - sum(removed.values())
+            row[f"sum_{field}"] = _total(added) - _total(removed) if added or removed else None
+            row[f"min_{field}"], row[f"max_{field}"] = (min(added), max(added)) if added else (None, None)
+        return row
+
+    def _refresh(self, db, key: str, values: dict):
+        row = self._count(db, values)
+        if row["row_count"]:
+            db.execute(self.table.update().where(self.table.c.key == key).values(row))
+        else:
+            db.execute(self.table.delete().where(self.table.c.key == key))
+
+    def _update(self, db, key: str, delta: _Delta) -> bool:
+        return bool(db.execute(self.table.update().where(self.table.c.key == key).values(self._changes(delta))).rowcount)
+
+    def _apply(self, db, key: str, delta: _Delta):
+        if delta.rows > 0 and db.get_bind().dialect.name in UPSERT_DIALECTS:
+            db.execute(postgresql.insert(self.table).values(self._row(key, delta)).on_conflict_do_update(
+                index_elements=[self.table.c.key], set_=self._changes(delta)
+            ))
+        elif not self._update(db, key, delta):
+            if delta.rows > 0:
+                try:
+                    with db.begin_nested():
+                        db.execute(self.table.insert().values(self._row(key, delta)))
+                except IntegrityError:
+                    self._update(db, key, delta)
+            return
+        removed = [field for field in self.columns if delta.removed[field]]
+        if not removed and delta.rows >= 0:
+            return
+        c = self.table.c
+        stored = db.execute(select([self.table]).where(c.key == key)).first()
+        if stored.row_count <= 0 or any(
+            min(delta.removed[field]) <= stored[f"min_{field}"] or max(delta.removed[field]) >= stored[f"max_{field}"]
+            for field in removed if stored[f"count_{field}"]
+        ):
+            self._refresh(db, key, delta.values)
+
+    def apply(self, db, old: list, new: list):
+        deltas = {}
+        for sign, rows in ((-1, old), (1, new)):
+            for row in rows:
+                values = _values(row, self.fields)
+                key = self.key(values)
+                if key not in deltas:
+                    deltas[key] = _Delta({field: values[field] for field in self.group}, self.columns)
+                deltas[key].add(sign, values)
+        # a fixed order, concurrent writers lock the rows of a rollup in the same order
+        for key in sorted(deltas):
+            if deltas[key].settle():
+                self._apply(db, key, deltas[key])
+
+    def rebuild(self, db):
+        group = [self.entity.c[field] for field in self.group]
+        with policies.unrestricted(db, self.entity):
+            rows = db.execute(select(group + self._aggregates()).select_from(self.entity).group_by(*group)).fetchall()
+        db.execute(self.table.delete())
+        if rows:
+            db.execute(self.table.insert(), [{"key": self.key(row), **dict(row)} for row in rows])
+
+    def active(self, db) -> bool:
+        """
+        whether the rollup is kept and answers requests, rows hidden by row level policies are counted in it
+        """
+        if not self.available(db):
+            return False
+        if not policies.row_security(db, self.entity):
+            return True
+        if self.public and not policies.ROW_SECURITY_BYPASS_ROLE and not self._warned:
+            self._warned = True
+            log.error("rollup <%s> of <%s> is off, it can not be recounted under row level security without ROW_SECURITY_BYPASS_ROLE", self.name, self.entity.name)
+        return self.public and bool(policies.ROW_SECURITY_BYPASS_ROLE)
+
+    def filterable(self, query_filter) -> bool:
+        if not query_filter:
+            return True
+        if not isinstance(query_filter, dict):
+            return False
+        for key, condition in query_filter.items():
+            if key in ("$or", "$and", "$nor"):
+                if not isinstance(condition, list) or not all(self.filterable(option) for option in condition):
+                    return False
+            elif key not in self.group:
+                return False
+        return True
+
+    def expressions(self, aggregate: dict, group: list):
+        """
+        the columns answering a JSONQ `aggregate` from this rollup, None when it can not
+        """
+        if not set(group) <= set(self.group):
+            return None
+        c = self.table.c
+        columns = []
+        for label, expression in aggregate.items():
+            if isinstance(expression, str):
+                if expression not in group:
+                    return None
+                columns.append(c[expression].label(label))
+                continue
+            if not isinstance(expression, dict) or len(expression) != 1:
+                return None
+            operator, operand = next(iter(expression.items()))
+            if operator == "$sum" and isinstance(operand, int):
+                column = func.sum(c.row_count) * operand
+            elif not isinstance(operand, str) or operand not in self.columns:
+                return None
+            elif operator == "$sum":
+                column = func.sum(case([(c[f"count_{operand}"] > 0, c[f"sum_{operand}"])]))
+            elif operator == "$min":
+                column = func.min(c[f"min_{operand}"])
+            elif operator == "$max":
+                column = func.max(c[f"max_{operand}"])
+            elif operator == "$avg":
+                column = cast(func.sum(c[f"sum_{operand}"]), Float) / func.nullif(func.sum(c[f"count_{operand}"]), 0)
+            else:
+                return None
+            columns.append(column.label(label))
+        return columns
+
+
+def declare(model):
+    """
+    define the rollup tables of an entity model, runs while the model class is created
+    """
+    table = model.__table__
+    for name, definition in (definitions().get(table.name) or {}).items():
+        group, columns = (definition or {}).get("group") or [], (definition or {}).get("columns") or []
+        unknown = [field for field in group + columns if field not in table.c]
+        if unknown:
+            log.error("rollup <%s> of <%s> has unknown columns %s", name, table.name, unknown)
+            continue
+        if any(isinstance(table.c[field].type, (JSON, ARRAY)) for field in group):
+            log.error("rollup <%s> of <%s> can not group by json or array columns", name, table.name)
+            continue
+        if not all(isinstance(table.c[field].type, (Integer, Numeric)) for field in columns):
+            log.error("rollup <%s> of <%s> can only aggregate numeric columns", name, table.name)
+            continue
+        public = bool((definition or {}).get("public"))
+        _rollups.setdefault(table.name, []).append(Rollup(model, name, group, columns, public))
+
+
+def of(model) -> list:
+    return _rollups.get(model.__tablename__, [])
+
+
+def active(db, model) -> list:
+    """
+    rollups of `model` kept up to date
+    """
+    return [rollup for rollup in of(model) if rollup.active(db)]
+
+
+def create_tables():
+    """
+    create the missing rollup tables and count them from their entity table, runs while the app warms up
+    """
+    for rollup in [rollup for declared in _rollups.values() for rollup in declared]:
+        db = db_session()
+        try:
+            if not rollup._table_exists(db):
+                rollup.create(db)
+                log.info("created rollup table <%s>", rollup.table.name)
+            rollup.exists = True
+        except Exception as e:
+            db.rollback()
+            log.debug(e)
+            # another worker may have created it meanwhile
+            rollup.exists = rollup._table_exists(db)
+            if not rollup.exists:
+                log.error("can not create rollup table <%s>, rollup <%s> of <%s> is off", rollup.table.name, rollup.name, rollup.entity.name)
+        finally:
+            db.close()
+
+
+def columns(model) -> list:
+    """
+    columns JSONQ may aggregate, the ones covered by a rollup
+    """
+    return list(dict.fromkeys(field for rollup in of(model) for field in rollup.fields))
+
+
+def snapshot(db, model, criterion) -> list:
+    """
+    rollup columns of the rows matching `criterion`, taken before they are updated or deleted
+    """
+    fields = list(dict.fromkeys(field for rollup in active(db, model) for field in rollup.fields))
+    if not fields:
+        return []
+    table = model.__table__
+    return [dict(row) for row in db.execute(select([table.c[field] for field in fields]).where(criterion))]
+
+
+def apply(db, model, old: list = (), new: list = ()):
+    """
+    update the rollups of `model` for rows going from `old` to `new`, once the write has run
+    """
+    for rollup in active(db, model):
+        rollup.apply(db, old, new)
+
+
+def rebuild(db, model):
+    """
+    count the rollups of `model` again from the entity table
+    """
+    for rollup in active(db, model):
+        rollup.rebuild(db)
@@ -0,0 +1,140 @@
+"""
+production launcher, a gunicorn master imports the app once and forks uvicorn workers:
+
+    python -m core.server
+
+workers share the imported code copy-on-write, every worker opens its own db pool sized
+from DB_CONNECTION_BUDGET and is replaced after WORKER_MAX_REQUESTS requests or once it
+grows past WORKER_MAX_MEMORY_MB
+"""
+import os
+import signal
+
+from core.logger import log
+
+HOST = os.environ.get('HOST', '0.0.0.0')
+PORT = int(os.environ.get('PORT', 5000))
+WORKERS = int(os.environ.get('WORKERS', os.cpu_count() or 1))
+# connections the database grants this service, shared by every worker
+DB_CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', 0))
+# part of a worker's share kept open, the rest is overflow opened under load
+DB_POOL_RATIO = float(os.environ.get('DB_POOL_RATIO', 0.5))
+WORKER_MAX_REQUESTS = int(os.environ.get('WORKER_MAX_REQUESTS', 10000))
+WORKER_MAX_REQUESTS_JITTER = int(os.environ.get('WORKER_MAX_REQUESTS_JITTER', 1000))
+WORKER_MAX_MEMORY_MB = float(os.environ.get('WORKER_MAX_MEMORY_MB', 0))
+WORKER_MEMORY_CHECK_EVERY = int(os.environ.get('WORKER_MEMORY_CHECK_EVERY', 100))
+GRACEFUL_TIMEOUT = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+WORKER_TIMEOUT = int(os.environ.get('WORKER_TIMEOUT', 60))
+KEEPALIVE = int(os.environ.get('KEEPALIVE', 5))
+SERVER_LOG_LEVEL = os.environ.get('SERVER_LOG_LEVEL', 'info')
+
+# set in forked workers, a single process server must not signal itself to exit
+supervised = False
+
+
+def pool_share(budget: int, workers: int, ratio: float = DB_POOL_RATIO) -> tuple:
+    """
+    split a global connection budget into (pool_size, max_overflow) of one worker
+    """
+    share = max(budget // max(workers, 1), 1)
+    pool_size = min(max(int(share * ratio), 1), share)
+    return pool_size, share - pool_size
+
+
+def rss_mb() -> float:
+    """
+    resident memory of this process, peak memory where /proc is not available
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class MemoryLimitMiddleware:
+    """
+    ask the master for a replacement once the worker grows past WORKER_MAX_MEMORY_MB,
+    SIGTERM lets uvicorn finish in-flight requests before the worker exits
+    """
+
+    def __init__(self, app, max_mb: float = WORKER_MAX_MEMORY_MB, every: int = WORKER_MEMORY_CHECK_EVERY):
+        self.app = app
+        self.max_mb = max_mb
+        self.every = max(every, 1)
+        self.requests = 0
+        self.recycling = False
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] != "http" or not self.max_mb or not supervised or self.recycling:
+            return
+        self.requests += 1
+        if self.requests % self.every:
+            return
+        used = rss_mb()
+        if used > self.max_mb:
+            self.recycling = True
+            log.warning("worker %s uses %.0f MB, over %.0f MB, recycling", os.getpid(), used, self.max_mb)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+
+def post_fork(server, worker):
+    global supervised
+    import business
+    supervised = True
+    if DB_CONNECTION_BUDGET:
+        pool_size, max_overflow = pool_share(DB_CONNECTION_BUDGET, server.cfg.workers)
+        business.configure_pool(pool_size, max_overflow)
+    log.info("worker %s started, db pool %s+%s", worker.pid, business.DB_POOL_SIZE, business.DB_MAX_OVERFLOW)
+
+
+def worker_exit(server, worker):
+    # the app shutdown event already disposed the pool, this covers workers killed on timeout
+    import business
+    business.dispose_engine()
+    log.info("worker %s exited", worker.pid)
+
+
+def options() -> dict:
+    return {
+        "bind": f"{HOST}:{PORT}",
+        "workers": WORKERS,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "max_requests": WORKER_MAX_REQUESTS,
+        "max_requests_jitter": WORKER_MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": WORKER_TIMEOUT,
+        "keepalive": KEEPALIVE,
+        "loglevel": SERVER_LOG_LEVEL,
+        "post_fork": post_fork,
+        "worker_exit": worker_exit,
+    }
+
+
+def run(app=None):
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options().items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if app is not None:
+                return app
+            from api import app as loaded
+            return loaded
+
+    if DB_CONNECTION_BUDGET:
+        pool_size, max_overflow = pool_share(DB_CONNECTION_BUDGET, WORKERS)
+        log.info("%s workers, db pool of %s+%s each, budget %s", WORKERS, pool_size, max_overflow, DB_CONNECTION_BUDGET)
+    Server().run()
+
+
+if __name__ == "__main__":
+    # hooks must live in core.server, not in __main__, for workers to see `supervised`
+    from core import server
+    server.run()
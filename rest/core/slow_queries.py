@@ -0,0 +1,197 @@
+"""
+ring buffer of statements slower than SLOW_QUERY_MS, with their normalized sql, the shape of
+their parameters (never the values), duration and the request that ran them. a sample of slow
+SELECT statements is explained in the background when SLOW_QUERY_EXPLAIN is on. explains run with
+the session variables of the user that ran the statement and are rolled back, SLOW_QUERY_EXPLAIN_ANALYZE
+runs the statement again to time it, never for statements locking rows
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from core import policies
+from core.logger import log
+from core.metrics import current_request
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 200))
+SLOW_QUERY_BUFFER = int(os.environ.get('SLOW_QUERY_BUFFER', 200))
+SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN', 'false').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE', 0.1))
+SLOW_QUERY_EXPLAIN_ANALYZE = os.environ.get('SLOW_QUERY_EXPLAIN_ANALYZE', 'false').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_DUMP_DIR = os.environ.get('SLOW_QUERY_DUMP_DIR', '/tmp')
+
+# set by JSONQ, together with the request it tells what ran a statement. a callable is
+# only called when a statement turns out slow
+current_origin: ContextVar = ContextVar('slow_queries_origin', default=None)
+
+entries = deque(maxlen=SLOW_QUERY_BUFFER)
+_lock = threading.Lock()
+_explainer = None
+_explaining = set()
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s|\?|(?<![:\w]):\w+')
+_LIST = re.compile(r'\?(?:\s*,\s*\?)+')
+_LOCKING = re.compile(r'\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b', re.IGNORECASE)
+
+
+def normalize(statement: str) -> str:
+    """
+    one line sql with literals and placeholders as ?, lists of any length look the same
+    """
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _STRING.sub('?', statement)
+    statement = _PLACEHOLDER.sub('?', statement)
+    statement = _NUMBER.sub('?', statement)
+    return _LIST.sub('?, ...', statement)
+
+
+def shape(value):
+    """
+    type names in place of values, so filters and parameters can be logged without their data
+    """
+    if isinstance(value, dict):
+        return {key: shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if len(value) > 3:
+            return [shape(value[0]), f"... {len(value)} items"]
+        return [shape(item) for item in value]
+    return type(value).__name__
+
+
+@contextmanager
+def origin(label):
+    token = current_origin.set(label)
+    try:
+        yield
+    finally:
+        current_origin.reset(token)
+
+
+def _origin():
+    label = current_origin.get()
+    try:
+        return label() if callable(label) else label
+    except Exception as e:
+        log.debug(e)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('slow_queries_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('slow_queries_started')
+    if not started:
+        return
+    elapsed_ms = (time.perf_counter() - started.pop()) * 1000
+    if elapsed_ms < SLOW_QUERY_MS:
+        return
+    entry = {
+        "at": datetime.utcnow().isoformat(),
+        "duration_ms": round(elapsed_ms, 2),
+        "sql": normalize(statement),
+        "params": shape(parameters[0] if executemany and parameters else parameters),
+        "rows": len(parameters) if executemany else 1,
+        "request": current_request.get(),
+        "origin": _origin(),
+        "explain": None,
+    }
+    with _lock:
+        entries.append(entry)
+    log.warning("slow query %.0f ms <%s> %s", elapsed_ms, entry["request"], entry["sql"][:200])
+    if SLOW_QUERY_EXPLAIN and entry["sql"].upper().startswith("SELECT") and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE:
+        from core.depends import current_user_uuid, current_user_roles
+        _explain_later(conn.engine, entry, statement, parameters, (current_user_uuid(), current_user_roles()))
+
+
+def explain_prefix(statement: str) -> str:
+    """
+    EXPLAIN ANALYZE, understood by postgres and cockroachdb, only when enabled and the statement locks no rows
+    """
+    if SLOW_QUERY_EXPLAIN_ANALYZE and not _LOCKING.search(statement):
+        return "EXPLAIN ANALYZE "
+    return "EXPLAIN "
+
+
+def _explain_later(engine, entry: dict, statement: str, parameters, user: tuple = (None, ())):
+    global _explainer
+    # one explain at a time per statement shape
+    with _lock:
+        if entry["sql"] in _explaining:
+            return
+        _explaining.add(entry["sql"])
+        if _explainer is None:
+            _explainer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="explain")
+    _explainer.submit(_explain, engine, entry, statement, parameters, user)
+
+
+def _explain(engine, entry: dict, statement: str, parameters, user: tuple = (None, ())):
+    try:
+        connection = engine.raw_connection()
+        try:
+            cursor = connection.cursor()
+            if engine.dialect.name in policies.SESSION_VARIABLE_DIALECTS:
+                # the explain shares the transaction of these, the rollback below ends both
+                for variable in policies.session_variables(*user, local=True):
+                    cursor.execute(variable)
+            cursor.execute(explain_prefix(statement) + statement, parameters)
+            entry["explain"] = "\n".join(" ".join(str(column) for column in row) for row in cursor.fetchall())
+            connection.rollback()
+        finally:
+            connection.close()
+    except Exception as e:
+        entry["explain"] = f"explain failed: {e}"
+        log.debug(e)
+    finally:
+        with _lock:
+            _explaining.discard(entry["sql"])
+
+
+def slowest(limit: int = 50) -> list:
+    with _lock:
+        return sorted(entries, key=lambda entry: entry["duration_ms"], reverse=True)[:limit]
+
+
+def summary() -> list:
+    """
+    buffered statements grouped by normalized sql, slowest total first
+    """
+    groups = {}
+    with _lock:
+        for entry in entries:
+            group = groups.setdefault(entry["sql"], {"sql": entry["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            group["count"] += 1
+            group["total_ms"] = round(group["total_ms"] + entry["duration_ms"], 2)
+            group["max_ms"] = max(group["max_ms"], entry["duration_ms"])
+    return sorted(groups.values(), key=lambda group: group["total_ms"], reverse=True)
+
+
+def clear():
+    with _lock:
+        entries.clear()
+
+
+def dump(path: str = None) -> str:
+    """
+    write the buffer as json, to a timestamped file in SLOW_QUERY_DUMP_DIR by default
+    """
+    path = path or os.path.join(SLOW_QUERY_DUMP_DIR, f"slow-queries-{os.getpid()}-{int(time.time())}.json")
+    with open(path, "w") as f:
+        json.dump({"threshold_ms": SLOW_QUERY_MS, "summary": summary(), "entries": slowest(len(entries))}, f, indent=2)
+    return path
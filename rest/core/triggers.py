@@ -0,0 +1,143 @@
+import importlib
+import os
+import pkgutil
+
+from core import metrics
+from core.logger import log
+
+DATA_YAML = os.environ.get('DATA_YAML')
+# next to the app as copied into the image, then the spec at the root of the repository
+_SEARCH_PATHS = [
+    os.path.join(os.path.dirname(__file__), '..', 'data.yaml'),
+    os.path.join(os.path.dirname(__file__), '..', '..', 'data.yaml'),
+]
+
+EVENTS = ("pre_create", "post_create", "pre_update", "post_update", "pre_delete", "post_delete")
+
+
+class Action:
+    """
+    an actions/<name>.py module, `handler` gets one row and the optional `batch_handler`
+    gets every row of a bulk call at once
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        module = importlib.import_module(f"actions.{name}")
+        self.handler = module.handler
+        self.batch_handler = getattr(module, "batch_handler", None)
+
+
+_registry = None
+
+
+def _data_yaml_path():
+    if DATA_YAML:
+        return DATA_YAML
+    for path in _SEARCH_PATHS:
+        if os.path.exists(path):
+            return path
+
+
+def action_modules() -> list:
+    import actions
+    return [module.name for module in pkgutil.iter_modules(actions.__path__)]
+
+
+def check():
+    """
+    raise when data.yaml, which wires actions to entities, can not be found although DATA_YAML
+    names it or actions/ holds actions: their triggers would silently never run
+    """
+    path = _data_yaml_path()
+    if path and os.path.exists(path):
+        return
+    modules = action_modules()
+    if DATA_YAML or modules:
+        raise RuntimeError(f"data.yaml not found at <{path}>, set DATA_YAML; triggers of actions {modules} would never run")
+
+
+def data_yaml(path: str = None) -> dict:
+    """
+    the parsed data.yaml, empty when there is none
+    """
+    import yaml
+    path = path or _data_yaml_path()
+    if not path:
+        log.error("data.yaml not found, set DATA_YAML to enable triggers and rollups")
+        return {}
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def load(path: str = None) -> dict:
+    """
+    build {plural: {event: [Action]}} out of the `triggers` section of every entity in data.yaml
+    """
+    registry = {}
+    data = data_yaml(path)
+    for name, entity in data.items():
+        entity = entity or {}
+        triggers = entity.get("triggers") or {}
+        plural = entity.get("plural", f"{name}s")
+        for event, actions in triggers.items():
+            if event not in EVENTS:
+                log.error("unknown trigger event <%s> on <%s>", event, plural)
+                continue
+            registry.setdefault(plural, {})[event] = [Action(action) for action in actions or []]
+    return registry
+
+
+def registry() -> dict:
+    global _registry
+    if _registry is None:
+        _registry = load()
+    return _registry
+
+
+def actions(entity: str, event: str) -> list:
+    return registry().get(entity, {}).get(event, [])
+
+
+def has(entity: str, event: str) -> bool:
+    return bool(actions(entity, event))
+
+
+def _call(handler, signal_data: dict, event: str, **data):
+    with metrics.timed("action", f"{handler.__module__.rsplit('.', 1)[-1]}.{handler.__name__}"):
+        return handler(
+            jwt=signal_data.get("jwt"),
+            well_known_urls=signal_data.get("well_known_urls", {}),
+            method=event.split("_", 1)[1],
+            runtime=signal_data.get("runtime"),
+            **data
+        )
+
+
+def run(entity: str, event: str, signal_data: dict):
+    """
+    run the actions of one row, pre_create/pre_update actions may return a new payload
+    and pre_delete actions may return False to cancel the delete
+    """
+    new_data = signal_data.get("new_data")
+    for action in actions(entity, event):
+        returned = _call(action.handler, signal_data, event, new_data=new_data, old_data=signal_data.get("old_data", {}))
+        if event == "pre_delete" and returned is False:
+            return False
+        if event in ("pre_create", "pre_update") and isinstance(returned, dict):
+            new_data = returned
+    return True if event == "pre_delete" else new_data
+
+
+def run_batch(entity: str, event: str, signal_data: dict):
+    """
+    run the actions of a bulk call, actions without a batch_handler are called once per row
+    """
+    new_rows = signal_data.get("new_rows", [])
+    old_rows = signal_data.get("old_rows") or [{} for _ in new_rows]
+    for action in actions(entity, event):
+        if action.batch_handler:
+            _call(action.batch_handler, signal_data, event, new_rows=new_rows, old_rows=old_rows)
+            continue
+        for new_data, old_data in zip(new_rows, old_rows):
+            _call(action.handler, signal_data, event, new_data=new_data, old_data=old_data)
@@ -1,7 +1,6 @@
 import uuid
-from datetime import datetime
 
-from sqlalchemy import Column, Text, String, DATETIME
+from sqlalchemy import func, Column, Text, String, DATETIME
 from business import Base
 
 
@@ -11,5 +10,5 @@ class UserModel(Base):
 
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     email = Column(Text, nullable=False)
-    created_on = Column(DATETIME, default=datetime.now())
-    updated_on = Column(DATETIME, default=datetime.now(), onupdate=datetime.now())
+    created_on = Column(DATETIME, default=func.now(), server_default=func.now())
+    updated_on = Column(DATETIME, default=func.now(), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,145 @@
+import asyncio
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Query as QueryParam
+from fastapi.responses import FileResponse, PlainTextResponse
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from business.registry import get_entity
+from core import slow_queries, profiling, loop_monitor, bulk_import, rollups
+from core.depends import Protect, get_db
+from core.logger import log
+
+router = APIRouter()
+ADMIN = ["admin"]
+
+
+@router.get('/slow-queries', tags=["admin"])
+async def list_slow_queries(limit: int = 50, token: str = Depends(Protect)):
+    """ Slowest buffered statements of this worker, with their explain output when captured"""
+    token.auth(ADMIN)
+    return {
+        "threshold_ms": slow_queries.SLOW_QUERY_MS,
+        "data": slow_queries.slowest(limit),
+    }
+
+
+@router.get('/slow-queries/summary', tags=["admin"])
+async def slow_queries_summary(token: str = Depends(Protect)):
+    """ Buffered statements grouped by normalized sql"""
+    token.auth(ADMIN)
+    return {"data": slow_queries.summary()}
+
+
+@router.post('/slow-queries/dump', tags=["admin"], status_code=201)
+async def dump_slow_queries(token: str = Depends(Protect)):
+    """ Write the buffer of this worker to a json file under SLOW_QUERY_DUMP_DIR"""
+    token.auth(ADMIN)
+    try:
+        return {"path": slow_queries.dump()}
+    except OSError as e:
+        log.debug(e)
+        raise HTTPException(500, "could not write slow queries dump")
+
+
+@router.delete('/slow-queries', tags=["admin"], status_code=204)
+async def clear_slow_queries(token: str = Depends(Protect)):
+    """ Empty the buffer of this worker"""
+    token.auth(ADMIN)
+    slow_queries.clear()
+
+
+@router.get('/profiles', tags=["admin"])
+async def list_profiles(token: str = Depends(Protect)):
+    """ Request profiles stored by this worker, newest first"""
+    token.auth(ADMIN)
+    return {"data": profiling.profiles()}
+
+
+@router.get('/profiles/{profile_id}', tags=["admin"], response_class=PlainTextResponse)
+async def get_profile(profile_id: str, token: str = Depends(Protect)):
+    """ Call tree of a stored request profile, sorted by cumulative time"""
+    token.auth(ADMIN)
+    path = profiling.profile_file(profile_id)
+    if not path:
+        raise HTTPException(404, {"field_name": "profile_id", "message": f"<{profile_id}> profile not found"})
+    with open(path) as f:
+        return f.read()
+
+
+@router.get('/profiles/{profile_id}/download', tags=["admin"])
+async def download_profile(profile_id: str, token: str = Depends(Protect)):
+    """ Stored request profile in the pstats format, e.g. for snakeviz or flameprof"""
+    token.auth(ADMIN)
+    path = profiling.profile_file(profile_id, "prof")
+    if not path:
+        raise HTTPException(404, {"field_name": "profile_id", "message": f"<{profile_id}> profile not found"})
+    return FileResponse(path, filename=f"{profile_id}.prof")
+
+
+@router.post('/profiles/stacks/dump', tags=["admin"], status_code=201)
+async def dump_sampled_stacks(token: str = Depends(Protect)):
+    """ Write the stacks sampled so far without waiting for the next periodic dump"""
+    token.auth(ADMIN)
+    if not profiling.sampler.running:
+        raise HTTPException(409, "stack sampler is not running")
+    return {"path": profiling.sampler.dump()}
+
+
+@router.get('/loop-blocking', tags=["admin"])
+async def loop_blocking(limit: int = 20, token: str = Depends(Protect)):
+    """ Routes and code locations that blocked the event loop of this worker, with recent stacks"""
+    token.auth(ADMIN)
+    return {
+        "threshold_ms": loop_monitor.LOOP_BLOCK_MS,
+        "top": loop_monitor.monitor.top(limit),
+        "recent": list(loop_monitor.monitor.recent)[-limit:],
+    }
+
+
+@router.post('/import/{entity_name}', tags=["admin"], status_code=201)
+async def import_rows(request: Request, entity_name: str,
+                      fmt: str = QueryParam("csv", alias="format", regex="^(csv|ndjson)$"),
+                      mode: str = QueryParam("insert", regex="^(insert|upsert)$"),
+                      db: Session = Depends(get_db), token: str = Depends(Protect)):
+    """ Load a csv (with header) or NDJSON body through COPY, upsert mode replaces rows with a known id"""
+    token.auth(ADMIN)
+    entity = get_entity(entity_name)
+    if not entity:
+        raise HTTPException(404, {"field_name": "entity_name", "message": f"<{entity_name}> entity not found"})
+    if not bulk_import.supported(db):
+        raise HTTPException(409, f"COPY import needs one of {', '.join(bulk_import.COPY_DIALECTS)}")
+    job = bulk_import.Import(entity, db, fmt, mode)
+    # run_in_threadpool copies the context, the job writes as the admin under row level policies
+    result = asyncio.ensure_future(run_in_threadpool(job.run))
+    try:
+        async for chunk in request.stream():
+            if chunk and not await run_in_threadpool(job.upload.put, chunk):
+                break
+    finally:
+        await run_in_threadpool(job.upload.put, None)
+    return await result
+
+
+@router.get('/imports/{import_id}/rejects', tags=["admin"])
+async def import_rejects(import_id: str, token: str = Depends(Protect)):
+    """ Rows of an import that failed validation, one json object with line, record and errors per line"""
+    token.auth(ADMIN)
+    path = bulk_import.rejects_file(import_id)
+    if not path:
+        raise HTTPException(404, {"field_name": "import_id", "message": f"<{import_id}> has no rejects"})
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{import_id}.rejects.ndjson")
+
+
+@router.post('/rollups/{entity_name}/rebuild', tags=["admin"])
+def rebuild_rollups(entity_name: str, db: Session = Depends(get_db), token: str = Depends(Protect)):
+    """ Count the rollups of an entity again from its table, after declaring a rollup on existing rows"""
+    token.auth(ADMIN)
+    entity = get_entity(entity_name)
+    if not entity:
+        raise HTTPException(404, {"field_name": "entity_name", "message": f"<{entity_name}> entity not found"})
+    model = entity.model
+    model.objects(db)
+    rollups.rebuild(db, model)
+    db.commit()
+    return {"entity": entity_name, "rollups": [rollup.name for rollup in rollups.active(db, model)]}
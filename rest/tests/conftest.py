@@ -0,0 +1,59 @@
+"""
+the api on the sqlite stand-in of bench.app, or on TEST_DATABASE_URL when given, with zeauth
+answered by bench.fake_zeauth. tests of postgres only features are skipped on sqlite
+"""
+import os
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+
+
+@pytest.fixture(scope="session")
+def zeauth():
+    from bench import fake_zeauth
+    from core import depends
+    server = fake_zeauth.serve()
+    depends.zeauth_url = server.url
+    yield server
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def engine(tmp_path_factory):
+    import core.logger  # noqa: F401, configures logging before business is imported
+    import business
+    from bench.app import sqlite_engine
+    from sqlalchemy import create_engine
+    if TEST_DATABASE_URL:
+        engine = create_engine(TEST_DATABASE_URL)
+    else:
+        engine = sqlite_engine(str(tmp_path_factory.mktemp("db")))
+    business.set_engine(engine)
+    import api  # noqa: F401, declares every model
+    business.Base.metadata.create_all(engine)
+    return engine
+
+
+@pytest.fixture(scope="session")
+def client(engine, zeauth):
+    import api
+    from fastapi.testclient import TestClient
+    client = TestClient(api.app)
+    client.headers["Authorization"] = "Bearer test"
+    return client
+
+
+@pytest.fixture
+def db(engine):
+    import business
+    db = business.db_session()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def postgres(engine):
+    if engine.dialect.name not in ("postgresql", "cockroachdb"):
+        pytest.skip("needs TEST_DATABASE_URL of a postgres or cockroachdb database")
+    return engine
@@ -0,0 +1,55 @@
+import pytest
+from fastapi import HTTPException
+
+from core import action_runtime
+from core.action_runtime import ActionRuntime
+from core.depends import user_permissions
+
+
+@pytest.fixture
+def permissions():
+    token = user_permissions.set(["manager"])
+    yield
+    user_permissions.reset(token)
+
+
+def test_local_writes_share_the_callers_transaction(db, permissions):
+    from business.players_model import PlayerModel
+    runtime = ActionRuntime(db)
+    player = runtime.create("players", {"name": "in transaction", "position": "staff"})
+    assert db.query(PlayerModel).filter_by(id=player.id).count() == 1
+    db.rollback()
+    assert db.query(PlayerModel).filter_by(name="in transaction").count() == 0
+
+
+def test_local_calls_check_permissions_and_payloads(db, permissions):
+    runtime = ActionRuntime(db)
+    with pytest.raises(HTTPException) as denied:
+        runtime.create("teams", {"name": "denied", "location": "l", "short_name": "d"})
+    assert denied.value.status_code == 403
+    with pytest.raises(HTTPException) as invalid:
+        runtime.create("players", {"name": "invalid", "position": "nowhere"})
+    assert invalid.value.status_code == 422
+
+
+def test_get_many_keeps_the_order_given(db, permissions):
+    runtime = ActionRuntime(db)
+    players = runtime.create_many("players", [{"name": f"ordered {i}", "position": "staff"} for i in range(3)])
+    ids = [player.id for player in reversed(players)]
+    assert [player.id for player in runtime.get_many("players", ids)] == ids
+    db.rollback()
+
+
+def test_remote_writes_wait_for_the_commit(db, monkeypatch):
+    calls = []
+    monkeypatch.setattr(action_runtime, "ACTION_RUNTIME", "http")
+    monkeypatch.setattr(action_runtime.requests, "request", lambda method, url, **kwargs: calls.append((method, url, kwargs)))
+    runtime = ActionRuntime(db, "token", {"self": "http://api/"})
+    runtime.create("players", {"name": "remote"})
+    assert calls == []
+    runtime.run_deferred()
+    [(method, url, kwargs)] = calls
+    assert (method, url, kwargs["json"]) == ("POST", "http://api/players/", {"name": "remote"})
+    assert kwargs["headers"]["Authorization"] == "Bearer token"
+    runtime.run_deferred()
+    assert len(calls) == 1
@@ -0,0 +1,61 @@
+import time
+
+from core import bulk_delete
+from tests.test_rollups import assert_matches_rebuild
+
+
+def create(client, location: str, count: int) -> list:
+    rows = [{"name": f"{location} {i}", "location": location, "type": "open", "capacity": i} for i in range(count)]
+    return [row["id"] for row in client.post("/stadiums/add-stadiums", json=rows).json()]
+
+
+def finished(client, job: dict) -> dict:
+    deadline = time.monotonic() + 10
+    while job["status"] in ("pending", "running") and time.monotonic() < deadline:
+        time.sleep(0.02)
+        job = client.get(f"/stadiums/delete-jobs/{job['id']}").json()
+    return job
+
+
+def remaining(db, location: str) -> int:
+    from business.stadiums_model import StadiumModel
+    db.expire_all()
+    return db.query(StadiumModel).filter_by(location=location).count()
+
+
+def test_small_id_sets_are_deleted_in_the_request(client, db):
+    from business.stadiums_model import StadiumModel
+    ids = create(client, "delete ids", 3)
+    response = client.post("/stadiums/delete", json={"ids": ids[:2] + ids[:1]})
+    assert response.status_code == 200
+    assert response.json() == {"deleted": 2, "job": None}
+    assert remaining(db, "delete ids") == 1
+    assert_matches_rebuild(db, StadiumModel)
+
+
+def test_large_id_sets_continue_in_a_job(client, db, monkeypatch):
+    monkeypatch.setattr(bulk_delete, "DELETE_JOB_THRESHOLD", 2)
+    ids = create(client, "delete job", 3)
+    response = client.post("/stadiums/delete", json={"ids": ids})
+    assert response.status_code == 202
+    assert response.json()["deleted"] == 0
+    job = finished(client, response.json()["job"])
+    assert (job["status"], job["total"], job["deleted"]) == ("done", 3, 3)
+    assert remaining(db, "delete job") == 0
+
+
+def test_filters_delete_in_a_job(client, db):
+    from business.stadiums_model import StadiumModel
+    create(client, "delete filter", 4)
+    response = client.post("/stadiums/delete", json={"filter": {"location": "delete filter", "capacity": {"$gte": 2}}})
+    assert response.status_code == 202
+    job = finished(client, response.json()["job"])
+    assert (job["status"], job["total"], job["deleted"]) == ("done", None, 2)
+    assert remaining(db, "delete filter") == 2
+    assert_matches_rebuild(db, StadiumModel)
+
+
+def test_malformed_deletes_are_rejected(client):
+    assert client.post("/stadiums/delete", json={}).status_code == 422
+    assert client.post("/stadiums/delete", json={"filter": {"missing": 1}}).status_code == 422
+    assert client.get("/stadiums/delete-jobs/unknown").status_code == 404
@@ -0,0 +1,52 @@
+import pytest
+
+from core import changes
+
+
+@pytest.fixture
+def settled(monkeypatch):
+    # every write is old enough to be in the feed
+    monkeypatch.setattr(changes, "CHANGES_SETTLE_SECONDS", -1)
+
+
+def feed(client, since: str = None, limit: int = 1000) -> list:
+    result, cursor = [], since
+    while True:
+        page = client.get("/stadiums/changes", params={"limit": limit, **({"since": cursor} if cursor else {})}).json()
+        result += page["data"]
+        cursor = page["next"]
+        if not page["has_more"]:
+            return result
+
+
+def create_stadiums(client, count: int) -> list:
+    response = client.post("/stadiums/add-stadiums", json=[{"name": f"c{i}", "location": "l"} for i in range(count)])
+    assert response.status_code == 201
+    return [row["id"] for row in response.json()]
+
+
+def test_feed_pages_through_creates_updates_and_deletes(client, settled):
+    ids = create_stadiums(client, 4)
+    assert client.put("/stadiums/stadium_id", params={"stadium_id": ids[0]}, json={"name": "z", "location": "l"}).status_code == 201
+    assert client.delete("/stadiums/stadium_id", params={"stadium_id": ids[1]}).status_code == 204
+    assert client.post("/stadiums/delete", json={"ids": ids[2:]}).status_code == 200
+
+    ops = {change["id"]: change["op"] for change in feed(client, limit=2) if change["id"] in ids}
+    assert ops == {ids[0]: "update", ids[1]: "delete", ids[2]: "delete", ids[3]: "delete"}
+
+    end = client.get("/stadiums/changes", params={"limit": 1000}).json()["next"]
+    assert feed(client, since=end) == []
+    assert client.get("/stadiums/changes", params={"since": "xx"}).status_code == 400
+
+
+def test_deletes_work_without_the_tombstones_table(client, engine, settled, monkeypatch):
+    changes.TombstoneModel.__table__.drop(engine)
+    monkeypatch.setattr(changes, "_tombstones", None)
+    ids = create_stadiums(client, 2)
+    assert client.delete("/stadiums/stadium_id", params={"stadium_id": ids[0]}).status_code == 204
+    assert [change["op"] for change in feed(client) if change["id"] in ids] == ["create"]
+
+    changes.create_tables()
+    assert changes._tombstones is True
+    assert client.delete("/stadiums/stadium_id", params={"stadium_id": ids[1]}).status_code == 204
+    assert [change["op"] for change in feed(client) if change["id"] in ids] == ["delete"]
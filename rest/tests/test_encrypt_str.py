@@ -0,0 +1,73 @@
+import base64
+
+import pytest
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from core import encryptStr
+from core.encryptStr import EncryptStr, PendingEncryption
+
+
+class Secret(BaseModel):
+    value: EncryptStr
+
+
+def key(byte: bytes) -> str:
+    return base64.urlsafe_b64encode(byte * 32).decode()
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    def configure(entries: str, version: str = None):
+        monkeypatch.setattr(encryptStr, "FIELD_ENCRYPTION_KEYS", entries)
+        monkeypatch.setattr(encryptStr, "FIELD_ENCRYPTION_KEY_VERSION", version)
+        monkeypatch.setattr(encryptStr, "_keys", None)
+    monkeypatch.setattr(encryptStr, "ENCRYPTION_BACKEND", "local")
+    return configure
+
+
+def test_local_values_round_trip_across_key_rotation(keys):
+    keys(f"v1:{key(b'a')}")
+    old = Secret(value="s3cret").value
+    assert old.startswith("v1$") and "s3cret" not in old
+    assert Secret(value="s3cret").value != old
+
+    keys(f"v1:{key(b'a')},v2:{key(b'b')}")
+    new = Secret(value="s3cret").value
+    assert new.startswith("v2$")
+    assert encryptStr.local_decrypt(old) == encryptStr.local_decrypt(new) == "s3cret"
+
+
+def test_tampered_or_unkeyed_values_are_rejected(keys):
+    keys(f"v1:{key(b'a')}")
+    token = encryptStr.local_encrypt("s3cret")
+    with pytest.raises(Exception):
+        encryptStr.local_decrypt("v1$" + base64.urlsafe_b64encode(b"\0" * 40).decode())
+    with pytest.raises(Exception):
+        encryptStr.local_decrypt(token.replace("v1$", "v2$"))
+    keys("")
+    with pytest.raises(ValueError):
+        Secret(value="s3cret")
+
+
+def test_batched_values_are_encrypted_in_one_call(monkeypatch):
+    calls = []
+    monkeypatch.setattr(encryptStr, "ENCRYPTION_BACKEND", "remote_batch")
+    monkeypatch.setattr(encryptStr, "remote_encrypt_many", lambda values: calls.append(values) or [f"enc:{v}" for v in values])
+    rows = [{"value": Secret(value=f"s{i}").value, "nested": {"list": [Secret(value="n").value]}} for i in range(3)]
+    assert isinstance(rows[0]["value"], PendingEncryption) and "s0" not in repr(rows[0]["value"])
+    encryptStr.resolve_pending(*rows)
+    assert calls == [["s0", "n", "s1", "n", "s2", "n"]]
+    assert [row["value"] for row in rows] == ["enc:s0", "enc:s1", "enc:s2"]
+    assert rows[0]["nested"] == {"list": ["enc:n"]}
+
+
+def test_batched_encryption_failures_refuse_the_write(monkeypatch):
+    def unavailable(values):
+        raise ConnectionError()
+    monkeypatch.setattr(encryptStr, "remote_encrypt_many", unavailable)
+    row = {"value": PendingEncryption("s")}
+    with pytest.raises(HTTPException) as failed:
+        encryptStr.resolve_pending(row)
+    assert failed.value.status_code == 503
+    assert isinstance(row["value"], PendingEncryption)
@@ -0,0 +1,50 @@
+import pytest
+
+
+@pytest.fixture
+def team(client):
+    response = client.post("/teams/", json={"name": "Blues", "location": "x", "short_name": "B"})
+    assert response.status_code == 201
+    return response.json()
+
+
+def revalidate(client, url: str, etag: str, **params) -> int:
+    return client.get(url, params=params, headers={"If-None-Match": etag}).status_code
+
+
+def test_get_answers_304_until_the_row_changes(client, team):
+    response = client.get("/teams/team_id", params={"team_id": team["id"]})
+    assert response.status_code == 200
+    etag = response.headers["etag"]
+    assert etag.startswith('W/"')
+    assert revalidate(client, "/teams/team_id", etag, team_id=team["id"]) == 304
+    assert revalidate(client, "/teams/team_id", "*", team_id=team["id"]) == 304
+
+    response = client.put("/teams/team_id", params={"team_id": team["id"]},
+                          json={"name": "Greens", "location": "x", "short_name": "G"})
+    assert response.status_code == 201
+    assert revalidate(client, "/teams/team_id", etag, team_id=team["id"]) == 200
+
+
+def test_list_answers_304_until_a_row_is_added(client, team):
+    response = client.get("/teams/")
+    etag = response.headers["etag"]
+    assert revalidate(client, "/teams/", etag) == 304
+    assert revalidate(client, "/teams/", etag, page=2) == 200
+
+    client.post("/teams/", json={"name": "Whites", "location": "x", "short_name": "W"})
+    assert revalidate(client, "/teams/", etag) == 200
+
+
+def test_embedded_relations_are_part_of_the_etag(client, team):
+    team_etag = client.get("/teams/team_id", params={"team_id": team["id"]}).headers["etag"]
+    list_etag = client.get("/teams/").headers["etag"]
+
+    response = client.post("/players/", json={"name": "Pat", "team": team["id"], "position": "goalkeeper", "is_active": True})
+    assert response.status_code == 201
+    assert revalidate(client, "/teams/team_id", team_etag, team_id=team["id"]) == 200
+    assert revalidate(client, "/teams/", list_etag) == 200
+
+    players_etag = client.get("/players/").headers["etag"]
+    client.put("/teams/team_id", params={"team_id": team["id"]}, json={"name": "Navy", "location": "x", "short_name": "N"})
+    assert revalidate(client, "/players/", players_etag) == 200
@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+from sqlalchemy import text
+
+from core import events, policies
+
+
+def deliver(changes: list, users: list) -> dict:
+    """
+    publish `changes` on a fresh broker with one subscriber per user, events each user received
+    """
+    async def run():
+        broker = events.Broker()
+        subscribers = {user: broker.subscribe("stadiums", user=user) for user in users}
+        for change in changes:
+            broker.publish(change)
+        # a last event every user sees, events are checked in order
+        broker.publish({"entity": "stadiums", "op": "delete", "id": "last", "at": 0})
+        deadline = time.monotonic() + 10
+        while any(all(item["id"] != "last" for item in subscriber.queue._queue) for subscriber in subscribers.values()):
+            assert time.monotonic() < deadline
+            await asyncio.sleep(0.01)
+        return {
+            user: [(item["op"], item["id"], "data" in item) for item in subscriber.queue._queue if item["id"] != "last"]
+            for user, subscriber in subscribers.items()
+        }
+
+    return asyncio.run(run())
+
+
+def test_events_reach_every_subscriber_without_row_security(engine):
+    change = {"entity": "stadiums", "op": "create", "id": "1", "at": 0, "data": {"id": "1"}}
+    assert deliver([change], ["a", "b"]) == {"a": [("create", "1", True)], "b": [("create", "1", True)]}
+
+
+def test_events_reach_subscribers_allowed_to_read_the_row(engine, monkeypatch):
+    monkeypatch.setitem(policies._row_security, "stadiums", True)
+    monkeypatch.setattr(events, "readable", lambda db, table, row_id, user, roles: user == "a")
+    changes = [
+        {"entity": "stadiums", "op": "create", "id": "1", "at": 0, "data": {"id": "1"}},
+        {"entity": "stadiums", "op": "delete", "id": "2", "at": 0, "data": {"id": "2"}},
+    ]
+    assert deliver(changes, ["a", "b"]) == {
+        "a": [("create", "1", True), ("delete", "2", False)],
+        "b": [("delete", "2", False)],
+    }
+
+
+def test_row_level_policies_decide_who_gets_events(client, zeauth, postgres, monkeypatch):
+    owner = client.post("/stadiums/", json={"name": "owned", "location": "l"}, headers={"Authorization": "Bearer a"})
+    assert owner.status_code == 201
+    row = owner.json()
+    with postgres.begin() as connection:
+        connection.execute(text("ALTER TABLE public.stadiums ENABLE ROW LEVEL SECURITY"))
+        connection.execute(text("ALTER TABLE public.stadiums FORCE ROW LEVEL SECURITY"))
+        connection.execute(text(
+            "CREATE POLICY test_owner ON public.stadiums USING (created_by = current_setting('zekoder.id', true))"
+        ))
+    monkeypatch.delitem(policies._row_security, "stadiums", raising=False)
+    try:
+        change = {"entity": "stadiums", "op": "update", "id": row["id"], "at": 0, "data": row}
+        a, b = zeauth.users["a"], zeauth.users.get("b") or zeauth.user("b")["id"]
+        assert deliver([change], [a, b]) == {a: [("update", row["id"], True)], b: []}
+    finally:
+        with postgres.begin() as connection:
+            connection.execute(text("DROP POLICY test_owner ON public.stadiums"))
+            connection.execute(text("ALTER TABLE public.stadiums NO FORCE ROW LEVEL SECURITY"))
+            connection.execute(text("ALTER TABLE public.stadiums DISABLE ROW LEVEL SECURITY"))
+        policies._row_security.pop("stadiums", None)
@@ -0,0 +1,43 @@
+import asyncio
+import csv
+import io
+import json
+
+from core.export import Export
+
+
+def test_ndjson_exports_follow_the_query(client):
+    for capacity in (3, 1, 2):
+        client.post("/stadiums/", json={"name": f"export {capacity}", "location": "export", "type": "open", "capacity": capacity})
+    q = {"filter": {"location": "export"}, "project": ["name", "type", "capacity"], "sort": ["capacity-"]}
+    response = client.post("/stadiums/export", json=q)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    assert response.headers["content-disposition"] == 'attachment; filename="stadiums.ndjson"'
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {"name": f"export {capacity}", "type": "open", "capacity": capacity} for capacity in (3, 2, 1)
+    ]
+
+
+def test_csv_exports_have_a_header_and_json_cells(client):
+    client.post("/stadiums/", json={"name": "csv", "location": "export csv", "family": {"a": [1]}})
+    q = {"filter": {"location": "export csv"}, "project": ["name", "family"]}
+    response = client.post("/stadiums/export", params={"format": "csv"}, json=q)
+    assert list(csv.reader(io.StringIO(response.text))) == [["name", "family"], ["csv", '{"a": [1]}']]
+
+
+def test_invalid_queries_fail_before_streaming(client):
+    assert client.post("/stadiums/export", json={"filter": {"missing": 1}}).status_code in (400, 422)
+    assert client.post("/stadiums/export", params={"format": "xml"}).status_code == 422
+
+
+def test_rows_are_fetched_in_batches(client, db):
+    from business.stadiums_model import StadiumModel
+    client.post("/stadiums/add-stadiums", json=[{"name": f"batch {i}", "location": "export batches"} for i in range(5)])
+    exporter = Export(db, StadiumModel, fetch_size=2)
+    exporter._query = db.query(StadiumModel).filter_by(location="export batches").order_by(StadiumModel.name)
+
+    async def blocks():
+        return [block async for block in exporter.stream()]
+
+    assert [block.count(b"\n") for block in asyncio.run(blocks())] == [2, 2, 1]
@@ -0,0 +1,88 @@
+import csv
+import io
+import json
+import uuid
+
+import pytest
+
+from core import bulk_import, rollups
+from core.depends import current_user_uuid, current_user_permissions
+
+
+def test_import_job_runs_as_the_admin(client, zeauth, monkeypatch):
+    monkeypatch.setattr(bulk_import, "supported", lambda db: True)
+    monkeypatch.setattr(bulk_import.Import, "run", lambda self: {
+        "job_user": self.user, "user": current_user_uuid(), "permissions": current_user_permissions()
+    })
+    response = client.post("/admin/import/stadiums", data="name,location\na,b\n")
+    assert response.status_code == 201
+    admin = zeauth.users["test"]
+    assert response.json() == {"job_user": admin, "user": admin, "permissions": zeauth.permissions}
+
+
+def test_imported_rows_are_written_as_the_admin(client, zeauth, postgres, db, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    session_users = []
+    rebuild = rollups.rebuild
+
+    def rebuild_and_read_session_user(job_db, model):
+        session_users.append(job_db.execute("SELECT current_setting('zekoder.id')").scalar())
+        rebuild(job_db, model)
+
+    monkeypatch.setattr(rollups, "rebuild", rebuild_and_read_session_user)
+    response = client.post("/admin/import/stadiums", data="name,location,capacity\nimported,b,10\n")
+    assert response.status_code == 201
+    assert response.json()["written"] == 1
+    admin = zeauth.users["test"]
+    assert session_users == [admin]
+    row = db.query(StadiumModel).filter_by(name="imported").one()
+    assert (str(row.created_by), str(row.updated_by)) == (admin, admin)
+
+
+def staged(job, *chunks) -> list:
+    for chunk in chunks:
+        job.upload.put(chunk)
+    job.upload.put(None)
+    return list(csv.reader(io.StringIO(b"".join(job._blocks()).decode())))
+
+
+def test_csv_uploads_are_staged_and_invalid_rows_rejected(db, client, tmp_path, monkeypatch):
+    from business.registry import get_entity
+    monkeypatch.setattr(bulk_import, "IMPORT_DIR", str(tmp_path))
+    job = bulk_import.Import(get_entity("stadiums"), db, "csv", batch=1)
+    rows = staged(
+        job,
+        b'\xef\xbb\xbfname,location,type,capacity,family\nfirst,l,open,3,"{""a"": [1]}"\n',
+        b"second,,,many,\nthird,l,,,,extra\n\"quoted \"\"name\"\"\",l,,,\n",
+    )
+    columns = ["_line"] + [column.name for column in job.columns]
+    staged_rows = [dict(zip(columns, row)) for row in rows]
+    assert [(row["_line"], row["name"], row["type"], row["family"]) for row in staged_rows] == [
+        ("2", "first", "open", '{"a": [1]}'),
+        ("5", 'quoted "name"', "", ""),
+    ]
+    assert job.counts == {"lines": 4, "staged": 2, "rejected": 2, "written": 0}
+    job._rejects.close()
+    rejects = [json.loads(line) for line in open(bulk_import.rejects_file(job.id))]
+    assert [(reject["line"], reject["errors"][0]["field_name"]) for reject in rejects] == [(3, "capacity"), (4, None)]
+
+    response = client.get(f"/admin/imports/{job.id}/rejects")
+    assert response.status_code == 200 and len(response.text.splitlines()) == 2
+    assert client.get("/admin/imports/not-an-id/rejects").status_code == 404
+
+
+def test_ndjson_uploads_keep_given_ids_and_fill_defaults(db):
+    from business.registry import get_entity
+    given = str(uuid.uuid4())
+    job = bulk_import.Import(get_entity("players"), db, "ndjson")
+    body = json.dumps({"id": given, "name": "kept", "position": "staff"}) + "\n\n" + json.dumps({"name": "new", "position": "staff"})
+    rows = [dict(zip(["_line"] + [column.name for column in job.columns], row)) for row in staged(job, body.encode())]
+    assert [row["_line"] for row in rows] == ["1", "3"]
+    assert rows[0]["id"] == given and uuid.UUID(rows[1]["id"])
+    assert rows[0]["is_active"] == "True"
+
+
+def test_imports_need_copy(client, db):
+    if bulk_import.supported(db):
+        pytest.skip("COPY is available")
+    assert client.post("/admin/import/stadiums", data="name\na\n").status_code == 409
@@ -0,0 +1,56 @@
+import json
+
+from core import ingest
+from core.ingest import Ingestion
+
+
+def results(response) -> list:
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_each_line_gets_a_result_and_valid_rows_are_committed(client, db):
+    from business.stadiums_model import StadiumModel
+    client.post("/stadiums/", json={"name": "taken", "location": "ingest"})
+    body = "\n".join([
+        json.dumps({"name": "first", "location": "ingest", "capacity": 1}),
+        "{not json",
+        "",
+        json.dumps({"name": "typed", "location": "ingest", "capacity": "many"}),
+        json.dumps({"name": "taken", "location": "ingest"}),
+        json.dumps({"name": "last", "location": "ingest"}),
+    ])
+    response = client.post("/stadiums/ingest", data=body, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    *lines, summary = results(response)
+    assert [line["index"] for line in lines] == [0, 1, 2, 3, 4]
+    assert [bool(line.get("id")) for line in lines] == [True, False, False, False, True]
+    assert lines[1]["errors"][0]["message"].startswith("invalid json")
+    assert lines[2]["errors"][0]["field_name"] == "capacity"
+    assert lines[3]["errors"] == [{"field_name": "name_location", "message": "name_location should be unique"}]
+    assert summary == {"summary": {"lines": 5, "created": 2, "failed": 3, "committed": 2}}
+    db.expire_all()
+    assert {row.name for row in db.query(StadiumModel).filter_by(location="ingest")} == {"taken", "first", "last"}
+
+
+def test_rows_are_committed_as_chunks_fill(db):
+    from business.registry import get_entity
+    from business.stadiums_model import StadiumModel
+    ingestion = Ingestion(get_entity("stadiums"), db, {}, chunk_size=2, commit_rows=2)
+    chunk = [(index, *ingestion.parse(json.dumps({"name": f"chunked {index}", "location": "chunks"}).encode()))
+             for index in range(2)]
+    assert [obj_id is not None for _, obj_id, _ in ingestion.write(chunk)] == [True, True]
+    assert ingestion.counts["committed"] == 2
+    db.rollback()
+    assert db.query(StadiumModel).filter_by(location="chunks").count() == 2
+
+
+def test_overlong_lines_abort_the_upload(client, monkeypatch):
+    async def short_lines(request, max_bytes=16):
+        async for line in lines(request, max_bytes):
+            yield line
+    lines = ingest.lines
+    monkeypatch.setattr(ingest, "lines", short_lines)
+    body = json.dumps({"name": "fits", "location": "l"})[:10] + "\n" + "x" * 64
+    *_, error, summary = results(client.post("/stadiums/ingest", data=body))
+    assert "longer than 16 bytes" in error["errors"][0]["message"]
+    assert summary["summary"]["aborted"] is True
@@ -0,0 +1,48 @@
+import uuid
+
+from core import loader
+from tests.test_upsert import statements
+
+
+def selects(engine, run):
+    result, seen = statements(engine, run)
+    return result, seen.count("SELECT")
+
+
+def players_of_teams(client, teams: int, per_team: int) -> str:
+    location = f"loader {uuid.uuid4()}"
+    for t in range(teams):
+        team = client.post("/teams/", json={"name": f"team {t}", "location": location, "short_name": "t"}).json()
+        client.post("/players/add-players", json=[
+            {"name": f"player {t}.{p}", "position": "defense", "team": team["id"]} for p in range(per_team)
+        ])
+    return location
+
+
+def test_listing_rows_loads_their_relations_together(client, engine):
+    counts = []
+    for teams in (1, 4):
+        location = players_of_teams(client, teams, 2)
+        _, count = selects(engine, lambda: client.post("/teams/q", json={"filter": {"location": location}}))
+        counts.append(count)
+        response, count = selects(engine, lambda: client.get("/players/", params={"size": 100}))
+        assert all(player["team__details"] for player in response.json()["data"] if player["name"].startswith("player"))
+        counts.append(count)
+    assert counts[0:2] == counts[2:4]
+
+
+def test_ids_are_fetched_in_batches_and_cached(db, engine, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    monkeypatch.setattr(loader, "LOADER_BATCH", 2)
+    rows = [StadiumModel(name=f"loader {i}", location="loader") for i in range(5)]
+    db.add_all(rows)
+    db.flush()
+    ids = [str(row.id) for row in rows] + [str(uuid.uuid4())]
+    db.expunge_all()
+    cache = loader.of(db)
+    found, count = selects(engine, lambda: cache.load_many(StadiumModel, list(reversed(ids))))
+    assert count == 3
+    assert [row and str(row.id) for row in found] == [None] + list(reversed(ids[:-1]))
+    _, count = selects(engine, lambda: [cache.load(StadiumModel, obj_id) for obj_id in ids])
+    assert count == 0
+    db.rollback()
@@ -0,0 +1,28 @@
+import asyncio
+import time
+
+import pytest
+
+from core import loop_monitor
+
+
+def test_blocking_calls_are_located_and_fail_strict_runs(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(loop_monitor, "sampled", lambda logger, level, msg, *args: warnings.append(args))
+
+    async def run(monitor):
+        monitor.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.3)
+        await asyncio.sleep(0.05)
+        await monitor.stop()
+
+    monitor = loop_monitor.LoopMonitor(interval=0.01, block_ms=100, strict=True)
+    asyncio.run(run(monitor))
+    [offender] = monitor.top()
+    assert offender["location"].startswith("tests/test_loop_monitor.py:")
+    assert offender["location"].endswith(" run")
+    assert [args[2] for args in warnings] == [offender["location"]]
+    with pytest.raises(loop_monitor.BlockingDetected):
+        monitor.check()
+    monitor.check()
@@ -0,0 +1,76 @@
+import asyncio
+import time
+
+import pytest
+
+from bench import fake_zenotify
+from core import notification, outbox
+
+
+@pytest.fixture
+def zenotify(monkeypatch):
+    server = fake_zenotify.serve()
+    monkeypatch.setattr(notification, "ZENOTIFY_BASE_URL", server.url)
+    monkeypatch.setattr(notification, "ZENOTIFY_SERVICE_BASE_URL", server.url)
+    yield server
+    server.shutdown()
+
+
+def dispatch(items: list, **kwargs) -> dict:
+    """
+    queue `items` on a fresh dispatcher and wait until all of them are delivered or failed
+    """
+    async def run():
+        dispatcher = notification.NotificationDispatcher(**kwargs)
+        dispatcher.start()
+        for recipients, template, data in items:
+            assert dispatcher.notify(recipients, template, data)
+        deadline = time.monotonic() + 10
+        while dispatcher.stats["sent"] + dispatcher.stats["failed"] < len(items) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        return dispatcher.metrics()
+
+    return asyncio.run(run())
+
+
+def test_dispatcher_batches_notifications_sharing_template_and_data(zenotify):
+    items = [([f"user{i}@example.com"], "welcome", {"team": "reds"}) for i in range(5)]
+    items.append((["user0@example.com"], "welcome", {"team": "blues"}))
+    stats = dispatch(items, concurrency=1, batch_window=0.2)
+    assert stats["sent"] == 6
+    assert stats["batches"] == 1
+    assert stats["create_calls"] == zenotify.create_calls == 2
+    recipients = sorted(len(body["recipients"]) for body in zenotify.notifications.values())
+    assert recipients == [1, 5]
+    assert len(zenotify.sent) == 2
+
+
+def test_dispatcher_counts_failed_create_calls(zenotify):
+    zenotify.fail_rate = 1
+    stats = dispatch([(["user@example.com"], "welcome", {})], concurrency=1, batch_window=0)
+    assert stats["failed"] == 1
+    assert stats["sent"] == 0
+    assert zenotify.sent == []
+
+
+def test_outbox_retries_failed_notifications(zenotify, db, monkeypatch):
+    monkeypatch.setattr(outbox, "backoff", lambda attempts: 0)
+    db.query(outbox.OutboxModel).delete()
+    event = notification.queue_notification(db, ["user@example.com"], "welcome", {"team": "reds"})
+    db.commit()
+    event_id = event.id
+
+    zenotify.fail_rate = 1
+    assert outbox.drain_once() == 1
+    db.expire_all()
+    event = db.query(outbox.OutboxModel).get(event_id)
+    assert (event.status, event.attempts) == (outbox.PENDING, 1)
+    assert zenotify.sent == []
+
+    zenotify.fail_rate = 0
+    assert outbox.drain_once() == 1
+    db.expire_all()
+    event = db.query(outbox.OutboxModel).get(event_id)
+    assert (event.status, event.attempts) == (outbox.DONE, 2)
+    assert len(zenotify.sent) == 1
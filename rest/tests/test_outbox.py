@@ -0,0 +1,87 @@
+import logging
+
+from core import outbox, triggers
+from core.action_runtime import ActionRuntime
+
+
+def test_queued_hooks_keep_the_user_instead_of_the_token(client, zeauth, db, monkeypatch):
+    from business.players_model import PlayerModel
+    monkeypatch.setattr(outbox, "OUTBOX_ENABLED", True)
+    monkeypatch.setattr(outbox, "OUTBOX_SERVICE_TOKEN", "service")
+    db.query(outbox.OutboxModel).delete()
+    db.commit()
+    response = client.post("/teams/", json={"name": "queued", "location": "l", "short_name": "q"},
+                           headers={"Authorization": "Bearer user-token"})
+    assert response.status_code == 201
+    team = response.json()
+    event = db.query(outbox.OutboxModel).filter_by(topic="hook").one()
+    assert "jwt" not in event.payload["signal_data"]
+    assert "user-token" not in str(event.payload)
+    assert event.payload["user"]["id"] == zeauth.users["user-token"]
+    assert db.query(PlayerModel).filter_by(team=team["id"]).count() == 0
+
+    tokens = []
+    run_deferred = ActionRuntime.run_deferred
+    monkeypatch.setattr(ActionRuntime, "run_deferred", lambda self: tokens.append(self.jwt) or run_deferred(self))
+    assert outbox.drain_once() == 1
+    db.expire_all()
+    assert db.query(outbox.OutboxModel).get(event.id).status == outbox.DONE
+    assert db.query(PlayerModel).filter_by(team=team["id"]).count() == 1
+    assert tokens == ["service"]
+
+
+def test_events_failing_every_attempt_are_dead_lettered(db, monkeypatch):
+    monkeypatch.setattr(outbox, "backoff", lambda attempts: 0)
+    monkeypatch.setattr(outbox, "OUTBOX_MAX_ATTEMPTS", 2)
+    monkeypatch.setitem(outbox.TOPICS, "broken", "core.outbox.missing_handler")
+    db.query(outbox.OutboxModel).delete()
+    event = outbox.enqueue(db, "broken", {})
+    db.commit()
+
+    assert outbox.drain_once() == 1
+    db.expire_all()
+    assert (event.status, event.attempts) == (outbox.PENDING, 1)
+    assert outbox.drain_once() == 1
+    db.expire_all()
+    assert (event.status, event.attempts) == (outbox.DEAD, 2)
+    assert "missing_handler" in event.last_error
+    assert outbox.drain_once() == 0
+    assert outbox.metrics(db)["dead_letter"] == 1
+
+    assert outbox.requeue_dead(db) == 1
+    db.expire_all()
+    assert (event.status, event.attempts) == (outbox.PENDING, 0)
+    db.delete(event)
+    db.commit()
+
+
+def test_delayed_events_wait_for_their_backoff(db, monkeypatch):
+    monkeypatch.setitem(outbox.TOPICS, "broken", "core.outbox.missing_handler")
+    db.query(outbox.OutboxModel).delete()
+    event = outbox.enqueue(db, "broken", {})
+    db.commit()
+    assert outbox.drain_once() == 1
+    assert outbox.drain_once() == 0
+    db.expire_all()
+    assert event.available_on > event.created_on
+    db.delete(event)
+    db.commit()
+
+
+def failing_post_create(run):
+    def wrapper(entity, event, *args):
+        if event == "post_create":
+            raise ZeroDivisionError(entity)
+        return run(entity, event, *args)
+    return wrapper
+
+
+def test_failing_hooks_are_logged_with_their_traceback(client, caplog, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_ENABLED", False)
+    for name in ("run", "run_batch"):
+        monkeypatch.setattr(triggers, name, failing_post_create(getattr(triggers, name)))
+    with caplog.at_level(logging.ERROR):
+        response = client.post("/teams/", json={"name": "failing", "location": "l", "short_name": "f"})
+    assert response.status_code == 201
+    failures = [record for record in caplog.records if record.levelno == logging.ERROR and record.exc_info]
+    assert failures and failures[0].exc_info[0] is ZeroDivisionError
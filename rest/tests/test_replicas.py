@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from core import replicas
+import business  # after core, which business imports back
+
+
+@pytest.fixture
+def replica(engine, tmp_path):
+    from bench.app import sqlite_engine
+    if engine.dialect.name != "sqlite":
+        pytest.skip("the replica stand-in is a second sqlite database")
+    replica = sqlite_engine(str(tmp_path))
+    business.Base.metadata.create_all(replica)
+    business.set_replicas([replica])
+    yield replica
+    business.set_replicas([])
+    replica.dispose()
+
+
+def names(response) -> set:
+    return {row["name"] for row in response.json()["data"]}
+
+
+def test_reads_go_to_the_replica_unless_the_client_just_wrote(client, replica):
+    created = client.post("/stadiums/", json={"name": "on the primary", "location": "replicas"})
+    stamp = created.headers[replicas.LAST_WRITE_HEADER]
+    assert abs(float(stamp) - time.time()) < 5
+    client.cookies.clear()
+
+    assert "on the primary" not in names(client.get("/stadiums/", params={"size": 1000}))
+    fresh = client.get("/stadiums/", params={"size": 1000}, headers={replicas.LAST_WRITE_HEADER: stamp})
+    assert "on the primary" in names(fresh)
+    stale = {replicas.LAST_WRITE_HEADER: str(time.time() - replicas.DB_REPLICA_STICKY_SECONDS - 1)}
+    assert "on the primary" not in names(client.get("/stadiums/", params={"size": 1000}, headers=stale))
+
+
+def test_unhealthy_replicas_are_skipped(client, replica):
+    client.post("/stadiums/", json={"name": "while unhealthy", "location": "replicas"})
+    client.cookies.clear()
+    business.set_replica_health(replica, False)
+    assert "while unhealthy" in names(client.get("/stadiums/", params={"size": 1000}))
+    replicas.health.check_all()
+    assert "while unhealthy" not in names(client.get("/stadiums/", params={"size": 1000}))
+
+
+def test_sticky_cookies_and_malformed_stamps():
+    class Request:
+        def __init__(self, headers=None, cookies=None):
+            self.headers, self.cookies = headers or {}, cookies or {}
+
+    assert replicas.sticky(Request(cookies={replicas.DB_STICKY_COOKIE: str(time.time())}))
+    assert not replicas.sticky(Request(headers={replicas.LAST_WRITE_HEADER: "soon"}))
+    assert not replicas.sticky(Request())
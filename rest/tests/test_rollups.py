@@ -0,0 +1,136 @@
+import pytest
+from sqlalchemy import text
+
+from core import policies, rollups
+from core.query import JSONQ, QuerySchema
+
+
+def stored(db, model) -> dict:
+    return {
+        rollup.name: sorted(tuple(row) for row in db.execute(rollup.table.select().order_by(rollup.table.c.key)))
+        for rollup in rollups.of(model)
+    }
+
+
+def assert_matches_rebuild(db, model):
+    db.expire_all()
+    before = stored(db, model)
+    rollups.rebuild(db, model)
+    assert stored(db, model) == before
+    db.rollback()
+
+
+def test_rollups_follow_writes(client, db):
+    from business.stadiums_model import StadiumModel
+    ids = []
+    for i, (kind, capacity) in enumerate([("open", 10), ("covered", None), (None, 30), ("open", 40)]):
+        response = client.post("/stadiums/", json={"name": f"s{i}", "location": "l", "type": kind, "capacity": capacity})
+        assert response.status_code == 201
+        ids.append(response.json()["id"])
+    response = client.post("/stadiums/add-stadiums", json=[
+        {"name": f"m{i}", "location": "l", "type": "open", "capacity": i} for i in range(5)
+    ])
+    assert response.status_code == 201
+    ids += [row["id"] for row in response.json()]
+    assert_matches_rebuild(db, StadiumModel)
+
+    response = client.put("/stadiums/stadium_id", params={"stadium_id": ids[0]},
+                          json={"name": "s0", "location": "l", "type": "covered", "capacity": -5})
+    assert response.status_code == 201
+    assert_matches_rebuild(db, StadiumModel)
+
+    assert client.delete("/stadiums/stadium_id", params={"stadium_id": ids[3]}).status_code == 204
+    assert client.post("/stadiums/delete", json={"ids": ids[4:7]}).status_code == 200
+    assert_matches_rebuild(db, StadiumModel)
+
+
+def test_rollups_follow_rows_created_by_triggers(client, db):
+    from business.players_model import PlayerModel
+    response = client.post("/teams/", json={"name": "Reds", "location": "x", "short_name": "R"})
+    assert response.status_code == 201
+    # the post_create trigger of teams adds a player through the action runtime
+    assert db.query(PlayerModel).filter_by(team=response.json()["id"]).count() == 1
+    assert_matches_rebuild(db, PlayerModel)
+
+
+def test_aggregates_from_rollup_match_the_entity_table(client, db, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    for i in range(3):
+        client.post("/stadiums/", json={"name": f"a{i}", "location": "l", "type": "open", "capacity": i})
+
+    def aggregates():
+        query = QuerySchema(aggregate={
+            "t": "type", "n": {"$sum": 1}, "c": {"$sum": "capacity"}, "hi": {"$max": "capacity"}, "group": ["type"]
+        })
+        return sorted(map(tuple, JSONQ(db, StadiumModel).query(query, ["type", "capacity"])["aggregates"]), key=str)
+
+    assert JSONQ(db, StadiumModel)._from_rollup({"n": {"$sum": 1}}, [], None) is not None
+    from_rollup = aggregates()
+    monkeypatch.setitem(rollups._rollups, StadiumModel.__tablename__, [])
+    assert aggregates() == from_rollup
+
+
+def test_rollups_skip_tables_with_row_level_security(engine, db, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    monkeypatch.setitem(policies._row_security, StadiumModel.__tablename__, True)
+    rollup = rollups.of(StadiumModel)[0]
+    jq = JSONQ(db, StadiumModel)
+    assert jq._from_rollup({"n": {"$sum": 1}}, [], None) is None
+    monkeypatch.setattr(rollup, "public", True)
+    assert rollups.active(db, StadiumModel) == []
+    with pytest.raises(RuntimeError):
+        with policies.unrestricted(db, StadiumModel.__table__):
+            pass
+    monkeypatch.setattr(policies, "ROW_SECURITY_BYPASS_ROLE", "bypass")
+    assert rollups.active(db, StadiumModel) == [rollup]
+    assert jq._from_rollup({"n": {"$sum": 1}}, [], None) is not None
+
+
+def test_public_rollups_count_rows_hidden_from_the_writer(client, db, zeauth, postgres, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    client.post("/stadiums/", json={"name": "hidden", "location": "l", "capacity": 5}, headers={"Authorization": "Bearer a"})
+    rollup = rollups.of(StadiumModel)[0]
+    with postgres.begin() as connection:
+        connection.execute(text("CREATE ROLE test_bypass BYPASSRLS"))
+        connection.execute(text("GRANT ALL ON ALL TABLES IN SCHEMA public TO test_bypass"))
+        connection.execute(text("GRANT test_bypass TO CURRENT_USER"))
+        connection.execute(text("ALTER TABLE public.stadiums ENABLE ROW LEVEL SECURITY"))
+        connection.execute(text("ALTER TABLE public.stadiums FORCE ROW LEVEL SECURITY"))
+        connection.execute(text(
+            "CREATE POLICY test_owner ON public.stadiums USING (created_by = current_setting('zekoder.id', true))"
+        ))
+    monkeypatch.delitem(policies._row_security, "stadiums", raising=False)
+    monkeypatch.setattr(policies, "ROW_SECURITY_BYPASS_ROLE", "test_bypass")
+    monkeypatch.setattr(rollup, "public", True)
+    try:
+        policies.set_user(db, zeauth.user("b")["id"], [], local=True)
+        rollup.rebuild(db)
+        assert db.execute(text("SELECT current_user")).scalar() != "test_bypass"
+        stored_count = sum(row["row_count"] for row in db.execute(rollup.table.select()))
+        db.rollback()
+        with postgres.connect() as connection:
+            assert stored_count == connection.execute(text("SELECT count(*) FROM public.stadiums")).scalar()
+    finally:
+        db.rollback()
+        with postgres.begin() as connection:
+            connection.execute(text("DROP POLICY test_owner ON public.stadiums"))
+            connection.execute(text("ALTER TABLE public.stadiums NO FORCE ROW LEVEL SECURITY"))
+            connection.execute(text("ALTER TABLE public.stadiums DISABLE ROW LEVEL SECURITY"))
+            connection.execute(text("REVOKE ALL ON ALL TABLES IN SCHEMA public FROM test_bypass"))
+            connection.execute(text("DROP ROLE test_bypass"))
+        policies._row_security.pop("stadiums", None)
+
+
+def test_missing_rollup_tables_are_created_and_counted(client, db, engine, monkeypatch):
+    from business.stadiums_model import StadiumModel
+    rollup = rollups.of(StadiumModel)[0]
+    rollup.table.drop(engine)
+    monkeypatch.setattr(rollup, "exists", None)
+    response = client.post("/stadiums/", json={"name": "while off", "location": "l", "type": "open", "capacity": 3})
+    assert response.status_code == 201
+    assert rollup.exists is False
+    assert JSONQ(db, StadiumModel)._from_rollup({"n": {"$sum": 1}}, [], None) is None
+
+    rollups.create_tables()
+    assert rollup.exists is True
+    assert_matches_rebuild(db, StadiumModel)
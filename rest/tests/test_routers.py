@@ -0,0 +1,45 @@
+import pytest
+
+from core import triggers
+from business.registry import ENTITIES
+
+
+def routes(plural: str) -> set:
+    import api
+    prefix = f"/{plural}"
+    return {
+        (method, route.path[len(prefix):], route.status_code)
+        for route in api.app.routes if route.path.startswith(f"{prefix}/")
+        for method in getattr(route, "methods", ())
+    }
+
+
+@pytest.mark.parametrize("plural,single", [(e.name, e.single) for e in ENTITIES.values()])
+def test_entity_routers_keep_the_generated_routes(engine, plural, single):
+    assert routes(plural) >= {
+        ("GET", "/", 200),
+        ("GET", f"/{single}_id", None),
+        ("POST", "/q", 200),
+        ("POST", "/", 201),
+        ("POST", f"/add-{plural}", 201),
+        ("POST", f"/upsert-multiple-{plural}", 201),
+        ("PUT", f"/{single}_id", 201),
+        ("DELETE", f"/{single}_id", 204),
+        ("DELETE", f"/delete-{plural}", 204),
+    }
+
+
+def test_registry_permissions_come_from_data_yaml():
+    spec = triggers.data_yaml()
+    assert {entity["plural"]: entity["permissions"] for entity in spec.values()} == {
+        plural: entity.permissions for plural, entity in ENTITIES.items()
+    }
+
+
+def test_routes_check_the_permissions_of_their_entity(client, zeauth, monkeypatch):
+    monkeypatch.setattr(zeauth, "permissions", ["user"])
+    assert client.get("/stadiums/").status_code == 200
+    assert client.post("/stadiums/", json={"name": "no", "location": "l"}).status_code == 403
+    assert client.get("/teams/").status_code == 403
+    monkeypatch.setitem(ENTITIES["stadiums"].permissions, "create", ["user"])
+    assert client.post("/stadiums/", json={"name": "yes", "location": "l"}).status_code == 201
@@ -0,0 +1,33 @@
+from core import slow_queries
+
+
+def test_statements_are_explained_without_running_them_by_default():
+    assert slow_queries.explain_prefix("SELECT * FROM stadiums") == "EXPLAIN "
+
+
+def test_analyze_skips_statements_locking_rows(monkeypatch):
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_EXPLAIN_ANALYZE", True)
+    assert slow_queries.explain_prefix("SELECT * FROM stadiums") == "EXPLAIN ANALYZE "
+    for statement in ("SELECT * FROM outbox FOR UPDATE SKIP LOCKED", "select id from teams for no key update",
+                      "SELECT id FROM players FOR SHARE"):
+        assert slow_queries.explain_prefix(statement) == "EXPLAIN "
+
+
+def test_explain_runs_as_the_user_of_the_statement(postgres, monkeypatch):
+    monkeypatch.setattr(slow_queries, "SLOW_QUERY_EXPLAIN_ANALYZE", True)
+    entry = {"sql": "explain as user"}
+    statement = "SELECT current_setting('zekoder.id') FROM stadiums FOR UPDATE"
+    slow_queries._explain(postgres, entry, statement, {}, ("user-1", ["admin"]))
+    assert entry["explain"].startswith("LockRows")
+    assert "Execution Time" not in entry["explain"]
+    entry = {"sql": "explain as user"}
+    slow_queries._explain(postgres, entry, "SELECT current_setting('zekoder.id')", {}, ("user-1", []))
+    assert "Execution Time" in entry["explain"]
+    with postgres.connect() as connection:
+        assert connection.execute("SELECT current_setting('zekoder.id', true)").scalar() in (None, "")
+
+
+def test_sqlite_statements_are_explained(engine):
+    entry = {"sql": "explain on sqlite"}
+    slow_queries._explain(engine, entry, "SELECT * FROM stadiums WHERE name = ?", ("a",))
+    assert entry["explain"] and not entry["explain"].startswith("explain failed")
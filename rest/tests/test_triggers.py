@@ -0,0 +1,40 @@
+import pytest
+
+from core import triggers
+
+
+def test_spec_at_the_root_of_the_repository_is_found(monkeypatch):
+    monkeypatch.setattr(triggers, "DATA_YAML", None)
+    path = triggers._data_yaml_path()
+    assert path and path.endswith("data.yaml")
+    triggers.check()
+    assert [action.name for action in triggers.load(path)["teams"]["post_create"]] == ["create_player_for_team"]
+
+
+def test_missing_spec_refuses_to_start(monkeypatch, tmp_path):
+    monkeypatch.setattr(triggers, "DATA_YAML", str(tmp_path / "data.yaml"))
+    with pytest.raises(RuntimeError):
+        triggers.check()
+    monkeypatch.setattr(triggers, "DATA_YAML", None)
+    monkeypatch.setattr(triggers, "_SEARCH_PATHS", [str(tmp_path / "data.yaml")])
+    with pytest.raises(RuntimeError):
+        triggers.check()
+
+
+def test_entities_without_triggers_or_a_body_are_skipped(tmp_path):
+    spec = tmp_path / "data.yaml"
+    spec.write_text(
+        "empty:\n"
+        "plain:\n  plural: plains\n"
+        "team:\n  plural: teams\n  triggers:\n    post_create:\n    on_read:\n      - create_player_for_team\n"
+    )
+    assert triggers.load(str(spec)) == {"teams": {"post_create": []}}
+    spec.write_text("")
+    assert triggers.load(str(spec)) == {}
+
+
+def test_team_creation_runs_its_trigger(client, db):
+    from business.players_model import PlayerModel
+    team = client.post("/teams/", json={"name": "triggered", "location": "l", "short_name": "tr"}).json()
+    [player] = db.query(PlayerModel).filter_by(team=team["id"]).all()
+    assert (player.name, player.position.value) == ("triggered", "staff")
@@ -0,0 +1,51 @@
+import uuid
+
+from sqlalchemy import event
+
+
+def statements(engine, run) -> list:
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement.split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = run()
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+    return response, seen
+
+
+def test_updates_matching_the_row_write_nothing(client, engine):
+    body = {"name": "unchanged", "location": "l", "type": "open", "capacity": 5}
+    stadium = client.post("/stadiums/", json=body).json()
+    update = lambda payload: client.put("/stadiums/stadium_id", params={"stadium_id": stadium["id"]}, json=payload)
+
+    response, seen = statements(engine, lambda: update(body))
+    assert response.status_code == 201
+    assert "UPDATE" not in seen
+    assert response.json()["updated_on"] == stadium["updated_on"]
+
+    response, seen = statements(engine, lambda: update({**body, "capacity": 6}))
+    assert "UPDATE" in seen
+    assert response.json()["capacity"] == 6
+
+
+def test_upsert_counts_each_outcome(client):
+    players = client.post("/players/add-players", json=[{"name": f"p{i}", "position": "defense"} for i in range(3)]).json()
+    items = [{"id": player["id"], "name": player["name"], "position": "defense", "is_active": True, "team": None}
+             for player in players]
+    items[0]["name"] = "renamed"
+    response = client.post("/players/upsert-multiple-players", json=items + [{"name": "new", "position": "defense"}])
+    assert response.status_code == 201
+    assert [player["name"] for player in response.json()] == ["renamed", "p1", "p2", "new"]
+    assert {key: value for key, value in response.headers.items() if key.startswith("x-upsert")} == {
+        "x-upsert-created": "1", "x-upsert-changed": "1", "x-upsert-unchanged": "2", "x-upsert-missing": "0",
+    }
+
+    response = client.post("/players/upsert-multiple-players", json=items[1:] + [{"id": str(uuid.uuid4()), "name": "gone"}])
+    assert [player["name"] for player in response.json()] == ["p1", "p2"]
+    assert response.headers["x-upsert-unchanged"] == "2"
+    assert response.headers["x-upsert-missing"] == "1"
+    assert response.headers["x-upsert-changed"] == "0"